@@ -0,0 +1,116 @@
+"""Memory benchmark: compares the LabelIndex with the dict-of-sets label maps it replaced, for a generated fleet.
+
+    python benchmarks/memory_benchmark.py --assets 100000 --labels-per-asset 12
+
+Both sides hold what a run keeps in memory through the sync: the report's labels, the labels the state store says
+were applied, and the due percentages saved for the next run.
+"""
+from pathlib import Path
+from itertools import groupby
+import tracemalloc
+import argparse
+import random
+import json
+import time
+import gc
+import sys
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / 'label_adapter'))
+
+from label_index import LabelIndex
+from state_store import StateStore
+
+LABEL_BASES = ['PM Service and Inspect', 'DOT Annual Inspection', 'Brake Inspection', 'Tire Rotation', 'Reefer Service',
+               'Liftgate Inspection', 'Oil Analysis', 'Coolant Flush', 'Transmission Service', 'Air Dryer Service',
+               'Fuel Filter Change', 'Wheel Seal Inspection', 'Battery Check', 'Door Seal Inspection', 'Axle Alignment',
+               'Kingpin Inspection']
+
+def fresh(value:str) -> str:
+    # A new string object, like every field the CSV reader or sqlite hands back
+    return value.encode().decode()
+
+def fleet_rows(args, applied:bool=False):
+    """(asset identifier, label base, due percent) rows sorted by asset, with new string objects for every field.
+    The applied rows are the last run's, where change_rate of the due percents were one lower."""
+    rng = random.Random(args.seed)
+    changes = random.Random(args.seed + 1)
+    bases = LABEL_BASES[:args.labels_per_asset]
+    for asset in range(args.assets):
+        identifier = str(10000 + asset)
+        for label_base in bases:
+            due_percent = rng.randint(50, 200)
+            if applied and changes.random() < args.change_rate:
+                due_percent -= 1
+            yield fresh(identifier), fresh(label_base), f'{due_percent}%'
+
+def build_legacy(args) -> tuple:
+    """The report map, applied labels and due percentages as dicts of sets and dicts of strings."""
+    new_label_map = {}
+    label_bases_processed = set()
+    due_percents = {}
+    for asset_identifier, label_base, due_percent in fleet_rows(args):
+        new_label_map.setdefault(asset_identifier, set()).add(f'{label_base} - {due_percent}')
+        label_bases_processed.add(label_base)
+        due_percents.setdefault(asset_identifier, {})[label_base] = due_percent
+    applied = {}
+    for asset_identifier, label_base, due_percent in fleet_rows(args, applied=True):
+        applied.setdefault(asset_identifier, set()).add(fresh(f'{label_base} - {due_percent}'))
+    changed = {asset_identifier for asset_identifier in set(new_label_map) | set(applied)
+               if new_label_map.get(asset_identifier, set()) != applied.get(asset_identifier, set())}
+    return (new_label_map, label_bases_processed, due_percents, applied), len(changed)
+
+def build_index(args) -> tuple:
+    """The same data as LabelIndexes sharing one table, loaded the way the adapter loads them."""
+    new_label_map = LabelIndex()
+    label_bases_processed = set()
+    for asset_identifier, rows in groupby(fleet_rows(args), key=lambda row: row[0]):
+        labels = {label_base: due_percent for _, label_base, due_percent in rows}
+        new_label_map.merge(asset_identifier, labels)
+        label_bases_processed.update(labels)
+    due_percents = new_label_map.copy()
+    applied = StateStore.index_rows(fleet_rows(args, applied=True), label_bases_processed, new_label_map.table)
+    changed = {asset_identifier for asset_identifier in new_label_map.records.keys() | applied.records.keys()
+               if new_label_map.record(asset_identifier) != applied.record(asset_identifier)}
+    return (new_label_map, label_bases_processed, due_percents, applied), len(changed)
+
+def measure(build, args) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    structures, changed = build(args)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del structures
+    return {
+        'megabytes': round(current / 2**20, 1),
+        'peak_megabytes': round(peak / 2**20, 1),
+        'bytes_per_asset': round(current / args.assets),
+        'build_seconds': round(elapsed, 3),
+        'assets_changed': changed
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the memory used by LabelIndex and by the dict-of-sets label maps.')
+    parser.add_argument('--assets', type=int, default=100000, help='Fleet size (default: 100000)')
+    parser.add_argument('--labels-per-asset', type=int, default=12, choices=range(1, len(LABEL_BASES) + 1), metavar=f'1-{len(LABEL_BASES)}',
+                        help='Component codes reported per asset (default: 12)')
+    parser.add_argument('--change-rate', type=float, default=0.1, help='Fraction of due percents that changed since the last run (default: 0.1)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated fleet (default: 1)')
+    parser.add_argument('--json', type=Path, default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {'assets': args.assets, 'labels_per_asset': args.labels_per_asset,
+               'dict_of_sets': measure(build_legacy, args), 'label_index': measure(build_index, args)}
+    legacy, index = results['dict_of_sets'], results['label_index']
+    if legacy['assets_changed'] != index['assets_changed']:
+        sys.exit(f"Changed assets differ: {legacy['assets_changed']} with dicts of sets, {index['assets_changed']} with LabelIndex")
+    for name in ('dict_of_sets', 'label_index'):
+        result = results[name]
+        print(f"{name:>13}: {result['megabytes']:8.1f} MB ({result['bytes_per_asset']} bytes/asset), peak {result['peak_megabytes']:.1f} MB, "
+              f"built in {result['build_seconds']:.2f}s")
+    print(f"LabelIndex uses {legacy['megabytes'] / index['megabytes']:.1f}x less memory for {args.assets} assets")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
@@ -0,0 +1,374 @@
+"""Local stand-in for the mailbox Trimble sends reports to, used for testing the IMAP ingestion stage.
+
+Speaks the subset of IMAP4rev1 the adapter uses, over plain TCP. Run it on its own and point the adapter at it:
+
+    python benchmarks/mock_imap_server.py --port 1143 --messages 20 --pdf-size 2000000
+    IMAP_PASSWORD=secret python label_adapter/label_adapter.py in out -t full --imap-server 127.0.0.1 --imap-port 1143 \\
+        --imap-no-ssl --imap-user reports --imap-sender trimble@example.com
+"""
+from email.message import EmailMessage
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+import threading
+import argparse
+import random
+import email
+import time
+import csv
+import io
+import re
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+(?:\[[^\]]*\](?:<[\d.]+>)?)?))')
+SECTION_PATTERN = re.compile(r'^(BODY(?:\.PEEK)?)\[([\d.]*)\]$', re.IGNORECASE)
+
+class MockMessage:
+    __slots__ = ('uid', 'raw', 'message', 'flags')
+
+    def __init__(self, uid:int, raw:bytes):
+        self.uid = uid
+        self.raw = raw
+        self.message = email.message_from_bytes(raw)
+        self.flags = set()
+
+class MockImapState:
+    def __init__(self, user:str='reports', password:str='secret', capabilities=('IMAP4rev1', 'UIDPLUS', 'MOVE')):
+        self.user = user
+        self.password = password
+        self.capabilities = tuple(capabilities)
+        # Reentrant, responses are counted while a MOVE or EXPUNGE holds it
+        self.lock = threading.RLock()
+        # mailbox name (lower case) -> messages, and mailbox name -> [uidvalidity, next uid]
+        self.mailboxes = {'inbox': []}
+        self.uids = {'inbox': [int(time.time()), 1]}
+        self.command_counts = {}
+        self.bytes_sent = 0
+
+    def add_message(self, raw:bytes, mailbox:str='inbox') -> int:
+        with self.lock:
+            return self._append(mailbox.lower(), raw)
+
+    def _append(self, mailbox:str, raw:bytes) -> int:
+        uid = self.uids[mailbox][1]
+        self.uids[mailbox][1] += 1
+        self.mailboxes[mailbox].append(MockMessage(uid, raw))
+        return uid
+
+    def create(self, mailbox:str) -> bool:
+        with self.lock:
+            if mailbox.lower() in self.mailboxes:
+                return False
+            self.mailboxes[mailbox.lower()] = []
+            self.uids[mailbox.lower()] = [int(time.time()), 1]
+            return True
+
+    def count(self, command:str) -> None:
+        with self.lock:
+            self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+    def sent(self, size:int) -> None:
+        with self.lock:
+            self.bytes_sent += size
+
+def build_report_email(sender:str, rows:list, pdf_size:int=0, subject:str='Trimble PM report') -> bytes:
+    """A report email like Trimble's: a short body, the CSV, and optionally a large PDF."""
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = 'reports@example.com'
+    message['Subject'] = subject
+    message.set_content('Scheduled report attached.')
+    report = io.StringIO()
+    csv.writer(report).writerows(rows)
+    message.add_attachment(report.getvalue().encode('utf-8-sig'), maintype='text', subtype='csv', filename='AMS to BBerry Labels.csv')
+    if pdf_size:
+        message.add_attachment(random.randbytes(pdf_size), maintype='application', subtype='pdf', filename='report.pdf')
+    return message.as_bytes()
+
+def quote(value) -> str:
+    if value is None:
+        return 'NIL'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def encoded_body(part) -> bytes:
+    if part.is_multipart():
+        return b''
+    payload = part.get_payload()
+    return payload.encode('utf-8', errors='replace') if isinstance(payload, str) else bytes(payload)
+
+def bodystructure(part) -> str:
+    if part.is_multipart():
+        children = ''.join(bodystructure(child) for child in part.get_payload())
+        return f'({children} {quote(part.get_content_subtype().upper())})'
+    params = [item for key, value in part.get_params()[1:] for item in (quote(key.upper()), quote(value))]
+    body = encoded_body(part)
+    fields = [quote(part.get_content_maintype().upper()), quote(part.get_content_subtype().upper()),
+              f"({' '.join(params)})" if params else 'NIL', 'NIL', 'NIL',
+              quote((part.get('Content-Transfer-Encoding') or '7BIT').upper()), str(len(body))]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(body.count(b'\n')))
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disposition_params = f'({quote("FILENAME")} {quote(filename)})' if filename else 'NIL'
+        fields += ['NIL', f'({quote(disposition.upper())} {disposition_params})', 'NIL', 'NIL']
+    return f"({' '.join(fields)})"
+
+def find_section(message, section:str):
+    part = message
+    for number in (int(value) for value in section.split('.') if value):
+        if not part.is_multipart():
+            return part if number == 1 else None
+        children = part.get_payload()
+        if number > len(children):
+            return None
+        part = children[number - 1]
+    return part
+
+def parse_sequence_set(value:str, highest:int) -> list:
+    ranges = []
+    for item in value.split(','):
+        start, _, end = item.partition(':')
+        start = highest if start == '*' else int(start)
+        end = start if not end else (highest if end == '*' else int(end))
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+def in_sequence_set(uid:int, ranges:list) -> bool:
+    return any(start <= uid <= end for start, end in ranges)
+
+def tokenize(line:str) -> list:
+    tokens = []
+    for opening, closing, quoted, atom in TOKEN_PATTERN.findall(line):
+        if opening:
+            tokens.append('(')
+        elif closing:
+            tokens.append(')')
+        elif atom:
+            tokens.append(atom)
+        else:
+            tokens.append(re.sub(r'\\(.)', r'\1', quoted))
+    return tokens
+
+class MockImapHandler(StreamRequestHandler):
+    state = None
+
+    def send(self, data) -> None:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.wfile.write(data)
+        self.state.sent(len(data))
+
+    def handle(self):
+        self.selected = None
+        self.send(f"* OK [CAPABILITY {' '.join(self.state.capabilities)}] Mock IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode('utf-8', errors='replace').rstrip('\r\n').partition(' ')
+            command, _, arguments = rest.partition(' ')
+            command = command.upper()
+            uid = command == 'UID'
+            if uid:
+                command, _, arguments = arguments.partition(' ')
+                command = command.upper()
+            self.state.count(f"{'UID ' if uid else ''}{command}")
+            handler = getattr(self, f'do_{command}', None)
+            try:
+                if handler is None:
+                    self.send(f'{tag} BAD Unknown command {command}\r\n')
+                    continue
+                if handler(tag, tokenize(arguments), uid) is False:
+                    return
+            except (ValueError, IndexError, KeyError) as e:
+                self.send(f'{tag} BAD {e}\r\n')
+
+    def messages(self) -> list:
+        return self.state.mailboxes[self.selected]
+
+    def matching(self, sequence:str, uid:bool) -> list:
+        messages = self.messages()
+        if not messages:
+            return []
+        if uid:
+            ranges = parse_sequence_set(sequence, messages[-1].uid)
+            return [(number, message) for number, message in enumerate(messages, 1) if in_sequence_set(message.uid, ranges)]
+        ranges = parse_sequence_set(sequence, len(messages))
+        return [(number, message) for number, message in enumerate(messages, 1) if in_sequence_set(number, ranges)]
+
+    def do_CAPABILITY(self, tag, arguments, uid):
+        self.send(f"* CAPABILITY {' '.join(self.state.capabilities)}\r\n{tag} OK CAPABILITY completed\r\n")
+
+    def do_NOOP(self, tag, arguments, uid):
+        self.send(f'{tag} OK NOOP completed\r\n')
+
+    def do_LOGIN(self, tag, arguments, uid):
+        if arguments[:2] == [self.state.user, self.state.password]:
+            self.send(f'{tag} OK LOGIN completed\r\n')
+        else:
+            self.send(f'{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n')
+
+    def do_LOGOUT(self, tag, arguments, uid):
+        self.send(f'* BYE Logging out\r\n{tag} OK LOGOUT completed\r\n')
+        return False
+
+    def do_SELECT(self, tag, arguments, uid):
+        mailbox = arguments[0].lower()
+        if mailbox not in self.state.mailboxes:
+            self.send(f'{tag} NO Mailbox does not exist\r\n')
+            return
+        self.selected = mailbox
+        uidvalidity, uidnext = self.state.uids[mailbox]
+        self.send(f'* {len(self.messages())} EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY {uidvalidity}] UIDs valid\r\n'
+                  f'* OK [UIDNEXT {uidnext}] Predicted next UID\r\n{tag} OK [READ-WRITE] SELECT completed\r\n')
+
+    do_EXAMINE = do_SELECT
+
+    def do_LIST(self, tag, arguments, uid):
+        for mailbox in self.state.mailboxes:
+            self.send(f'* LIST (\\HasNoChildren) "/" {quote("INBOX" if mailbox == "inbox" else mailbox)}\r\n')
+        self.send(f'{tag} OK LIST completed\r\n')
+
+    def do_CREATE(self, tag, arguments, uid):
+        if self.state.create(arguments[0]):
+            self.send(f'{tag} OK CREATE completed\r\n')
+        else:
+            self.send(f'{tag} NO Mailbox already exists\r\n')
+
+    def do_SEARCH(self, tag, arguments, uid):
+        candidates = list(enumerate(self.messages(), 1))
+        index = 0
+        while index < len(arguments):
+            key = arguments[index].upper()
+            if key == 'UID':
+                candidates = [(n, m) for n, m in self.matching(arguments[index + 1], True) if (n, m) in candidates]
+                index += 2
+            elif key == 'FROM':
+                sender = arguments[index + 1].lower()
+                candidates = [(n, m) for n, m in candidates if sender in str(m.message.get('From', '')).lower()]
+                index += 2
+            else:
+                # ALL, CHARSET and anything else this stand-in doesn't filter on
+                index += 2 if key == 'CHARSET' else 1
+        results = ' '.join(str(m.uid if uid else n) for n, m in candidates)
+        self.send(f"* SEARCH{' ' + results if results else ''}\r\n{tag} OK SEARCH completed\r\n")
+
+    def do_FETCH(self, tag, arguments, uid):
+        items = [item for item in arguments[1:] if item not in ('(', ')')]
+        for number, message in self.matching(arguments[0], uid):
+            parts = [f'UID {message.uid}'] if uid or 'UID' in (item.upper() for item in items) else []
+            literals = []
+            for item in items:
+                name = item.upper()
+                section = SECTION_PATTERN.match(item)
+                if name == 'UID':
+                    continue
+                elif name == 'BODYSTRUCTURE':
+                    parts.append(f'BODYSTRUCTURE {bodystructure(message.message)}')
+                elif name == 'FLAGS':
+                    parts.append(f"FLAGS ({' '.join(sorted(message.flags))})")
+                elif name in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+                    literals.append(('RFC822' if name == 'RFC822' else 'BODY[]', message.raw))
+                elif section:
+                    part = find_section(message.message, section.group(2))
+                    literals.append((f'BODY[{section.group(2)}]', encoded_body(part) if part is not None else b''))
+                    if section.group(1).upper() == 'BODY':
+                        message.flags.add('\\Seen')
+            response = f"* {number} FETCH ({' '.join(parts)}".encode()
+            for name, data in literals:
+                response += f"{' ' if response[-1:] != b'(' else ''}{name} {{{len(data)}}}\r\n".encode() + data
+            self.send(response + b')\r\n')
+        self.send(f'{tag} OK FETCH completed\r\n')
+
+    def do_STORE(self, tag, arguments, uid):
+        flags = [flag for flag in arguments[2:] if flag not in ('(', ')')]
+        for _, message in self.matching(arguments[0], uid):
+            if arguments[1].upper().startswith('-'):
+                message.flags.difference_update(flags)
+            else:
+                message.flags.update(flags)
+        self.send(f'{tag} OK STORE completed\r\n')
+
+    def do_COPY(self, tag, arguments, uid):
+        destination = arguments[1].lower()
+        if destination not in self.state.mailboxes:
+            self.send(f'{tag} NO [TRYCREATE] Mailbox does not exist\r\n')
+            return
+        with self.state.lock:
+            for _, message in self.matching(arguments[0], uid):
+                self.state._append(destination, message.raw)
+        self.send(f'{tag} OK COPY completed\r\n')
+
+    def do_MOVE(self, tag, arguments, uid):
+        if 'MOVE' not in self.state.capabilities:
+            self.send(f'{tag} BAD MOVE not supported\r\n')
+            return
+        destination = arguments[1].lower()
+        if destination not in self.state.mailboxes:
+            self.send(f'{tag} NO [TRYCREATE] Mailbox does not exist\r\n')
+            return
+        with self.state.lock:
+            moved = self.matching(arguments[0], uid)
+            for _, message in moved:
+                self.state._append(destination, message.raw)
+            self.expunge([message for _, message in moved])
+        self.send(f'{tag} OK MOVE completed\r\n')
+
+    def expunge(self, messages:list) -> None:
+        for message in messages:
+            number = self.messages().index(message) + 1
+            self.messages().remove(message)
+            self.send(f'* {number} EXPUNGE\r\n')
+
+    def do_EXPUNGE(self, tag, arguments, uid):
+        messages = [message for _, message in (self.matching(arguments[0], True) if uid else enumerate(self.messages(), 1))]
+        with self.state.lock:
+            self.expunge([message for message in messages if '\\Deleted' in message.flags])
+        self.send(f'{tag} OK EXPUNGE completed\r\n')
+
+class MockImapServer:
+    def __init__(self, state:MockImapState, host:str='127.0.0.1', port:int=0):
+        handler = type('BoundMockImapHandler', (MockImapHandler,), {'state': state})
+        self.state = state
+        ThreadingTCPServer.allow_reuse_address = True
+        self.server = ThreadingTCPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self) -> tuple:
+        return self.server.server_address[:2]
+
+    def start(self) -> 'MockImapServer':
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock-imap', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the IMAP mailbox Trimble reports are sent to.')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=1143, help='Port to listen on (default: 1143)')
+    parser.add_argument('--user', default='reports', help='Login accepted by the server (default: reports)')
+    parser.add_argument('--password', default='secret', help='Password accepted by the server (default: secret)')
+    parser.add_argument('--sender', default='trimble@example.com', help='From address of the seeded report emails (default: trimble@example.com)')
+    parser.add_argument('--messages', type=int, default=5, help='Number of report emails to seed the inbox with (default: 5)')
+    parser.add_argument('--pdf-size', type=int, default=0, help='Size in bytes of a PDF attached next to each CSV, 0 for none (default: 0)')
+    parser.add_argument('--no-move', action='store_true', help='Leave MOVE and UIDPLUS out of the capabilities, to exercise the COPY/STORE/EXPUNGE fallback')
+    args = parser.parse_args()
+
+    capabilities = ('IMAP4rev1',) if args.no_move else ('IMAP4rev1', 'UIDPLUS', 'MOVE')
+    state = MockImapState(args.user, args.password, capabilities)
+    header = ['UNITNUMBER', 'DESCRIPTION', 'DUEPERCENT', 'COMPCODE', 'LASTDONE']
+    for i in range(args.messages):
+        rows = [header] + [[str(10000 + n), 'PM Service and Inspect', f'{random.randint(50, 200)}%', '000-003', '9/25/2024'] for n in range(100)]
+        state.add_message(build_report_email(args.sender, rows, args.pdf_size, f'Trimble PM report {i + 1}'))
+    server = MockImapServer(state, args.host, args.port)
+    print(f'Mock IMAP server with {args.messages} report email(s) on {args.host}:{args.port}')
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
@@ -0,0 +1,247 @@
+"""Local stand-in for the BlackBerry Radar API, used for load testing the label adapter.
+
+Run it on its own and point the adapter at it:
+
+    python benchmarks/mock_radar_server.py --port 8080 --fleet-size 5000 --latency 0.02
+    python label_adapter/label_adapter.py in out --api-url http://127.0.0.1:8080/1 --token-url http://127.0.0.1:8080/1/token
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from uuid import uuid4
+import threading
+import argparse
+import random
+import json
+import time
+
+class MockRadarState:
+    def __init__(self, fleet_size:int, page_size:int=100, latency:float=0.0, error_rate:float=0.0, throttle_rps:float=0.0,
+                 seed_labels:dict=None, first_identifier:int=10000, bulk:bool=False):
+        self.page_size = page_size
+        # Serve POST /labels/batch, otherwise it 404s like a server without one
+        self.bulk = bulk
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+        self.lock = threading.Lock()
+        self.assets = [(f'asset-{i:06d}', str(first_identifier + i)) for i in range(fleet_size)]
+        self.asset_ids = {asset_id for asset_id, _ in self.assets}
+        # asset id -> label name -> label id
+        self.labels = {asset_id: {} for asset_id in self.asset_ids}
+        for asset_id, names in (seed_labels or {}).items():
+            for name in names:
+                self.labels[asset_id][name] = str(uuid4())
+        self.request_counts = {}
+        self.throttled = 0
+        self.errors = 0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    def count(self, endpoint:str) -> None:
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def throttle(self) -> float:
+        """Returns the seconds to put in Retry-After when the request should be throttled, else 0."""
+        if self.throttle_rps <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            if self.window_count > self.throttle_rps:
+                self.throttled += 1
+                return max(0.0, 1.0 - (now - self.window_start))
+        return 0.0
+
+class MockRadarHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, without this delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status:int, body=None, headers:dict=None) -> None:
+        payload = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_json(self):
+        """Returns the JSON object in the request body, None if the body is missing, cut off or not an object."""
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return None
+        return body if isinstance(body, dict) else None
+
+    def route(self, method:str) -> None:
+        body = self.read_json() if method == 'POST' else None
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if parts and parts[0] == '1':
+            parts = parts[1:]
+        state = self.state
+
+        if state.latency:
+            time.sleep(random.uniform(0.5, 1.5) * state.latency)
+
+        if parts == ['token'] and method == 'POST':
+            state.count('token')
+            return self.send_json(200, {'access_token': str(uuid4()), 'expires_in': 3600})
+
+        if not self.headers.get('Authorization', '').startswith('Bearer ') or self.headers['Authorization'] == 'Bearer None':
+            return self.send_json(401, {'error': 'unauthorized'})
+
+        retry_after = state.throttle()
+        if retry_after:
+            return self.send_json(429, {'error': 'too many requests'}, {'Retry-After': f'{retry_after:.2f}'})
+        if state.error_rate and random.random() < state.error_rate:
+            with state.lock:
+                state.errors += 1
+            return self.send_json(503, {'error': 'injected failure'})
+
+        if parts == ['assets'] and method == 'GET':
+            state.count('get_assets')
+            query = parse_qs(url.query)
+            limit = int(query.get('limit', [state.page_size])[0])
+            start = int(query.get('cursor', ['0'])[0])
+            page = state.assets[start:start + limit]
+            res_json = {'items': [{'id': asset_id, 'identifier': identifier} for asset_id, identifier in page]}
+            if start + limit < len(state.assets):
+                res_json['next'] = str(start + limit)
+            return self.send_json(200, res_json)
+
+        if parts == ['labels', 'batch'] and method == 'POST' and state.bulk:
+            state.count('bulk_labels')
+            if body is None:
+                return self.send_json(400, {'error': 'invalid request body'})
+            results = []
+            with state.lock:
+                for item in body.get('assets', []):
+                    asset_id = item.get('asset_id')
+                    operations = item.get('operations', [])
+                    results.append({'asset_id': asset_id, 'results': [self.apply_operation(asset_id, operation) for operation in operations]})
+            return self.send_json(207, {'results': results})
+
+        if len(parts) >= 3 and parts[0] == 'assets' and parts[2] == 'labels':
+            asset_id = parts[1]
+            if asset_id not in state.asset_ids:
+                return self.send_json(404, {'error': 'asset not found'})
+            endpoint = {('GET', 3): 'get_asset_labels', ('POST', 3): 'add_label', ('DELETE', 4): 'delete_label'}.get((method, len(parts)))
+            if endpoint:
+                state.count(endpoint)
+            with state.lock:
+                labels = state.labels[asset_id]
+                if len(parts) == 3 and method == 'GET':
+                    items = [{'name': name, 'id': label_id} for name, label_id in labels.items()]
+                    status, res_json = 200, {'items': items}
+                elif len(parts) == 3 and method == 'POST':
+                    name = body.get('name') if body else None
+                    if not isinstance(name, str):
+                        status, res_json = 400, {'error': 'label name is required'}
+                    elif name in labels:
+                        status, res_json = 409, {'error': 'label already exists'}
+                    else:
+                        labels[name] = str(uuid4())
+                        status, res_json = 201, {'name': name, 'id': labels[name]}
+                elif len(parts) == 4 and method == 'DELETE':
+                    name = next((name for name, label_id in labels.items() if label_id == parts[3]), None)
+                    if name is None:
+                        status, res_json = 404, {'error': 'label not found'}
+                    else:
+                        del labels[name]
+                        status, res_json = 204, None
+                else:
+                    status, res_json = 405, {'error': 'method not allowed'}
+            return self.send_json(status, res_json)
+
+        self.send_json(404, {'error': 'not found'})
+
+    def apply_operation(self, asset_id:str, operation:dict) -> dict:
+        # Called with the state lock held
+        labels = self.state.labels.get(asset_id)
+        if labels is None:
+            return {'status': 404, 'error': 'asset not found'}
+        if operation.get('op') == 'add':
+            name = operation.get('name')
+            if not isinstance(name, str):
+                return {'status': 400, 'error': 'label name is required'}
+            if name in labels:
+                return {'status': 409, 'error': 'label already exists'}
+            labels[name] = str(uuid4())
+            return {'status': 201, 'id': labels[name]}
+        if operation.get('op') == 'delete':
+            name = next((name for name, label_id in labels.items() if label_id == operation.get('label_id')), None)
+            if name is None:
+                return {'status': 404, 'error': 'label not found'}
+            del labels[name]
+            return {'status': 204}
+        return {'status': 400, 'error': 'unknown operation'}
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+class MockRadarServer:
+    def __init__(self, state:MockRadarState, host:str='127.0.0.1', port:int=0):
+        handler = type('BoundMockRadarHandler', (MockRadarHandler,), {'state': state})
+        self.state = state
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/1'
+
+    @property
+    def token_url(self) -> str:
+        return f'{self.base_url}/token'
+
+    def start(self) -> 'MockRadarServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mock-radar', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the BlackBerry Radar API.')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+    parser.add_argument('--fleet-size', type=int, default=1000, help='Number of assets to serve (default: 1000)')
+    parser.add_argument('--page-size', type=int, default=100, help='Default number of assets per page (default: 100)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean added latency per request in seconds (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API requests that fail with a 503 (default: 0)')
+    parser.add_argument('--throttle-rps', type=float, default=0.0, help='Requests per second allowed before answering 429, 0 to disable (default: 0)')
+    parser.add_argument('--bulk', action='store_true', help='Serve the bulk label endpoint at /1/labels/batch')
+    args = parser.parse_args()
+
+    state = MockRadarState(args.fleet_size, args.page_size, args.latency, args.error_rate, args.throttle_rps, bulk=args.bulk)
+    server = MockRadarServer(state, args.host, args.port)
+    print(f'Mock Radar API for {args.fleet_size} assets on {server.base_url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
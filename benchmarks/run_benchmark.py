@@ -0,0 +1,174 @@
+"""End-to-end load benchmark: runs pipeline.main() against the mock Radar API for a range of fleet sizes.
+
+    python benchmarks/run_benchmark.py --fleet-sizes 100 1000 10000 --concurrency 16 --latency 0.01
+"""
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives import serialization
+from pathlib import Path
+import statistics
+import tempfile
+import argparse
+import logging
+import random
+import json
+import time
+import sys
+import csv
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / 'label_adapter'))
+sys.path.insert(0, str(BENCHMARK_DIR))
+
+from mock_radar_server import MockRadarServer, MockRadarState
+from rate_limiter import AdaptiveConcurrencyLimiter, RateLimiter
+from blackberry import BlackBerryAPI, RetryPolicy
+from helpers import Helpers
+import pipeline
+
+LABEL_BASE = 'PM Service and Inspect'
+REPORT_HEADER = ['Textbox56', 'UNITNUMBER', 'DOMICILE', 'LASTDONE', 'LASTRDING', 'NEXTDUEMETER', 'TYPE', 'DUEPERCENT',
+                 'INTERVAL', 'UTILIZATION', 'Textbox38', 'COMPCODE', 'DESCRIPTION', 'METERTYPE', 'Textbox144']
+
+def write_key(path:Path) -> None:
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    path.write_bytes(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+def build_fleet(fleet_size:int, change_rate:float, rng:random.Random):
+    """Returns the labels to seed on the mock server and the report rows, with change_rate of assets getting a new due percent."""
+    seed_labels = {}
+    rows = []
+    for i in range(fleet_size):
+        asset_id = f'asset-{i:06d}'
+        identifier = str(10000 + i)
+        due_percent = rng.randint(50, 200)
+        seed_labels[asset_id] = [f'{LABEL_BASE} - {due_percent}%']
+        if rng.random() < change_rate:
+            due_percent += 1
+        rows.append(['Department DEPT - Default Department', identifier, 'BARTO', '9/25/2024', '', '', 'D', f'{due_percent}%',
+                     '60', '55', '5', '000-003', LABEL_BASE, 'DAYS', '104'])
+    return seed_labels, rows
+
+def write_report(path:Path, rows:list) -> None:
+    with path.open('w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(REPORT_HEADER)
+        writer.writerows(rows)
+
+def endpoint_name(method:str, url:str) -> str:
+    if url.endswith('/token'):
+        return 'token'
+    path = url.split('?')[0].rstrip('/')
+    if path.endswith('/assets'):
+        return 'get_assets'
+    if path.endswith('/labels/batch'):
+        return 'bulk_labels'
+    if path.endswith('/labels'):
+        return 'get_asset_labels' if method == 'GET' else 'add_label'
+    return 'delete_label'
+
+def instrument(bb:BlackBerryAPI, latencies:dict) -> None:
+    # Time every call that goes through the pooled session, including retries
+    request = bb.session.request
+    def timed_request(method, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return request(method, url, *args, **kwargs)
+        finally:
+            latencies.setdefault(endpoint_name(method, url), []).append(time.perf_counter() - start)
+    bb.session.request = timed_request
+
+def percentile(values:list, percent:float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def run_fleet(args, fleet_size:int, work_dir:Path) -> dict:
+    rng = random.Random(args.seed)
+    seed_labels, rows = build_fleet(fleet_size, args.change_rate, rng)
+    input_dir = work_dir / f'input_{fleet_size}'
+    output_dir = work_dir / f'output_{fleet_size}'
+    input_dir.mkdir()
+    write_report(input_dir / 'report.csv', rows)
+    key_file = work_dir / 'key.pem'
+    if not key_file.exists():
+        write_key(key_file)
+
+    state = MockRadarState(fleet_size, args.server_page_size, args.latency, args.error_rate, args.throttle_rps, seed_labels,
+                           bulk=args.bulk_endpoint is not None and not args.no_server_bulk)
+    server = MockRadarServer(state).start()
+    logger = logging.getLogger(f'benchmark.{fleet_size}')
+    try:
+        helper = Helpers(input_dir, output_dir, logger, 'error', 5, 'full')
+        helper.whitelist_file = BENCHMARK_DIR.parent / 'label_adapter' / 'component_code_whitelist.txt'
+        adaptive_concurrency = AdaptiveConcurrencyLimiter(args.concurrency) if args.adaptive_concurrency else None
+        rate_limiter = RateLimiter(args.read_rate, args.write_rate, adaptive_concurrency)
+        bb = BlackBerryAPI(key_file, logger, 'not_test', max(10, 2 * args.concurrency), RetryPolicy(max_retries=args.max_retries),
+                           base_url=server.base_url, token_url=server.token_url, rate_limiter=rate_limiter,
+                           bulk_endpoint=args.bulk_endpoint)
+        latencies = {}
+        instrument(bb, latencies)
+
+        start = time.perf_counter()
+        pipeline.main(helper, bb, args.concurrency, args.page_size, bulk_batch_size=args.bulk_batch_size)
+        wall_time = time.perf_counter() - start
+        bb.close()
+    finally:
+        server.stop()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
+    total_requests = sum(len(values) for values in latencies.values())
+    return {
+        'fleet_size': fleet_size,
+        'wall_time_s': round(wall_time, 3),
+        'requests': total_requests,
+        'requests_per_s': round(total_requests / wall_time, 1) if wall_time else 0.0,
+        'throttled': state.throttled,
+        'injected_errors': state.errors,
+        'endpoints': {
+            name: {
+                'count': len(values),
+                'p50_ms': round(statistics.median(values) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2)
+            } for name, values in sorted(latencies.items())
+        }
+    }
+
+def print_result(result:dict) -> None:
+    print(f"\nFleet {result['fleet_size']}: {result['wall_time_s']}s wall, {result['requests']} requests, "
+          f"{result['requests_per_s']} req/s, {result['throttled']} throttled, {result['injected_errors']} injected errors")
+    print(f"  {'endpoint':<18}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, stats in result['endpoints'].items():
+        print(f"  {name:<18}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark pipeline.main() against a local mock of the BlackBerry Radar API.')
+    parser.add_argument('--fleet-sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000], help='Fleet sizes to run (default: 100 1000 10000 50000)')
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='Sync workers passed to main() (default: 16)')
+    parser.add_argument('--page-size', type=int, default=500, help='Assets requested per page (default: 500)')
+    parser.add_argument('--server-page-size', type=int, default=100, help='Page size the mock uses when none is requested (default: 100)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean added server latency per request in seconds (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failing with 503 (default: 0)')
+    parser.add_argument('--throttle-rps', type=float, default=0.0, help='Server-side requests per second before 429s, 0 to disable (default: 0)')
+    parser.add_argument('--change-rate', type=float, default=0.1, help='Fraction of assets whose due percent changed since the last report (default: 0.1)')
+    parser.add_argument('--max-retries', type=int, default=5, help='Client retry budget (default: 5)')
+    parser.add_argument('--read-rate', type=float, default=0, help='Client read requests per second, 0 for no limit (default: 0)')
+    parser.add_argument('--write-rate', type=float, default=0, help='Client write requests per second, 0 for no limit (default: 0)')
+    parser.add_argument('--adaptive-concurrency', action='store_true', help='Enable AIMD adaptive concurrency in the client')
+    parser.add_argument('--bulk-endpoint', default=None, help='Send label writes to this bulk endpoint, e.g. /labels/batch (default: one request per label)')
+    parser.add_argument('--bulk-batch-size', type=int, default=100, help='Maximum label operations per bulk request (default: 100)')
+    parser.add_argument('--no-server-bulk', action='store_true', help='Leave the bulk endpoint out of the mock server, to measure the fallback')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the generated fleet (default: 1)')
+    parser.add_argument('--json', type=Path, default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='radar_benchmark_') as work_dir:
+        for fleet_size in args.fleet_sizes:
+            result = run_fleet(args, fleet_size, Path(work_dir))
+            print_result(result)
+            results.append(result)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
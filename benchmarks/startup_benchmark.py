@@ -0,0 +1,87 @@
+"""Startup benchmark: times scheduled runs that find no reports, and fails if they regress.
+
+    python benchmarks/startup_benchmark.py --runs 20 --budget-ms 60
+
+An empty run must not import the API, mailbox or sync stages, and must not leave an archive directory behind. The budget
+is measured on top of a bare interpreter start, so it holds on slow and fast machines alike.
+"""
+from pathlib import Path
+import statistics
+import subprocess
+import tempfile
+import argparse
+import json
+import time
+import sys
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+ADAPTER = BENCHMARK_DIR.parent / 'label_adapter' / 'label_adapter.py'
+# Only needed once there is something to sync
+HEAVY_MODULES = ('requests', 'urllib3', 'jwt', 'cryptography', 'imaplib', 'ssl', 'multiprocessing', 'logging', 'sqlite3', 'ctypes',
+                 'gzip', 'hashlib', 'csv', 'threading', 'archiver', 'state_store', 'watcher', 'helpers', 'sync',
+                 'pipeline')
+
+PROBE = '''
+import runpy, sys, json
+sys.argv = sys.argv[1:]
+sys.path.insert(0, sys.argv[0].rsplit('/', 1)[0])
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit as e:
+    code = e.code
+else:
+    code = 0
+print(json.dumps({'exit_code': code, 'modules': sorted(name for name in %r if name in sys.modules)}))
+''' % (HEAVY_MODULES,)
+
+def time_run(command:list) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def run_benchmark(args, work_dir:Path) -> dict:
+    input_dir = work_dir / 'reports'
+    archive_dir = work_dir / 'archive'
+    input_dir.mkdir()
+    command = [sys.executable, str(ADAPTER), str(input_dir), str(archive_dir)]
+
+    baseline = [time_run([sys.executable, '-c', 'pass']) for _ in range(args.runs)]
+    timings = [time_run(command) for _ in range(args.runs)]
+    probe = json.loads(subprocess.run([sys.executable, '-c', PROBE] + command[1:], check=True, capture_output=True, text=True).stdout)
+    return {
+        'runs': args.runs,
+        'interpreter_ms': round(statistics.median(baseline) * 1000, 1),
+        'min_ms': round(min(timings) * 1000, 1),
+        'median_ms': round(statistics.median(timings) * 1000, 1),
+        'overhead_ms': round((statistics.median(timings) - statistics.median(baseline)) * 1000, 1),
+        'exit_code': probe['exit_code'],
+        'heavy_modules_imported': probe['modules'],
+        'archive_dir_created': archive_dir.exists()
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time label_adapter.py on an empty report directory and check it stays on the fast path.')
+    parser.add_argument('--runs', type=int, default=20, help='Number of timed runs (default: 20)')
+    parser.add_argument('--budget-ms', type=float, default=60, help='Fail if the median empty run takes this much longer than a bare interpreter (default: 60)')
+    parser.add_argument('--json', type=Path, default=None, help='Also write the result to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='radar_startup_') as work_dir:
+        result = run_benchmark(args, Path(work_dir))
+    print(f"Empty run: {result['median_ms']}ms median, {result['min_ms']}ms min over {result['runs']} runs, "
+          f"{result['overhead_ms']}ms over a bare interpreter ({result['interpreter_ms']}ms median)")
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
+
+    problems = []
+    if result['exit_code'] not in (0, None):
+        problems.append(f"exited with {result['exit_code']}")
+    if result['heavy_modules_imported']:
+        problems.append(f"imported {', '.join(result['heavy_modules_imported'])}")
+    if result['archive_dir_created']:
+        problems.append('created an archive directory')
+    if result['overhead_ms'] > args.budget_ms:
+        problems.append(f"took {result['overhead_ms']}ms over a bare interpreter, more than the {args.budget_ms}ms budget")
+    for problem in problems:
+        print(f'FAIL: empty run {problem}')
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from pathlib import Path
+import hashlib
+import errno
+import gzip
+import io
+import os
+
+from csv_ingest import MemoryReport
+from metrics import Metrics
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+CHUNK_SIZE = 1024 * 1024
+
+def zstd_available() -> bool:
+    try:
+        import zstandard
+    except ImportError:
+        return False
+    return True
+
+class ArchiveEntry:
+    __slots__ = ('source', 'name', 'rename', 'future', 'stat', 'target', 'sha256', 'committed')
+
+    def __init__(self, source):
+        self.source = source
+        self.name = os.path.basename(os.fspath(source))
+        self.rename = False
+        self.future = None
+        self.stat = None
+        self.target = None
+        self.sha256 = None
+        self.committed = False
+
+class ReportArchiver:
+    """Archives each report on its own in a background pool, starting as soon as it has been parsed.
+
+    A report on the same filesystem as the archive is renamed into place once the run has applied it. Any other report
+    is streamed into a compressed copy straight away, and its SHA-256 goes in the archive's manifest."""
+    MANIFEST = 'MANIFEST.sha256'
+
+    def __init__(self, archive_dir:Path, logger:Logger, metrics:Metrics, keep_sources:bool=False, compression:str='gzip', workers:int=4):
+        self.archive_dir = archive_dir
+        self.logger = logger
+        self.metrics = metrics
+        # Test runs copy the reports and leave them where they are
+        self.keep_sources = keep_sources
+        self.compression = compression
+        self.archive_device = os.stat(archive_dir).st_dev
+        self.entries = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='archive')
+
+    @staticmethod
+    def source_stat(source) -> tuple:
+        if isinstance(source, MemoryReport):
+            return None
+        stat = os.stat(source)
+        return stat.st_mtime_ns, stat.st_size
+
+    def same_filesystem(self, source) -> bool:
+        try:
+            return os.stat(source).st_dev == self.archive_device
+        except OSError:
+            # Let the copy report it
+            return False
+
+    def stage(self, report) -> None:
+        """Starts archiving a report. Renames are left to commit(), so the report stays put until it has been applied."""
+        key = os.fspath(report)
+        if key in self.entries:
+            return
+        entry = ArchiveEntry(report)
+        if not self.keep_sources and not isinstance(report, MemoryReport) and self.same_filesystem(report):
+            entry.rename = True
+        else:
+            entry.future = self.pool.submit(self.copy, entry)
+        self.entries[key] = entry
+
+    def open_source(self, source):
+        if isinstance(source, MemoryReport):
+            return io.BytesIO(source.data)
+        return open(source, 'rb')
+
+    def compressor(self, raw):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=6, mtime=0)
+        if self.compression == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+        return None
+
+    def copy(self, entry:ArchiveEntry) -> None:
+        entry.stat = self.source_stat(entry.source)
+        target = self.archive_dir / (entry.name + COMPRESSION_SUFFIXES[self.compression])
+        part = target.with_name(target.name + '.part')
+        sha256 = hashlib.sha256()
+        try:
+            with open(part, 'wb') as raw, self.open_source(entry.source) as source:
+                writer = self.compressor(raw) or raw
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    writer.write(chunk)
+                if writer is not raw:
+                    writer.close()
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(part, target)
+        except BaseException:
+            part.unlink(missing_ok=True)
+            raise
+        entry.target = target
+        entry.sha256 = sha256.hexdigest()
+        self.metrics.increment('archive_bytes_written', target.stat().st_size)
+
+    def commit_entry(self, entry:ArchiveEntry) -> None:
+        if entry.rename:
+            try:
+                os.rename(entry.source, self.archive_dir / entry.name)
+                entry.committed = True
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # Same device number but not the same mount, e.g. a bind mount
+                self.copy(entry)
+        else:
+            entry.future.result()
+            if self.source_stat(entry.source) != entry.stat:
+                self.logger.warning(f'{entry.name} changed after it was parsed, archiving it again')
+                self.copy(entry)
+        entry.committed = True
+        if not self.keep_sources and not isinstance(entry.source, MemoryReport):
+            os.unlink(entry.source)
+
+    def write_manifest(self) -> None:
+        lines = [f'{entry.sha256}  {entry.name}\n' for entry in self.entries.values() if entry.committed and entry.sha256]
+        if not lines:
+            return
+        manifest = self.archive_dir / self.MANIFEST
+        part = manifest.with_name(manifest.name + '.part')
+        with open(part, 'w', encoding='utf-8') as file:
+            file.writelines(lines)
+        os.replace(part, manifest)
+
+    def commit(self, reports:list) -> bool:
+        """Waits for every report to be archived and removes the originals. Returns False if any report failed,
+        in which case it is left in place for the next run."""
+        for report in reports:
+            self.stage(report)
+        archived = True
+        for entry in self.entries.values():
+            try:
+                self.commit_entry(entry)
+                self.metrics.increment('reports_archived')
+            except Exception as e:
+                archived = False
+                self.metrics.increment('reports_archive_failed')
+                self.logger.error(f'Unable to archive {entry.name}: {e}')
+        try:
+            self.write_manifest()
+        except OSError as e:
+            archived = False
+            self.logger.error(f'Unable to write the archive manifest: {e}')
+        self.pool.shutdown()
+        return archived
+
+    def discard(self) -> None:
+        """Removes the copies of reports that were never committed, e.g. after an interrupted run."""
+        for entry in self.entries.values():
+            if entry.future:
+                entry.future.cancel()
+        self.pool.shutdown()
+        for entry in self.entries.values():
+            if not entry.committed and entry.target:
+                entry.target.unlink(missing_ok=True)
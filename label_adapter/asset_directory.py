@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from logging import Logger
+
+def normalize_identifier(identifier) -> str:
+    """Unit numbers are typed by hand on both sides, so ' 026706' in a report is the same truck as '26706' in Radar."""
+    value = str(identifier).strip()
+    if value.isdigit():
+        value = value.lstrip('0') or '0'
+    return value
+
+class AssetDirectory:
+    """Persistent identifier -> Radar asset id lookup, so a sync only touches the assets it needs
+    instead of listing the whole fleet."""
+
+    def __init__(self, bb, state_store, logger:Logger, ttl_hours:float=24.0, miss_refresh_minutes:float=15.0):
+        self.bb = bb
+        self.state_store = state_store
+        self.logger = logger
+        self.ttl = timedelta(hours=ttl_hours)
+        # Identifiers that aren't in Radar would otherwise force a full listing on every run
+        self.miss_refresh = timedelta(minutes=miss_refresh_minutes)
+        self.assets, self.refreshed_at = state_store.load_asset_directory()
+
+    @property
+    def expired(self) -> bool:
+        return self.refreshed_at is None or datetime.now() - self.refreshed_at >= self.ttl
+
+    def iter_and_refresh(self, page_size:int=None):
+        """Yields (asset_id, identifier) for the whole fleet, and saves the directory once the listing completes
+        if it came from Radar rather than canned test responses. A failed page raises before anything is saved."""
+        assets = {}
+        for asset_id, identifier in self.bb.iter_assets(page_size):
+            identifier = normalize_identifier(identifier)
+            if identifier in assets and assets[identifier] != asset_id:
+                self.logger.warning(f'Radar assets {assets[identifier]} and {asset_id} share identifier {identifier}')
+            assets[identifier] = asset_id
+            yield asset_id, identifier
+        self.assets = assets
+        if not self.bb.do_read:
+            # Canned test ids must never stand in for the real fleet
+            self.logger.info('Asset directory not saved, the listing was simulated')
+            return
+        self.refreshed_at = datetime.now()
+        self.state_store.save_asset_directory(assets)
+        self.logger.info(f'Asset directory refreshed with {len(assets)} asset(s)')
+
+    def lookup(self, identifiers:set, page_size:int=None) -> list:
+        """Returns (asset_id, identifier) for the identifiers Radar knows about, refreshing the directory
+        first when it has expired, or when some identifiers are missing and it wasn't refreshed recently."""
+        missing = [identifier for identifier in identifiers if identifier not in self.assets]
+        recently_refreshed = self.refreshed_at is not None and datetime.now() - self.refreshed_at < self.miss_refresh
+        if self.expired or (missing and not recently_refreshed):
+            reason = 'expired' if self.expired else f'{len(missing)} identifier(s) not cached'
+            self.logger.info(f'Refreshing asset directory ({reason})')
+            for _ in self.iter_and_refresh(page_size):
+                pass
+            missing = [identifier for identifier in identifiers if identifier not in self.assets]
+        if missing:
+            self.logger.info(f'{len(missing)} identifier(s) from the reports are not Radar assets')
+            self.logger.debug('Unknown identifiers: %s', ', '.join(sorted(missing)))
+        return sorted((self.assets[identifier], identifier) for identifier in identifiers if identifier in self.assets)
@@ -0,0 +1,147 @@
+from collections import namedtuple
+from operator import itemgetter
+import time
+import csv
+import io
+
+from asset_directory import normalize_identifier
+from label_index import LabelIndex
+
+ReportRow = namedtuple('ReportRow', ['unit_number', 'description', 'due_percent', 'comp_code', 'last_done'])
+
+class MemoryReport:
+    """A report that was never written to the report directory, e.g. an email attachment."""
+    __slots__ = ('name', 'data', 'mtime')
+
+    def __init__(self, name:str, data:bytes, mtime:float=None):
+        self.name = name
+        self.data = data
+        self.mtime = time.time() if mtime is None else mtime
+
+    def __fspath__(self):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+def open_report(path_to_csv):
+    if isinstance(path_to_csv, MemoryReport):
+        return io.TextIOWrapper(io.BytesIO(path_to_csv.data), encoding='utf-8-sig', errors='replace', newline='')
+    return open(path_to_csv, 'r', newline='', encoding='utf-8-sig', errors='replace')
+
+class ReportReader:
+    """Streams a Trimble report, yielding only the columns the adapter uses."""
+    COLUMNS = ('UNITNUMBER', 'DESCRIPTION', 'DUEPERCENT', 'COMPCODE')
+    # Yielded as '' when an export doesn't include it
+    OPTIONAL_COLUMNS = ('LASTDONE',)
+
+    def __init__(self, path_to_csv):
+        self.path_to_csv = path_to_csv
+        self.rows_read = 0
+        self.rows_rejected = 0
+        self.elapsed = 0.0
+
+    @staticmethod
+    def clean_header(header:list) -> list:
+        # utf-8-sig drops a leading BOM, but stray ones show up on re-saved exports too
+        return [name.strip().lstrip('\ufeff') for name in header]
+
+    def __iter__(self):
+        start = time.perf_counter()
+        try:
+            with open_report(self.path_to_csv) as file:
+                reader = csv.reader(file)
+                header = self.clean_header(next(reader, []))
+                missing = [name for name in self.COLUMNS if name not in header]
+                if missing:
+                    raise ValueError(f'{self.path_to_csv} is missing column(s) {", ".join(missing)}')
+                optional = [name for name in self.OPTIONAL_COLUMNS if name in header]
+                indexes = [header.index(name) for name in self.COLUMNS + tuple(optional)]
+                project = itemgetter(*indexes)
+                if len(optional) < len(self.OPTIONAL_COLUMNS):
+                    padding = ('',) * (len(self.OPTIONAL_COLUMNS) - len(optional))
+                    project_present = project
+                    project = lambda row: project_present(row) + padding
+                width = max(indexes) + 1
+
+                for row in reader:
+                    if not row:
+                        continue
+                    if len(row) < width:
+                        self.rows_rejected += 1
+                        continue
+                    self.rows_read += 1
+                    yield ReportRow._make(project(row))
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_read / self.elapsed if self.elapsed > 0 else 0.0
+
+class ParsedReport:
+    __slots__ = ('path_to_csv', 'labels', 'rows_read', 'rows_rejected', 'superseded', 'elapsed', 'error')
+
+    def __init__(self, path_to_csv):
+        self.path_to_csv = path_to_csv
+        # asset identifier -> label base -> due percent
+        self.labels = {}
+        self.rows_read = 0
+        self.rows_rejected = 0
+        self.superseded = 0
+        self.elapsed = 0.0
+        self.error = None
+
+def parse_last_done(last_done:str, cache:dict) -> tuple:
+    """Turns a Trimble M/D/YYYY date into a sortable (year, month, day), (0, 0, 0) when blank or unparseable."""
+    parsed = cache.get(last_done)
+    if parsed is None:
+        try:
+            month, day, year = (int(part) for part in last_done.strip().split('/'))
+            parsed = (year, month, day)
+        except ValueError:
+            parsed = (0, 0, 0)
+        cache[last_done] = parsed
+    return parsed
+
+def parse_report(path_to_csv, comp_code_whitelist) -> ParsedReport:
+    """Parses one report into a partial label map. Top level so it can run in a process pool."""
+    report = ParsedReport(path_to_csv)
+    # asset identifier -> label base -> (recency, due percent)
+    resolved = {}
+    date_cache = {}
+    reader = ReportReader(path_to_csv)
+    try:
+        for row_number, (asset_id, label_base, due_percent, comp_code, last_done) in enumerate(reader):
+            if asset_id and comp_code in comp_code_whitelist:
+                asset_id = normalize_identifier(asset_id)
+                asset_labels = resolved.get(asset_id)
+                if asset_labels is None:
+                    asset_labels = resolved[asset_id] = {}
+                # Most recent LASTDONE wins, later rows break ties
+                recency = (parse_last_done(last_done, date_cache), row_number)
+                current = asset_labels.get(label_base)
+                if current is not None:
+                    if current[1] != due_percent:
+                        report.superseded += 1
+                    if current[0] > recency:
+                        continue
+                asset_labels[label_base] = (recency, due_percent)
+    except (ValueError, csv.Error) as e:
+        report.error = str(e)
+        resolved = {}
+    report.labels = {asset_id: {label_base: due_percent for label_base, (_, due_percent) in bases.items()}
+                     for asset_id, bases in resolved.items()}
+    report.rows_read = reader.rows_read
+    report.rows_rejected = reader.rows_rejected
+    report.elapsed = reader.elapsed
+    return report
+
+def merge_report(report:ParsedReport, asset_label_map:LabelIndex, label_bases_processed:set) -> int:
+    """Merges a partial map into the run's index. For the same asset and label base, the report merged last wins.
+    Returns the number of labels from earlier reports that were superseded."""
+    superseded = 0
+    for asset_id, bases in report.labels.items():
+        superseded += asset_label_map.merge(asset_id, bases)
+        label_bases_processed.update(bases)
+    return superseded
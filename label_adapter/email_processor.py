@@ -1,15 +1,35 @@
 from pathlib import Path
-import os
+import quopri
 import imaplib
+import base64
+import email.header
+import re
+import os
+
+from csv_ingest import MemoryReport
+
+INBOX = 'inbox'
+PROCESSED = 'processed'
+# UIDs per FETCH/MOVE command, keeps command lines well under server limits
+UID_BATCH = 200
+
+FETCH_SECTION_PATTERN = re.compile(rb'BODY\[([\d.]+)\]')
+TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"]+))')
 
-def email_login(email_address, password, imap_server, imap_port, logger):
+class MailboxCursor:
+    """Where the last fetch stopped. A UID only means something within one UIDVALIDITY of the mailbox."""
+    __slots__ = ('uidvalidity', 'last_uid')
+
+    def __init__(self, uidvalidity:int=0, last_uid:int=0):
+        self.uidvalidity = uidvalidity
+        self.last_uid = last_uid
+
+def email_login(email_address, password, imap_server, imap_port, logger, use_ssl:bool=True):
     logger.debug('Attempting email login')
-    mail = imaplib.IMAP4_SSL(imap_server, imap_port)
+    mail = imaplib.IMAP4_SSL(imap_server, imap_port) if use_ssl else imaplib.IMAP4(imap_server, imap_port)
+    # Raises imaplib.IMAP4.error on bad credentials
     mail.login(email_address, password)
-    if mail:
-        logger.debug('Email login successful')
-    else:
-        logger.error('Email login unsuccessful')
+    logger.debug('Email login successful')
     return mail
 
 def email_logout(mail, logger):
@@ -17,83 +37,265 @@ def email_logout(mail, logger):
     mail.logout()
     logger.debug("Successfully logged out")
 
-def download_csv_attachments(mail, sender_email, download_folder, logger):
-    # Search for emails from the specific sender
-    INBOX = 'inbox'
-    PROCESSED = 'processed'
-    downloaded = {} # filename, email_id
-    logger.debug('Downloading email attachments')
-    mail.select(INBOX)
-    logger.debug(f'Searching for emails from {sender_email}')
-    status, data = mail.search(None, '(FROM "{}")'.format(sender_email))
-    logger.debug(f'Status: {status}, Data: {data}')
-    email_ids = data[0].split()
-    logger.debug(f'Email IDs: {email_ids}')
-
-    for email_id in email_ids:
-        # Fetch the email
-        logger.debug(f'Fetching email with ID {email_id}')
-        status, data = mail.fetch(email_id, '(RFC822)')
-        logger.debug(f'Status: {status}')
-        raw_email = data[0][1]
-
-        # Parse the email
-        email_message = email.message_from_bytes(raw_email)
-
-        #print(f'Email_message: {email_message}')
-        logger.debug(f'Checking for attachments...')
-        # Check if the email has attachments
-        if email_message.get_content_maintype() =='multipart':
-            logger.debug(f'Multipart:True')
-            for part in email_message.walk():
-                logger.debug(f'content_maintype: {part.get_content_maintype()}')
-                logger.debug(f'content_subtype: {part.get_content_subtype()}')
-                if part.get_content_maintype() == 'text' and part.get_content_subtype() == 'csv':
-                    logger.debug(f'Has CSV')
-                    # Download the CSV attachment
-                    email_id_str = email_id.decode('utf-8')
-                    filename = f'{email_id_str}_{part.get_filename()}'
-                    logger.debug(f'Filename: {filename}')
-                    Path(download_folder).mkdir(parents=True, exist_ok=True)
-                    download_path = os.path.join(download_folder, filename)
-                    with open(download_path, 'wb') as f:
-                        f.write(part.get_payload(decode=True))
-                    downloaded[download_path] = email_id
-                    logger.debug('Downloaded:', download_path)
-    
-    move_processed_emails(mail, downloaded.values(), PROCESSED, logger)
-
-    return downloaded.keys()
-
-def move_processed_emails(mail, downloaded_email_ids,  destination_folder, logger):
-    logger.debug('Attempting to move processed emails')
-    status, mailboxes = mail.list()  # Retrieve all mailboxes first
-    if status == "OK":
-        # Iterate through the list to find our destination folder
-        for mailbox in mailboxes:
-            # Manually extract the mailbox name
-            mailbox_name = mailbox.decode('utf-8').split('"')[-2]
-            # Remove leading/trailing '/' if present (depending on the IMAP server)
-            mailbox_name = mailbox_name.strip('/')
-            if mailbox_name == destination_folder:
-                logger.debug(f"Folder '{destination_folder}' already exists.")
+def uid_set(uids) -> str:
+    """Compresses UIDs into an IMAP sequence set, e.g. 1:3,7."""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else f'{start}:{end}' for start, end in ranges)
+
+def batches(items:list, size:int=UID_BATCH):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def parse_sexp(data:list):
+    """Parses the parenthesized lists of a FETCH response. data is imaplib's mix of bytes and (prefix, literal) tuples."""
+    tokens = []
+    for chunk in data:
+        literal = None
+        if isinstance(chunk, tuple):
+            chunk, literal = chunk
+        for match in TOKEN_PATTERN.finditer(chunk):
+            opening, closing, quoted, literal_size, atom = match.groups()
+            if opening:
+                tokens.append('(')
+            elif closing:
+                tokens.append(')')
+            elif quoted is not None:
+                tokens.append(re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', errors='replace'))
+            elif literal_size is not None:
+                tokens.append((literal or b'').decode('utf-8', errors='replace'))
+            elif atom is not None:
+                atom = atom.decode('utf-8', errors='replace')
+                tokens.append(None if atom.upper() == 'NIL' else atom)
+    root = []
+    stack = [root]
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+        elif token == ')' and len(stack) > 1:
+            child = stack.pop()
+            stack[-1].append(child)
+        else:
+            stack[-1].append(token)
+    return root
+
+def pairs_to_dict(values) -> dict:
+    if not isinstance(values, list):
+        return {}
+    return {str(values[i]).lower(): values[i + 1] for i in range(0, len(values) - 1, 2) if isinstance(values[i], str)}
+
+def csv_parts(structure:list, section:str='') -> list:
+    """Walks a BODYSTRUCTURE and returns (section, filename, encoding) for every CSV part."""
+    if not structure:
+        return []
+    if isinstance(structure[0], list):
+        # multipart: child parts, then the subtype and extension data
+        parts = []
+        for number, child in enumerate(structure, 1):
+            if not isinstance(child, list):
                 break
+            parts += csv_parts(child, f'{section}.{number}' if section else str(number))
+        return parts
+    maintype = str(structure[0] or '').lower()
+    subtype = str(structure[1] or '').lower() if len(structure) > 1 else ''
+    params = pairs_to_dict(structure[2] if len(structure) > 2 else None)
+    encoding = str(structure[5] or '7bit').lower() if len(structure) > 5 else '7bit'
+    filename = params.get('name') or ''
+    # Disposition sits after the optional md5, somewhere in the extension data
+    for extension in structure[7:]:
+        if isinstance(extension, list) and len(extension) == 2 and isinstance(extension[0], str):
+            filename = pairs_to_dict(extension[1]).get('filename') or filename
+    if (maintype, subtype) == ('text', 'csv') or filename.lower().endswith('.csv'):
+        return [(section or '1', filename, encoding)]
+    return []
+
+def decode_part(data:bytes, encoding:str) -> bytes:
+    if encoding == 'base64':
+        return base64.b64decode(data)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+def attachment_name(uid:int, filename:str) -> str:
+    # Attachment names come from the sender, so never let them pick the directory
+    filename = os.path.basename(str(email.header.make_header(email.header.decode_header(filename or '')))) or 'attachment.csv'
+    if not filename.lower().endswith('.csv'):
+        filename += '.csv'
+    return f'{uid}_{filename}'
+
+def select_inbox(mail) -> int:
+    status, data = mail.select(INBOX)
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f'Unable to select {INBOX}: {data}')
+    for response in mail.response('UIDVALIDITY')[1] or []:
+        if response:
+            return int(response)
+    return 0
+
+def search_new_uids(mail, sender_email, last_uid:int, logger) -> list:
+    status, data = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*', f'FROM "{sender_email}"')
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f'Email search failed: {data}')
+    # n:* always matches the newest message, even when its UID is below n
+    uids = sorted(uid for uid in (int(value) for value in (data[0] or b'').split()) if uid > last_uid)
+    logger.debug('%d new email(s) from %s after UID %d', len(uids), sender_email, last_uid)
+    return uids
+
+def fetch_bodystructures(mail, uids:list) -> dict:
+    structures = {}
+    for batch in batches(uids):
+        status, data = mail.uid('FETCH', uid_set(batch), '(UID BODYSTRUCTURE)')
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f'BODYSTRUCTURE fetch failed: {data}')
+        for response in split_fetch_responses(data):
+            parsed = parse_sexp(response)
+            items = next((item for item in parsed if isinstance(item, list)), [])
+            fields = pairs_to_dict(items)
+            if fields.get('uid') and isinstance(fields.get('bodystructure'), list):
+                structures[int(fields['uid'])] = fields['bodystructure']
+    return structures
+
+def split_fetch_responses(data:list) -> list:
+    """Groups imaplib's flat FETCH data into one list of chunks per message."""
+    responses = []
+    for chunk in data:
+        if chunk is None:
+            continue
+        head = chunk[0] if isinstance(chunk, tuple) else chunk
+        if re.match(rb'\d+ \(', head) or not responses:
+            responses.append([chunk])
         else:
-            logger.info(f"email folder '{destination_folder}' does not exist. Creating it...")
-            # Attempt to create the folder
-            status, response = mail.create(destination_folder)
-            if status == "OK":
-                logger.info(f"Folder '{destination_folder}' created successfully.")
-            else:
-                logger.error(f"Failed to create folder '{destination_folder}': {response.decode()}")
-                return
-    else:
-        logger.error(f"Failed to retrieve mailbox list: {mail.response()[0].decode()}")
+            responses[-1].append(chunk)
+    return responses
+
+def fetch_parts(mail, uid:int, parts:list) -> list:
+    """Downloads just the listed sections of one message, without setting \\Seen. Returns (filename, encoding, data)
+    with the data still transfer-encoded."""
+    sections = ' '.join(f'BODY.PEEK[{section}]' for section, _, _ in parts)
+    status, data = mail.uid('FETCH', str(uid), f'({sections})')
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f'Unable to fetch email {uid}: {data}')
+    bodies = {}
+    for chunk in data:
+        if isinstance(chunk, tuple):
+            match = FETCH_SECTION_PATTERN.search(chunk[0])
+            if match:
+                bodies[match.group(1).decode()] = chunk[1]
+    return [(filename, encoding, bodies[section]) for section, filename, encoding in parts if section in bodies]
+
+def fetch_csv_attachments(mail, sender_email, logger, cursor:MailboxCursor=None) -> tuple:
+    """Returns (uid, filename, data) for every CSV attachment from sender_email newer than cursor,
+    and the cursor to save once they have been handled."""
+    cursor = cursor or MailboxCursor()
+    uidvalidity = select_inbox(mail)
+    last_uid = cursor.last_uid
+    if uidvalidity != cursor.uidvalidity:
+        if cursor.uidvalidity:
+            logger.info(f'{INBOX} UIDVALIDITY changed from {cursor.uidvalidity} to {uidvalidity}, rescanning the whole mailbox')
+        last_uid = 0
+    uids = search_new_uids(mail, sender_email, last_uid, logger)
+    attachments = []
+    if uids:
+        structures = fetch_bodystructures(mail, uids)
+        for uid in uids:
+            parts = csv_parts(structures.get(uid, []))
+            logger.debug('Email %d has %d CSV part(s)', uid, len(parts))
+            if parts:
+                for filename, encoding, data in fetch_parts(mail, uid, parts):
+                    try:
+                        attachments.append((uid, attachment_name(uid, filename), decode_part(data, encoding)))
+                    except (ValueError, LookupError) as e:
+                        # Bad base64 (binascii.Error is a ValueError) or an unknown filename charset. The cursor still
+                        # moves past the email, so one malformed attachment doesn't block every later fetch.
+                        logger.error(f'Skipping attachment {filename!r} of email {uid}, it could not be decoded: {e}')
+    return attachments, MailboxCursor(uidvalidity, max(uids, default=last_uid))
+
+def save_attachment(download_folder, filename:str, data:bytes) -> str:
+    """Writes the attachment under a temporary name first, so a half-written report is never picked up."""
+    Path(download_folder).mkdir(parents=True, exist_ok=True)
+    download_path = os.path.join(download_folder, filename)
+    part_path = f'{download_path}.part'
+    with open(part_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(part_path, download_path)
+    return download_path
+
+def download_csv_attachments(mail, sender_email, download_folder, logger, cursor:MailboxCursor=None) -> tuple:
+    """Returns the saved report paths and the cursor to save."""
+    downloaded = {} # filename, uid
+    attachments, cursor = fetch_csv_attachments(mail, sender_email, logger, cursor)
+    for uid, filename, data in attachments:
+        download_path = save_attachment(download_folder, filename, data)
+        downloaded[download_path] = uid
+        logger.debug('Downloaded: %s', download_path)
+
+    # Each report is on disk before its email leaves the inbox
+    move_processed_emails(mail, set(downloaded.values()), PROCESSED, logger)
+
+    return list(downloaded.keys()), cursor
+
+def stream_csv_attachments(mail, sender_email, logger, cursor:MailboxCursor=None) -> tuple:
+    """Returns the CSV attachments as in-memory reports, the UIDs of the emails they came from and the cursor to save.
+    The caller moves the emails and saves the cursor once the reports have been applied and archived."""
+    attachments, cursor = fetch_csv_attachments(mail, sender_email, logger, cursor)
+    reports = [MemoryReport(filename, data) for _, filename, data in attachments]
+    return reports, sorted({uid for uid, _, _ in attachments}), cursor
+
+def ensure_mailbox(mail, destination_folder, logger) -> bool:
+    status, mailboxes = mail.list()  # Retrieve all mailboxes first
+    if status != "OK":
+        logger.error(f"Failed to retrieve mailbox list: {mail.response('LIST')}")
+        return False
+    # Iterate through the list to find our destination folder
+    for mailbox in mailboxes:
+        if not mailbox:
+            continue
+        parsed = parse_sexp([mailbox])
+        # Remove leading/trailing '/' if present (depending on the IMAP server)
+        mailbox_name = str(parsed[-1] if parsed else '').strip('/')
+        if mailbox_name.lower() == destination_folder.lower():
+            logger.debug(f"Folder '{destination_folder}' already exists.")
+            return True
+    logger.info(f"email folder '{destination_folder}' does not exist. Creating it...")
+    # Attempt to create the folder
+    status, response = mail.create(destination_folder)
+    if status == "OK":
+        logger.info(f"Folder '{destination_folder}' created successfully.")
+        return True
+    logger.error(f"Failed to create folder '{destination_folder}': {response}")
+    return False
+
+def move_processed_emails(mail, downloaded_uids, destination_folder, logger):
+    uids = sorted(downloaded_uids)
+    if not uids:
+        return
+    logger.debug('Attempting to move processed emails')
+    if not ensure_mailbox(mail, destination_folder, logger):
         return
 
-    logger.debug("Moving processed emails to '{}'...".format(destination_folder))
-    for email_id in downloaded_email_ids:
-        mail.copy(email_id, destination_folder)  # Copy to destination
-        mail.store(email_id, '+FLAGS', '\\Deleted')  # Mark original for deletion
-    mail.expunge()  # Permanently remove deleted items from inbox
-    logger.debug("Emails moved.")    
\ No newline at end of file
+    capabilities = getattr(mail, 'capabilities', ())
+    logger.debug("Moving %d processed email(s) to '%s'...", len(uids), destination_folder)
+    for batch in batches(uids):
+        uids_to_move = uid_set(batch)
+        if 'MOVE' in capabilities:
+            status, response = mail.uid('MOVE', uids_to_move, destination_folder)
+            if status != 'OK':
+                logger.error(f'Failed to move emails {uids_to_move}: {response}')
+            continue
+        status, response = mail.uid('COPY', uids_to_move, destination_folder)  # Copy to destination
+        if status != 'OK':
+            logger.error(f'Failed to copy emails {uids_to_move}: {response}')
+            continue
+        mail.uid('STORE', uids_to_move, '+FLAGS.SILENT', '(\\Deleted)')  # Mark original for deletion
+        if 'UIDPLUS' in capabilities:
+            # Only expunge our own messages, not whatever else someone marked deleted
+            mail.uid('EXPUNGE', uids_to_move)
+        else:
+            mail.expunge()  # Permanently remove deleted items from inbox
+    logger.debug("Emails moved.")
@@ -1,4 +1,4 @@
-from logging.handlers import RotatingFileHandler
+from itertools import repeat
 from datetime import datetime
 from typing import Optional
 from logging import Logger
@@ -6,33 +6,80 @@ from pathlib import Path
 import logging
 import shutil
 import glob
-import csv
 import os
 import re
 
+from archiver import ReportArchiver
+from label_policy import LabelPolicy
+from log_utils import JsonFormatter
+from metrics import Metrics
+from csv_ingest import MemoryReport, ParsedReport, merge_report, parse_report
+from label_index import LabelIndex
+from whitelist import ComponentCodeWhitelist
+
 class Helpers:
-    def __init__(self, input_dir:Path, output_dir:Path, logger:Logger, log_level_str:str, max_directories:int, test_level:str):
+    def __init__(self, input_dir:Path, output_dir:Path, logger:Logger, log_level_str:str, max_directories:int, test_level:str, log_format:str='text',
+                 metrics:Metrics=None, archive_compression:str='gzip'):
         self.input_dir = input_dir
+        self.metrics = metrics or Metrics()
         self.output_dir = output_dir
         self.archive_dir = self.create_archive_dir()
         self.logger = logger
-        self.configure_logger(log_level_str)
-        self.csv_files = self.get_csv_files(input_dir)
+        self.log_level_str = log_level_str
+        self.log_format = log_format
+        self.max_directories = max_directories
+        self.file_handler = None
+        self.configure_logger(log_level_str, log_format)
+        with self.metrics.phase('discover_csv_files'):
+            self.csv_files = self.get_csv_files(input_dir)
+        # Reports that could not be parsed, they stay where they are instead of being archived
+        self.failed_reports = set()
         self.delete_oldest_directory(max_directories)
+        self._comp_code_whitelist = None
         self.whitelist_file = Path('')
         if test_level == 'not_test':
             self.is_test = False
         else:
             self.is_test = True
+        self.archive_compression = archive_compression
+        self.archiver = self.create_archiver()
+
+    @property
+    def whitelist_file(self) -> Path:
+        return self._whitelist_file
+
+    @whitelist_file.setter
+    def whitelist_file(self, whitelist_file:Path) -> None:
+        self._whitelist_file = whitelist_file
+        self._comp_code_whitelist = None
+
+    @property
+    def comp_code_whitelist(self) -> ComponentCodeWhitelist:
+        # Loaded on first use and shared by every CSV in the run
+        if self._comp_code_whitelist is None:
+            self._comp_code_whitelist = ComponentCodeWhitelist.from_file(self.whitelist_file)
+            self.logger.debug('Label whitelist %s', self._comp_code_whitelist)
+        return self._comp_code_whitelist
+
+    def refresh(self) -> None:
+        """Starts the next run of a long-running process: a new archive dir and log file, and a fresh scan for CSVs."""
+        self.metrics.reset()
+        self.archive_dir = self.create_archive_dir()
+        self.configure_logger(self.log_level_str, self.log_format)
+        with self.metrics.phase('discover_csv_files'):
+            self.csv_files = self.get_csv_files(self.input_dir)
+        self.failed_reports = set()
+        self.delete_oldest_directory(self.max_directories)
+        self.archiver = self.create_archiver()
 
     def get_csv_files(self, input_dir:Path) -> list:
-        self.logger.debug(f'Retrieving CSVs from {str(input_dir)}')
+        self.logger.debug('Retrieving CSVs from %s', input_dir)
         if not input_dir.is_dir():
             self.logger.error(f"{str(input_dir)} is not a valid directory.")
             exit(1)
         try:
             csv_files = glob.glob(os.path.join(input_dir, '*.csv'))
-            self.logger.debug(f'{len(csv_files)} CSV files found')
+            self.logger.debug('%d CSV files found', len(csv_files))
             return csv_files 
         except PermissionError:
             self.logger.error(f"Permission denied for directory: {input_dir}")
@@ -44,61 +91,94 @@ class Helpers:
         archive_dir = self.output_dir / f"{current_datetime}_csv_reports"
         archive_dir.mkdir(parents=True, exist_ok=True)
         return archive_dir
+
+    def create_archiver(self) -> ReportArchiver:
+        return ReportArchiver(self.archive_dir, self.logger, self.metrics, self.is_test, self.archive_compression)
         
-    def archive_csv_files(self) -> None: 
-        self.logger.debug(f'Moving {len(self.csv_files)} CSVs to archive folder {self.archive_dir}')
+    def archive_csv_files(self) -> bool:
+        """Returns False if any report could not be parsed or archived."""
+        csv_files = [csv for csv in self.csv_files if os.fspath(csv) not in self.failed_reports]
+        self.logger.debug('Moving %d CSVs to archive folder %s', len(csv_files), self.archive_dir)
+        archived = self.archiver.commit(csv_files)
+        if self.failed_reports:
+            self.logger.error(f'{len(self.failed_reports)} report(s) could not be parsed and were not archived')
+            return False
+        return archived
+
+    def discard_archive(self) -> None:
+        self.archiver.discard()
+
+    def order_csv_files(self, csv_files:list) -> list:
+        # Oldest report first so newer reports win when they disagree
+        return sorted(csv_files, key=lambda path: (self.report_mtime(path), os.path.basename(path)))
+
+    @staticmethod
+    def report_mtime(path) -> float:
+        return path.mtime if isinstance(path, MemoryReport) else os.path.getmtime(path)
+
+    def parse_reports(self, assetLabelMap:LabelIndex, label_bases_processed:set, workers:int=1, archive:bool=True) -> None:
+        csv_files = self.order_csv_files(self.csv_files)
+        comp_code_whitelist = self.comp_code_whitelist
+        superseded = 0
+        pool = None
+        if workers > 1 and len(csv_files) > 1:
+            # multiprocessing is slow to import and most runs parse serially
+            from concurrent.futures import ProcessPoolExecutor
+            self.logger.debug('Parsing %d CSVs with %d processes', len(csv_files), min(workers, len(csv_files)))
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(csv_files)))
+            # map keeps submission order, so merging is deterministic however the workers finish
+            reports = pool.map(parse_report, csv_files, repeat(comp_code_whitelist))
+        else:
+            reports = (parse_report(csv, comp_code_whitelist) for csv in csv_files)
         try:
-            for file in self.csv_files:
-                if self.is_test:
-                    shutil.copy(file, self.archive_dir)
-                else:
-                    shutil.move(file, self.archive_dir)
-        except Exception as e:
-            self.logger.error(f"Archiving error: {e}")
-
-    def process_csv(self,pathToCsv:str, assetLabelMap: dict, label_bases_processed:set) -> None:
-        self.logger.debug(f'Processing {pathToCsv}')
-        label = ''
-        with self.whitelist_file.open('r') as file:
-            comp_code_whitelist = [line.rstrip().lower() for line in file]
-            self.logger.debug(f'Label whitelist {comp_code_whitelist}')
-        with open(pathToCsv, 'r') as file:
-            csv_reader = csv.DictReader(file)
-            for row in csv_reader:
-                assetId = row['UNITNUMBER']
-                #label = f"{row['DESCRIPTION']} - {determine_severity(row['DUEPERCENT'])}"
-                label_base = row['DESCRIPTION']
-                due_percent = row['DUEPERCENT']
-                comp_code = row['COMPCODE']
-                if assetId:
-                    if comp_code in comp_code_whitelist:
-                        if assetId not in assetLabelMap:
-                            assetLabelMap[assetId] = set()
-                        full_label = f'{label_base} - {due_percent}'
-                        label_bases_processed.add(label_base)
-                        self.logger.debug(f'Adding asset {assetId} and label {full_label} to map')
-                        assetLabelMap[assetId].add(full_label)
-                    else:
-                        self.logger.debug(f'Label {label} not in whitelist. Skipping...')
+            for report in reports:
+                if report.error:
+                    # Archiving it would silently drop its labels from the feed, so it waits for someone to fix it
+                    self.failed_reports.add(os.fspath(report.path_to_csv))
+                elif archive:
+                    # Archive I/O overlaps the rest of the parse and the sync instead of trailing the run
+                    self.archiver.stage(report.path_to_csv)
+                superseded += self.merge_parsed_report(report, assetLabelMap, label_bases_processed)
+        finally:
+            if pool:
+                pool.shutdown()
+        self.metrics.increment('csv_files_parsed', len(csv_files))
+        self.metrics.increment('csv_files_failed', len(self.failed_reports))
+        self.metrics.increment('labels_superseded', superseded)
+        if superseded:
+            self.logger.info(f'{superseded} superseded label(s) dropped in favour of more recent due percentages')
+
+    def process_csv(self,pathToCsv:str, assetLabelMap: LabelIndex, label_bases_processed:set) -> None:
+        self.logger.debug('Processing %s', pathToCsv)
+        report = parse_report(pathToCsv, self.comp_code_whitelist)
+        self.merge_parsed_report(report, assetLabelMap, label_bases_processed)
+
+    def merge_parsed_report(self, report:ParsedReport, assetLabelMap:LabelIndex, label_bases_processed:set) -> int:
+        name = Path(report.path_to_csv).name
+        if report.error:
+            self.logger.error(f'Unable to process CSV: {report.error}')
+            return 0
+        self.metrics.increment('csv_rows_read', report.rows_read)
+        self.metrics.increment('csv_rows_rejected', report.rows_rejected)
+        rows_per_second = report.rows_read / report.elapsed if report.elapsed > 0 else 0.0
+        self.logger.info(f'Processed {report.rows_read} row(s) from {name} in {report.elapsed:.3f}s '
+                         f'({rows_per_second:.0f} rows/s), {report.rows_rejected} malformed row(s) rejected')
+        self.logger.debug('%s has labels for %d asset(s)', name, len(report.labels))
+        return report.superseded + merge_report(report, assetLabelMap, label_bases_processed)
                 
     def determine_severity(self, due_percent:str) -> str:
-        LOW_THRESH = 110
-        MED_THRESH = 180
         self.logger.debug('Determining Severity')
         severity = ''
         if due_percent:
-            due_percent_float = float(due_percent.strip('%'))
-            if due_percent_float <= LOW_THRESH:
-                severity = "LOW"
-            elif due_percent_float > LOW_THRESH and due_percent_float <= MED_THRESH:
-                severity = "MEDIUM"
-            else:
-                severity = "HIGH"
+            # The thresholds live in the severity label policy
+            policy = LabelPolicy.severity()
+            severity = policy.bands[policy.band(float(due_percent.strip('%')))][1]
         
-        self.logger.debug(f'Severity for due percentage {due_percent} was determined to be {severity}')
+        self.logger.debug('Severity for due percentage %s was determined to be %s', due_percent, severity)
         return severity
 
-    def configure_logger(self, log_level_str: str) -> None:
+    def configure_logger(self, log_level_str: str, log_format:str='text') -> None:
+        from logging.handlers import RotatingFileHandler
 
         LOG_LEVEL_MAP = {
             'info': logging.INFO,
@@ -108,7 +188,10 @@ class Helpers:
         new_log_level = LOG_LEVEL_MAP[log_level_str]
 
         self.logger.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+        if log_format == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
         file_handler = RotatingFileHandler(
             f'{self.archive_dir}/app.log',
             mode='a',
@@ -117,6 +200,11 @@ class Helpers:
         )
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(formatter)
+        if self.file_handler:
+            # Replace the previous run's log file rather than writing to both
+            self.logger.removeHandler(self.file_handler)
+            self.file_handler.close()
+        self.file_handler = file_handler
         self.logger.addHandler(file_handler)
         
         if new_log_level != self.logger.getEffectiveLevel():
@@ -0,0 +1,41 @@
+from logging import Logger
+import hashlib
+
+from planner import APPLIED, EXISTS, GONE, LabelOperation
+from state_store import StateStore
+
+class SyncJournal:
+    """Write-ahead journal of the label operations planned and completed by a sync, kept in the state store.
+
+    A run that dies or is interrupted leaves its journal behind. The next run over the same reports resumes from it:
+    journaled assets skip the label fetch and replay only the operations that didn't complete."""
+
+    def __init__(self, state_store:StateStore, logger:Logger, report_hashes:dict, label_bases:set, label_policy:str=''):
+        self.state_store = state_store
+        self.logger = logger
+        # The same reports, label bases and label policy mean the same desired labels, so the journaled plans still hold
+        key = hashlib.sha256('\n'.join(sorted(report_hashes.values()) + sorted(label_bases) + [label_policy]).encode()).hexdigest()
+        self.resumed = state_store.open_journal(key)
+        if self.resumed:
+            pending = sum(1 for _, operations in self.resumed.values() for *_, done in operations if not done)
+            self.logger.info(f'Resuming an unfinished sync: {len(self.resumed)} asset(s) were already planned, '
+                             f'{pending} label operation(s) left to replay')
+
+    def resume(self, asset_id) -> list:
+        """Returns the operations a previous run planned for the asset but didn't complete, None if it never planned the asset."""
+        journaled = self.resumed.get(asset_id)
+        if journaled is None:
+            return None
+        asset_identifier, operations = journaled
+        return [LabelOperation(asset_id, asset_identifier, op, label, label_id) for op, label, label_id, done in operations if not done]
+
+    def planned(self, asset_id, asset_identifier:str, operations:list) -> None:
+        self.state_store.journal_planned(asset_id, asset_identifier, operations)
+
+    def completed(self, operations:list) -> None:
+        done = [operation for operation in operations if operation.result in (APPLIED, EXISTS, GONE)]
+        if done:
+            self.state_store.journal_completed(done)
+
+    def finish(self) -> None:
+        self.state_store.close_journal()
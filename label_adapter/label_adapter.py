@@ -1,56 +1,25 @@
-from datetime import datetime
 from pathlib import Path
 import argparse
-import logging
+import os
 
-from blackberry import BlackBerryAPI
-from helpers import Helpers
+def positive_int(value:str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} must be a positive integer')
+    return number
 
-logger = logging.getLogger(__name__)
+def band_bounds(value:str) -> list:
+    try:
+        return [float(bound.strip().rstrip('%')) for bound in value.split(',') if bound.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} must be a comma-separated list of percentages, e.g. 90,110,180')
 
-def main(helper:Helpers, bb: BlackBerryAPI):    
-    # Get label str per asset from email csvs
-    new_label_map = {}
-    if len(helper.csv_files) <= 0:
-        logger.info(f'No CSV reports found in {helper.input_dir}')
-        return
-    label_bases_processed = set()
-    for csv in helper.csv_files:
-        helper.process_csv(csv, new_label_map, label_bases_processed)
+def reports_waiting(input_dir:Path) -> bool:
+    # Same pattern as Helpers.get_csv_files' glob, but stops at the first match
+    with os.scandir(input_dir) as entries:
+        return any(entry.name.endswith('.csv') and not entry.name.startswith('.') for entry in entries)
 
-    # Get current assets
-    assets = bb.get_assets()
-
-    for asset_id in assets: 
-        asset_identifier = assets[asset_id]
-        logger.info(f'Syncing labels for asset {asset_identifier}')
-        cur_asset_labels = bb.get_asset_labels(asset_id)
-        # Asset id from Blackberry system in report, so skip
-        new_asset_labels = []
-        if asset_identifier in new_label_map:
-            new_asset_labels = new_label_map[asset_identifier]
-        
-        # Delete old labels
-        num_labels_deleted = 0
-        for cur_label in cur_asset_labels:
-            cur_label_base = cur_label[:cur_label.rfind(' - ')]
-            if cur_label_base in label_bases_processed and cur_label not in new_asset_labels:
-                # remove it from asset
-                num_labels_deleted += 1
-                bb.delete_label(asset_id, cur_asset_labels[cur_label])
-            logger.info(f'{num_labels_deleted} label(s) deleted for asset {asset_identifier}')
-        
-        # Add new labels
-        num_labels_added = 0
-        for new_label in new_asset_labels:
-            label_added = bb.add_label(asset_id, new_label)
-            if label_added: num_labels_added += 1
-            logger.info(f'{num_labels_added} label(s) added for asset {asset_identifier}')
-    
-    #Archive the files
-    helper.archive_csv_files()
-
-if __name__ == "__main__":
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Pipe labels from Trimble CSV report to the BlackBerry Radar system.')
     parser.add_argument('report_directory', type=Path, help='Path to the directory to scan for CSV report files from Trimble.')
     parser.add_argument('report_archive_directory', type=Path, help='Path to the directory where CSV reports from Trimble should be moved after processing.')
@@ -58,30 +27,63 @@ if __name__ == "__main__":
     parser.add_argument('-k', '--api-key-file', type=Path, default='label_adapter/key.pem', help='Path to the Blackberry Api key file.')
     parser.add_argument('-l', '--log-level', choices=['info', 'debug', 'error'], default='info', help='Set the log level (default: info)')
     parser.add_argument('-t', '--test-level', choices=['full', 'read_only', 'not_test'], default='not_test', help='Indicates what kind of test will be run, if any. not_test will perform real read and write to BlackBerry servers; read_only will simulate just writing; and full will simulate both read and write.')
+    parser.add_argument('-c', '--concurrency', type=positive_int, default=1, help='Number of assets to sync in parallel (default: 1)')
+    parser.add_argument('--pool-size', type=positive_int, default=None, help='Maximum number of pooled keep-alive connections to the BlackBerry API (default: the larger of 10 and twice --concurrency)')
+    parser.add_argument('--max-retries', type=int, default=5, help='Number of times a request is retried on a 429/5xx response or connection error (default: 5)')
+    parser.add_argument('--page-size', type=positive_int, default=None, help='Number of assets to request per page from the BlackBerry API (default: server default)')
+    parser.add_argument('--dry-run', action='store_true', help='Read current labels and print the planned label changes as JSON without writing anything or archiving the reports.')
+    parser.add_argument('--full-resync', action='store_true', help='Fetch and sync the labels of every asset instead of only the assets whose labels changed since the last run.')
+    parser.add_argument('--full-resync-hours', type=float, default=24, help='Force a full resync when the last one is older than this many hours, to correct drift (default: 24)')
+    parser.add_argument('--asset-cache-hours', type=float, default=24, help='Relist every Radar asset to refresh the cached identifier to asset id directory after this many hours (default: 24)')
+    parser.add_argument('--label-policy', choices=['exact', 'severity', 'bands'], default='exact', help='How due percentages are written: the exact value, LOW/MEDIUM/HIGH severity (up to 110%% and 180%%), or the --label-bands bands (default: exact)')
+    parser.add_argument('--label-bands', type=band_bounds, default=None, help='Band boundaries in percent for --label-policy bands, e.g. 90,110,180')
+    parser.add_argument('--label-hysteresis', type=float, default=0, help='Keep the applied label while the due percentage stays within this many points of it, or of its band (default: 0)')
+    parser.add_argument('--parse-workers', type=positive_int, default=1, help='Number of processes used to parse CSV reports in parallel (default: 1)')
+    parser.add_argument('--api-url', default=None, help='Base URL of the BlackBerry Radar API (default: the production API)')
+    parser.add_argument('--token-url', default=None, help='BlackBerry Radar OAuth token endpoint (default: the production endpoint)')
+    parser.add_argument('--bulk-endpoint', default=None, help='Path of a bulk label endpoint under --api-url, e.g. /labels/batch. Falls back to one request per label if the server does not have it.')
+    parser.add_argument('--bulk-batch-size', type=positive_int, default=100, help='Maximum label operations per bulk request (default: 100)')
+    parser.add_argument('--archive-compression', choices=['gzip', 'zstd', 'none'], default='gzip', help='Compression for reports that are copied into the archive rather than renamed (default: gzip)')
+    parser.add_argument('--read-rate', type=float, default=0, help='Maximum read requests per second to the BlackBerry API, 0 for no limit (default: 0)')
+    parser.add_argument('--write-rate', type=float, default=0, help='Maximum write requests per second to the BlackBerry API, 0 for no limit (default: 0)')
+    parser.add_argument('--adaptive-concurrency', action='store_true', help='Back off the number of in-flight requests on 429s and latency spikes and ramp back up to --concurrency when healthy.')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text', help='Write the log as plain text or as one JSON object per line (default: text)')
+    parser.add_argument('--log-body-limit', type=int, default=2000, help='Truncate logged request and response bodies to this many characters, 0 for no limit (default: 2000)')
+    parser.add_argument('--prometheus-textfile', type=Path, default=None, help='Also write the run metrics to this file in the Prometheus textfile collector format.')
+    parser.add_argument('--daemon', action='store_true', help='Keep running and sync whenever new CSV reports land in report_directory, until SIGTERM.')
+    parser.add_argument('--debounce', type=float, default=5.0, help='In daemon mode, seconds without new files before a burst of reports is synced (default: 5)')
+    parser.add_argument('--poll-interval', type=float, default=10.0, help='In daemon mode, seconds between directory scans where inotify is unavailable (default: 10)')
+    parser.add_argument('--imap-server', default=None, help='Pull Trimble CSV attachments from this IMAP server (SSL) before syncing.')
+    parser.add_argument('--imap-port', type=int, default=993, help='IMAP server port (default: 993)')
+    parser.add_argument('--imap-no-ssl', action='store_true', help='Connect to the IMAP server without SSL, e.g. a local test server.')
+    parser.add_argument('--imap-user', default=None, help='Mailbox login.')
+    parser.add_argument('--imap-password-env', default='IMAP_PASSWORD', help='Environment variable holding the mailbox password (default: IMAP_PASSWORD)')
+    parser.add_argument('--imap-sender', default=None, help='Only take attachments from emails sent by this address.')
+    parser.add_argument('--imap-in-memory', action='store_true', help='Parse attachments in memory instead of saving them to report_directory first. They are still archived.')
+    parser.add_argument('--imap-poll-interval', type=float, default=300, help='In daemon mode, seconds between mailbox checks (default: 300)')
     args = parser.parse_args()
+    if args.imap_server and not (args.imap_user and args.imap_sender):
+        parser.error('--imap-server requires --imap-user and --imap-sender')
+    if args.label_policy == 'bands' and not args.label_bands:
+        parser.error('--label-policy bands requires --label-bands')
+    if args.archive_compression == 'zstd':
+        from archiver import zstd_available
+        if not zstd_available():
+            parser.error('--archive-compression zstd requires the zstandard package')
+    if args.imap_in_memory and args.daemon:
+        parser.error('--imap-in-memory cannot be combined with --daemon, which watches report_directory for the attachments')
+    return args
 
-    whitelist_file = args.white_list_file.resolve()
-    key_file = args.api_key_file.resolve()
-    
-    test_level = args.test_level
+def entry() -> None:
+    args = parse_args()
     input_dir = args.report_directory.resolve()
-    if test_level == 'not_test':
-        max_dirs = 24
-    else:
-        max_dirs = 5
-    helper = Helpers(input_dir, args.report_archive_directory.resolve(), logger, args.log_level, max_dirs, test_level)
-
+    if not (args.daemon or args.imap_server) and input_dir.is_dir() and not reports_waiting(input_dir):
+        # Most scheduled runs find nothing, so leave before importing the pipeline, or creating an archive dir,
+        # a log file or an API client
+        exit(0)
+    # The pipeline's imports take longer than an empty run takes altogether, so they wait for the check above
+    from pipeline import run
+    run(args, input_dir)
 
-    if not whitelist_file.is_file():
-        logger.error(f"{str(whitelist_file)} is not a valid file.")
-        exit(1)
-    if not key_file.is_file():
-        logger.error(f"{str(key_file)} is not a valid file.")
-        exit(1)
-
-    helper.whitelist_file = whitelist_file
-    bb = BlackBerryAPI(key_file, logger, test_level)
-
-    logger.info(f'--------------------------------------\nUpdating labels from CSVs in {str(input_dir)}. Files will be archived to {str(helper.archive_dir)}.')
-    logger.info(f'Test Level: {test_level}')
-    main(helper, bb)
\ No newline at end of file
+if __name__ == "__main__":
+    entry()
\ No newline at end of file
@@ -0,0 +1,108 @@
+from collections.abc import Mapping
+from array import array
+import sys
+
+SEPARATOR = ' - '
+
+def format_label(label_base:str, value:str) -> str:
+    return f'{label_base}{SEPARATOR}{value}'
+
+def split_label(label:str) -> tuple:
+    """'PM Service - 92%' -> ('PM Service', '92%'), (label, None) for a label without a value."""
+    cut = label.rfind(SEPARATOR)
+    if cut < 0:
+        return label, None
+    return label[:cut], label[cut + len(SEPARATOR):]
+
+class LabelTable:
+    """Interns label bases and values: each distinct string is kept once and numbered in the order it was first seen."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def id(self, string:str) -> int:
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def __len__(self):
+        return len(self.strings)
+
+class LabelIndex(Mapping):
+    """Asset identifier -> {label base: value}, e.g. {'PM Service': '92%'}, for fleets of 100k+ assets.
+
+    Each asset is one array of (base id, value id) pairs sorted by base id, the strings live once in a LabelTable.
+    Indexes sharing a table compare assets by their arrays. Lookups build a small dict, labels are only formatted
+    when they are written."""
+    TYPECODE = 'I'
+    EMPTY = array(TYPECODE)
+
+    def __init__(self, table:LabelTable=None):
+        self.table = table or LabelTable()
+        self.records = {}
+        # Remote label -> (base, value), the same labels come back from most of the fleet
+        self._split_cache = {}
+
+    def sibling(self) -> 'LabelIndex':
+        """An empty index sharing this index's table."""
+        return LabelIndex(self.table)
+
+    def copy(self) -> 'LabelIndex':
+        # Records are replaced, never changed in place, so the copy can share them
+        index = self.sibling()
+        index.records = dict(self.records)
+        return index
+
+    def encode(self, labels:dict) -> array:
+        table_id = self.table.id
+        pairs = sorted((table_id(label_base), table_id(value)) for label_base, value in labels.items())
+        return array(self.TYPECODE, [string_id for pair in pairs for string_id in pair])
+
+    def __getitem__(self, asset_identifier) -> dict:
+        record = self.records[asset_identifier]
+        strings = self.table.strings
+        return {strings[record[i]]: strings[record[i + 1]] for i in range(0, len(record), 2)}
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, asset_identifier):
+        return asset_identifier in self.records
+
+    def record(self, asset_identifier) -> array:
+        return self.records.get(asset_identifier, self.EMPTY)
+
+    def replace(self, asset_identifier, labels:dict) -> None:
+        # Interned so indexes built from the reports and from the state store share one copy of each identifier
+        self.records[sys.intern(asset_identifier)] = self.encode(labels)
+
+    def merge(self, asset_identifier, labels:dict) -> int:
+        """Sets the asset's value for each label base in labels. Returns the number of values that changed."""
+        record = self.records.get(asset_identifier)
+        if record is None:
+            self.replace(asset_identifier, labels)
+            return 0
+        current = self[asset_identifier]
+        superseded = sum(1 for label_base, value in labels.items() if current.get(label_base, value) != value)
+        current.update(labels)
+        self.records[asset_identifier] = self.encode(current)
+        return superseded
+
+    def labels(self, asset_identifier) -> set:
+        return {format_label(label_base, value) for label_base, value in self.get(asset_identifier, {}).items()}
+
+    def label_count(self) -> int:
+        return sum(len(record) for record in self.records.values()) // 2
+
+    def split(self, label:str) -> tuple:
+        """split_label, parsing each distinct label once."""
+        parsed = self._split_cache.get(label)
+        if parsed is None:
+            parsed = self._split_cache[label] = split_label(label)
+        return parsed
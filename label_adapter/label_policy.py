@@ -0,0 +1,128 @@
+from typing import Optional
+import math
+
+from label_index import LabelIndex
+
+class LabelStats:
+    def __init__(self):
+        self.labels_rendered = 0
+        # Kept at the previous label by hysteresis
+        self.labels_held = 0
+        # Deletes and adds the exact due percentage label would have needed
+        self.writes_avoided = 0
+
+    def to_dict(self) -> dict:
+        return {
+            'labels_rendered': self.labels_rendered,
+            'labels_held': self.labels_held,
+            'label_writes_avoided': self.writes_avoided
+        }
+
+    def __str__(self):
+        return f'{self.labels_held} label(s) held by hysteresis, {self.writes_avoided} label write(s) avoided'
+
+class LabelPolicy:
+    """Decides the label text for a due percentage.
+
+    The exact policy keeps the report's value, e.g. 'PM Service - 92%'. A banded policy writes the band instead, e.g.
+    'PM Service - MEDIUM', so a truck only gets a new label when it crosses a band boundary. With hysteresis, the label
+    already applied is kept while the due percentage stays within that many points of it, or of its band."""
+    # Helpers.determine_severity's thresholds, upper bounds inclusive
+    SEVERITY_BANDS = ((110.0, 'LOW'), (180.0, 'MEDIUM'), (math.inf, 'HIGH'))
+
+    def __init__(self, bands:tuple=None, hysteresis:float=0.0, name:str='exact'):
+        # (upper bound, band name) in ascending order, the last bound is inf. None writes the exact value.
+        self.bands = bands
+        self.hysteresis = max(0.0, hysteresis)
+        self.name = name
+
+    @classmethod
+    def exact(cls, hysteresis:float=0.0) -> 'LabelPolicy':
+        return cls(None, hysteresis)
+
+    @classmethod
+    def severity(cls, hysteresis:float=0.0) -> 'LabelPolicy':
+        return cls(cls.SEVERITY_BANDS, hysteresis, 'severity')
+
+    @classmethod
+    def from_bounds(cls, bounds:list, hysteresis:float=0.0) -> 'LabelPolicy':
+        """Bands between ascending upper bounds, named like '90% or less', '90-110%' and 'over 180%'."""
+        bounds = sorted(set(float(bound) for bound in bounds))
+        if not bounds:
+            raise ValueError('at least one band boundary is required')
+        labels = [f'{cls.format_percent(bounds[0])}% or less']
+        labels += [f'{cls.format_percent(low)}-{cls.format_percent(high)}%' for low, high in zip(bounds, bounds[1:])]
+        labels.append(f'over {cls.format_percent(bounds[-1])}%')
+        return cls(tuple(zip(bounds + [math.inf], labels)), hysteresis, 'bands ' + ','.join(cls.format_percent(bound) for bound in bounds))
+
+    @staticmethod
+    def format_percent(value:float) -> str:
+        return f'{value:g}'
+
+    @staticmethod
+    def parse_percent(due_percent:str) -> Optional[float]:
+        try:
+            value = float(due_percent.strip().rstrip('%'))
+        except ValueError:
+            return None
+        # 'nan' and 'inf' parse as floats, but fall in no band and can't be ordered
+        return value if math.isfinite(value) else None
+
+    def band(self, value:float) -> int:
+        # NaN is not <= any bound, so like the original severity thresholds it falls through to the top band
+        return next((index for index, (upper, _) in enumerate(self.bands) if value <= upper), len(self.bands) - 1)
+
+    def render(self, due_percent:str) -> str:
+        """The label value for due_percent, e.g. '92%' or 'MEDIUM'."""
+        value = self.parse_percent(due_percent)
+        if self.bands is None or value is None:
+            return due_percent
+        return self.bands[self.band(value)][1]
+
+    def holds(self, previous:str, due_percent:str) -> bool:
+        """True if the label value already applied is still close enough to due_percent to be left alone."""
+        value = self.parse_percent(due_percent)
+        if not self.hysteresis or value is None:
+            return False
+        if self.bands is None:
+            previous_value = self.parse_percent(previous)
+            return previous_value is not None and abs(previous_value - value) <= self.hysteresis
+        for index, (upper, name) in enumerate(self.bands):
+            if name == previous:
+                lower = self.bands[index - 1][0] if index else -math.inf
+                return lower - self.hysteresis < value <= upper + self.hysteresis
+        return False
+
+    def apply(self, new_label_map:LabelIndex, applied_labels:LabelIndex, previous_due_percents:LabelIndex=None) -> tuple:
+        """Replaces the report's due percentages in new_label_map with this policy's label values, in place.
+
+        Returns the due percentages from the reports, as a LabelIndex sharing new_label_map's records, for the next
+        run's stats, and the LabelStats. A write counts as avoided when the due percentage changed since the last run
+        but the label applied then still stands."""
+        stats = LabelStats()
+        due_percents = new_label_map.copy()
+        if self.bands is None and not self.hysteresis:
+            # The exact labels are the due percentages, nothing to render
+            stats.labels_rendered = new_label_map.label_count()
+            return due_percents, stats
+        previous_due_percents = previous_due_percents or {}
+        for asset_identifier, asset_due_percents in due_percents.items():
+            applied = applied_labels.get(asset_identifier, {})
+            previous_values = previous_due_percents.get(asset_identifier, {})
+            rendered = {}
+            for label_base, due_percent in asset_due_percents.items():
+                new_value = self.render(due_percent)
+                applied_value = applied.get(label_base)
+                if applied_value is not None and applied_value != new_value and self.holds(applied_value, due_percent):
+                    new_value = applied_value
+                    stats.labels_held += 1
+                previous_value = previous_values.get(label_base)
+                if new_value == applied_value and previous_value is not None and previous_value != due_percent:
+                    stats.writes_avoided += 2
+                rendered[label_base] = new_value
+            stats.labels_rendered += len(rendered)
+            new_label_map.replace(asset_identifier, rendered)
+        return due_percents, stats
+
+    def __str__(self):
+        return f'{self.name} (hysteresis {self.format_percent(self.hysteresis)})' if self.hysteresis else self.name
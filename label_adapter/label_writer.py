@@ -0,0 +1,112 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from logging import Logger
+import threading
+import time
+
+from blackberry import BlackBerryAPI
+from planner import ADD, APPLIED, EXISTS, FAILED, GONE
+
+class PerLabelWriter:
+    """One request per label. An asset's operations are sent concurrently instead of one after another."""
+
+    def __init__(self, bb:BlackBerryAPI, logger:Logger, pipeline_depth:int=1):
+        self.bb = bb
+        self.logger = logger
+        self.pool = ThreadPoolExecutor(max_workers=pipeline_depth, thread_name_prefix='label-write') if pipeline_depth > 1 else None
+
+    def apply_one(self, operation) -> None:
+        if operation.op == ADD:
+            label_added = self.bb.add_label(operation.asset_id, operation.label)
+            operation.result = APPLIED if label_added else EXISTS if label_added is None else FAILED
+        else:
+            label_deleted = self.bb.delete_label(operation.asset_id, operation.label_id)
+            operation.result = APPLIED if label_deleted else GONE if label_deleted is None else FAILED
+
+    def apply(self, operations:list) -> None:
+        if self.pool is None or len(operations) <= 1:
+            for operation in operations:
+                self.apply_one(operation)
+            return
+        for future in [self.pool.submit(self.apply_one, operation) for operation in operations]:
+            future.result()
+
+    def close(self) -> None:
+        if self.pool:
+            self.pool.shutdown()
+
+class BulkLabelWriter:
+    """Collects the operations of every sync worker into bulk requests of up to batch_size operations.
+    Falls back to per-label calls for good if the server has no bulk endpoint, and for any operation a bulk request left without a result."""
+
+    def __init__(self, bb:BlackBerryAPI, logger:Logger, fallback:PerLabelWriter, batch_size:int=100, max_delay:float=0.05,
+                 max_in_flight:int=4):
+        self.bb = bb
+        self.logger = logger
+        self.fallback = fallback
+        self.batch_size = max(1, batch_size)
+        # How long a partial batch waits for more operations before it is sent anyway
+        self.max_delay = max_delay
+        self.supported = True
+        self.pending = []
+        self.oldest = None
+        self.closing = False
+        self._condition = threading.Condition()
+        self.senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='label-bulk')
+        self.flusher = threading.Thread(target=self.flush_loop, name='label-bulk-flusher', daemon=True)
+        self.flusher.start()
+
+    def apply(self, operations:list) -> None:
+        if not operations:
+            return
+        if not self.supported:
+            return self.fallback.apply(operations)
+        futures = []
+        with self._condition:
+            for operation in operations:
+                future = Future()
+                self.pending.append((operation, future))
+                futures.append(future)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            self._condition.notify()
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def flush_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self.pending or (len(self.pending) < self.batch_size and not self.closing
+                                           and time.monotonic() - self.oldest < self.max_delay):
+                    if self.closing and not self.pending:
+                        return
+                    timeout = None if not self.pending else self.max_delay - (time.monotonic() - self.oldest)
+                    self._condition.wait(timeout)
+                batch = self.pending[:self.batch_size]
+                self.pending = self.pending[self.batch_size:]
+                self.oldest = time.monotonic() if self.pending else None
+            self.senders.submit(self.send, batch)
+
+    def send(self, batch:list) -> None:
+        operations = [operation for operation, _ in batch]
+        try:
+            if self.supported and self.bb.bulk_label_operations(operations) is None:
+                self.logger.warning('Falling back to one request per label')
+                self.supported = False
+            # Whatever the bulk request didn't settle is retried one label at a time
+            unsettled = [operation for operation in operations if operation.result is None]
+            if unsettled:
+                self.fallback.apply(unsettled)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for _, future in batch:
+            future.set_result(None)
+
+    def close(self) -> None:
+        with self._condition:
+            self.closing = True
+            self._condition.notify()
+        self.flusher.join()
+        self.senders.shutdown()
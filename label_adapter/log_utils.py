@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+import logging
+import json
+import re
+
+SECRET_PATTERN = re.compile(r'("(?:access_token|assertion|refresh_token)"\s*:\s*")[^"]*(")')
+BEARER_PATTERN = re.compile(r'(Bearer\s+)[^\s\'",]+')
+
+class LazyMessage:
+    """Defers building an expensive log argument until a handler actually formats the record."""
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+def redact(text) -> str:
+    if text is None:
+        return ''
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', errors='replace')
+    text = SECRET_PATTERN.sub(r'\1***\2', str(text))
+    return BEARER_PATTERN.sub(r'\1***', text)
+
+def redact_headers(headers) -> dict:
+    return {name: ('***' if name.lower() == 'authorization' else value) for name, value in (headers or {}).items()}
+
+def truncate(text:str, limit:int) -> str:
+    if limit and len(text) > limit:
+        return f'{text[:limit]}... [{len(text) - limit} more characters]'
+    return text
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record:logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import threading
+import random
+import json
+import time
+import os
+
+class EndpointStats:
+    # Bounded reservoir so a 50k asset run doesn't keep every latency sample
+    MAX_SAMPLES = 5000
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors_4xx = 0
+        self.errors_5xx = 0
+        self.connection_errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.samples = []
+
+    def add_latency(self, latency:float) -> None:
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if len(self.samples) < self.MAX_SAMPLES:
+            self.samples.append(latency)
+        else:
+            index = random.randrange(self.requests)
+            if index < self.MAX_SAMPLES:
+                self.samples[index] = latency
+
+    def percentile(self, percent:float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(percent / 100 * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors_4xx': self.errors_4xx,
+            'errors_5xx': self.errors_5xx,
+            'connection_errors': self.connection_errors,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency_seconds_total': round(self.latency_total, 6),
+            'latency_seconds_max': round(self.latency_max, 6),
+            'latency_seconds_p50': round(self.percentile(50), 6),
+            'latency_seconds_p99': round(self.percentile(99), 6)
+        }
+
+class Metrics:
+    """Timers and counters for a single run, written out as a machine-readable report."""
+    REPORT_NAME = 'run_report.json'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Starts a new run, e.g. for each cycle of a long-running process."""
+        with self._lock:
+            self.started_at = datetime.now()
+            self.start = time.perf_counter()
+            self.phases = {}
+            self.counters = {}
+            self.endpoints = {}
+            # Priority tier -> seconds from the start of the sync until each asset's labels were applied
+            self.time_to_apply = {}
+
+    @contextmanager
+    def phase(self, name:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def increment(self, name:str, value:int=1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_counter(self, name:str, value) -> None:
+        with self._lock:
+            self.counters[name] = value
+
+    def endpoint(self, name:str) -> EndpointStats:
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints.setdefault(name, EndpointStats())
+        return stats
+
+    def record_request(self, endpoint:str, status_code, latency:float, bytes_sent:int=0, bytes_received:int=0) -> None:
+        with self._lock:
+            stats = self.endpoint(endpoint)
+            stats.requests += 1
+            stats.add_latency(latency)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            if status_code is None:
+                stats.connection_errors += 1
+            elif 400 <= status_code < 500:
+                stats.errors_4xx += 1
+            elif status_code >= 500:
+                stats.errors_5xx += 1
+
+    def record_retry(self, endpoint:str) -> None:
+        with self._lock:
+            self.endpoint(endpoint).retries += 1
+
+    def record_time_to_apply(self, tier:str, seconds:float) -> None:
+        with self._lock:
+            self.time_to_apply.setdefault(tier, []).append(seconds)
+
+    def time_to_apply_stats(self) -> dict:
+        # Called with self._lock held
+        stats = {}
+        for tier, samples in self.time_to_apply.items():
+            ordered = sorted(samples)
+            stats[tier] = {
+                'assets': len(ordered),
+                'seconds_p50': round(ordered[len(ordered) // 2], 6),
+                'seconds_p90': round(ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))], 6),
+                'seconds_max': round(ordered[-1], 6)
+            }
+        return stats
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'duration_seconds': round(time.perf_counter() - self.start, 6),
+                'phases_seconds': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                'counters': dict(self.counters),
+                'endpoints': {name: stats.to_dict() for name, stats in sorted(self.endpoints.items())},
+                'time_to_apply': self.time_to_apply_stats()
+            }
+
+    def to_prometheus(self, report:dict=None) -> str:
+        report = report or self.to_dict()
+        lines = [
+            '# HELP label_adapter_run_duration_seconds Wall time of the last label adapter run.',
+            '# TYPE label_adapter_run_duration_seconds gauge',
+            f"label_adapter_run_duration_seconds {report['duration_seconds']}",
+            '# HELP label_adapter_phase_duration_seconds Time spent in each phase of the last run.',
+            '# TYPE label_adapter_phase_duration_seconds gauge'
+        ]
+        for name, seconds in report['phases_seconds'].items():
+            lines.append(f'label_adapter_phase_duration_seconds{{phase="{name}"}} {seconds}')
+        lines += ['# HELP label_adapter_run_count Counters from the last run.', '# TYPE label_adapter_run_count gauge']
+        for name, value in report['counters'].items():
+            if isinstance(value, (int, float)):
+                lines.append(f'label_adapter_run_count{{name="{name}"}} {value}')
+        lines += ['# HELP label_adapter_endpoint Per-endpoint request statistics from the last run.', '# TYPE label_adapter_endpoint gauge']
+        for endpoint, stats in report['endpoints'].items():
+            for name, value in stats.items():
+                lines.append(f'label_adapter_endpoint{{endpoint="{endpoint}",stat="{name}"}} {value}')
+        lines += ['# HELP label_adapter_time_to_apply Seconds from the start of the sync until assets of each priority tier had their labels applied.',
+                  '# TYPE label_adapter_time_to_apply gauge']
+        for tier, stats in report.get('time_to_apply', {}).items():
+            for name, value in stats.items():
+                lines.append(f'label_adapter_time_to_apply{{tier="{tier}",stat="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, directory:Path, prometheus_file:Path=None) -> Path:
+        report = self.to_dict()
+        report_file = Path(directory) / self.REPORT_NAME
+        report_file.write_text(json.dumps(report, indent=2))
+        if prometheus_file:
+            # Write then rename, so the textfile collector never reads a half-written file
+            prometheus_file = Path(prometheus_file)
+            tmp_file = prometheus_file.with_name(f'.{prometheus_file.name}.tmp')
+            tmp_file.write_text(self.to_prometheus(report))
+            os.replace(tmp_file, prometheus_file)
+        return report_file
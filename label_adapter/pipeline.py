@@ -0,0 +1,334 @@
+from pathlib import Path
+import threading
+import logging
+import signal
+import os
+
+from rate_limiter import AdaptiveConcurrencyLimiter, RateLimiter
+from asset_directory import AssetDirectory
+from blackberry import BlackBerryAPI, RetryPolicy
+from helpers import Helpers
+from journal import SyncJournal
+from label_index import LabelIndex
+from label_policy import LabelPolicy
+from metrics import Metrics
+from state_store import StateStore
+from planner import ADD, DELETE
+from sync import LabelSyncEngine
+from watcher import DirectoryWatcher
+
+logger = logging.getLogger(__name__)
+
+def main(helper:Helpers, bb: BlackBerryAPI, concurrency:int=1, page_size:int=None, dry_run:bool=False,
+         state_store:StateStore=None, full_resync:bool=True, parse_workers:int=1, stop_event:threading.Event=None,
+         asset_cache_hours:float=24.0, bulk_batch_size:int=100, label_policy:LabelPolicy=None) -> bool:
+    """Returns True once the reports have been archived."""
+    # Get label base -> due percent per asset from email csvs
+    new_label_map = LabelIndex()
+    if len(helper.csv_files) <= 0:
+        logger.info(f'No CSV reports found in {helper.input_dir}')
+        return False
+
+    metrics = helper.metrics
+    metrics.set_counter('csv_files_found', len(helper.csv_files))
+    report_hashes = {}
+    # Simulated writes never reached Radar, so nothing about them may be remembered as applied
+    record_store = state_store if bb.do_write else None
+    if state_store:
+        with metrics.phase('hash_reports'):
+            report_hashes = {csv: state_store.hash_file(csv) for csv in helper.csv_files}
+        if not full_resync and state_store.reports_seen(report_hashes):
+            logger.info('All CSV reports were already applied by a previous run. Nothing to sync.')
+            if dry_run:
+                return False
+            with metrics.phase('archive'):
+                return helper.archive_csv_files()
+
+    label_bases_processed = set()
+    with metrics.phase('parse'):
+        helper.parse_reports(new_label_map, label_bases_processed, parse_workers, archive=not dry_run)
+    # Reports that couldn't be parsed stay in report_directory, so they must not be remembered as applied
+    report_hashes = {csv: sha256 for csv, sha256 in report_hashes.items() if os.fspath(csv) not in helper.failed_reports}
+    metrics.set_counter('assets_in_reports', len(new_label_map))
+
+    # Render the labels with the policy, holding labels already applied where hysteresis allows
+    label_policy = label_policy or LabelPolicy.exact()
+    # Loaded into the same table as the reports, so their labels compare by ID
+    applied = state_store.get_applied_labels(label_bases_processed, new_label_map.table) if state_store else new_label_map.sibling()
+    previous_due_percents = state_store.load_due_percents(label_bases_processed, new_label_map.table) if state_store else None
+    due_percents, label_stats = label_policy.apply(new_label_map, applied, previous_due_percents)
+    for name, value in label_stats.to_dict().items():
+        metrics.set_counter(name, value)
+    logger.info(f'Label policy {label_policy}: {label_stats}')
+
+    # Only touch assets whose desired labels changed since they were last applied
+    asset_filter = None
+    if state_store and not full_resync:
+        asset_filter = state_store.changed_assets(new_label_map, label_bases_processed, applied)
+        logger.info(f'{len(asset_filter)} asset(s) have label changes since the last run')
+        metrics.set_counter('assets_changed', len(asset_filter))
+        if not asset_filter:
+            if dry_run:
+                return False
+            if record_store:
+                record_store.record_reports(report_hashes)
+                record_store.save_due_percents(due_percents)
+            with metrics.phase('archive'):
+                return helper.archive_csv_files()
+    elif state_store:
+        logger.info('Running a full resync of all assets')
+
+    directory = AssetDirectory(bb, state_store, logger, asset_cache_hours) if state_store else None
+    if directory and asset_filter is not None:
+        # Only the changed assets are looked up, instead of listing the whole fleet
+        try:
+            assets = directory.lookup(asset_filter, page_size)
+        except Exception as e:
+            # As when the listing fails mid-sync: leave the reports and the journal in place for the next run
+            logger.error(f'Unable to look up the assets to sync: {e}')
+            return False
+        metrics.set_counter('assets_looked_up', len(assets))
+    elif directory:
+        # A full resync lists every asset anyway, so it refreshes the directory for free
+        assets = directory.iter_and_refresh(page_size)
+    else:
+        # Stream current assets page by page and sync labels per asset across the worker pool
+        assets = bb.iter_assets(page_size)
+    # Sync the most overdue assets first, by the highest due percentage in their reports
+    priorities = {}
+    for asset_identifier, asset_due_percents in due_percents.items():
+        values = [value for value in map(LabelPolicy.parse_percent, asset_due_percents.values()) if value is not None]
+        if values:
+            priorities[asset_identifier] = max(values)
+    journal = SyncJournal(record_store, logger, report_hashes, label_bases_processed, str(label_policy)) if record_store and not dry_run else None
+    engine = LabelSyncEngine(bb, logger, new_label_map, label_bases_processed, concurrency, dry_run, record_store, asset_filter, stop_event,
+                             bulk_batch_size, journal, priorities, metrics)
+    with metrics.phase('sync'):
+        summary = engine.run(assets)
+    for name, value in summary.to_dict().items():
+        metrics.set_counter(name, value)
+    metrics.set_counter('planned_adds', engine.plan.count(ADD))
+    metrics.set_counter('planned_deletes', engine.plan.count(DELETE))
+
+    if summary.interrupted or summary.listing_failed:
+        # Leave the reports and the journal in place so the next run finishes the job
+        return False
+
+    if dry_run:
+        # Nothing was written, so leave the reports in place for the real run
+        print(engine.plan.to_json())
+        return False
+
+    if journal:
+        journal.finish()
+    if record_store:
+        record_store.save_due_percents(due_percents)
+    if record_store and not summary.assets_failed:
+        record_store.record_reports(report_hashes)
+        if full_resync:
+            record_store.mark_full_resync()
+    
+    #Archive the files
+    with metrics.phase('archive'):
+        return helper.archive_csv_files()
+
+def create_label_policy(args) -> LabelPolicy:
+    if args.label_policy == 'severity':
+        return LabelPolicy.severity(args.label_hysteresis)
+    if args.label_policy == 'bands':
+        return LabelPolicy.from_bounds(args.label_bands, args.label_hysteresis)
+    return LabelPolicy.exact(args.label_hysteresis)
+
+# The IMAP modules are imported by the functions that use them, so runs without a mailbox never load imaplib and ssl
+
+def open_mailbox(args):
+    from email_processor import email_login
+    password = os.environ.get(args.imap_password_env)
+    if not password:
+        raise ValueError(f'the mailbox password is not set in the {args.imap_password_env} environment variable')
+    return email_login(args.imap_user, password, args.imap_server, args.imap_port, logger, not args.imap_no_ssl)
+
+def mailbox_key(args) -> str:
+    from email_processor import INBOX
+    return f'{args.imap_user}@{args.imap_server}:{args.imap_port}/{INBOX}'
+
+def load_mailbox_cursor(args, state_store:StateStore):
+    from email_processor import MailboxCursor
+    return MailboxCursor(*state_store.get_mailbox_cursor(mailbox_key(args)))
+
+def save_mailbox_cursor(args, state_store:StateStore, cursor) -> None:
+    state_store.set_mailbox_cursor(mailbox_key(args), cursor.uidvalidity, cursor.last_uid)
+
+def close_mailbox(mail) -> None:
+    from email_processor import email_logout
+    import imaplib
+    try:
+        email_logout(mail, logger)
+    except (imaplib.IMAP4.error, OSError) as e:
+        logger.debug('Mailbox logout failed: %s', e)
+
+def download_mailbox(args, download_folder:Path, state_store:StateStore) -> list:
+    """Saves new CSV attachments to download_folder and moves their emails out of the inbox."""
+    from email_processor import download_csv_attachments
+    import imaplib
+    try:
+        mail = open_mailbox(args)
+    except (imaplib.IMAP4.error, OSError, ValueError) as e:
+        logger.error(f'Unable to log in to {args.imap_server}: {e}')
+        return []
+    try:
+        paths, cursor = download_csv_attachments(mail, args.imap_sender, download_folder, logger, load_mailbox_cursor(args, state_store))
+        save_mailbox_cursor(args, state_store, cursor)
+        if paths:
+            logger.info(f'Downloaded {len(paths)} CSV report(s) from {args.imap_server} to {download_folder}')
+        return paths
+    except (imaplib.IMAP4.error, OSError) as e:
+        logger.error(f'Unable to download reports from {args.imap_server}: {e}')
+        return []
+    finally:
+        close_mailbox(mail)
+
+def ingest_mailbox(helper:Helpers, args, state_store:StateStore):
+    """Adds the mailbox's CSV attachments to this run's reports. For streamed reports, returns the open mailbox,
+    the emails to move and the cursor to save once the reports are archived, otherwise (None, [], None)."""
+    from email_processor import stream_csv_attachments
+    import imaplib
+    if not args.imap_in_memory:
+        for path in download_mailbox(args, helper.input_dir, state_store):
+            if path not in helper.csv_files:
+                helper.csv_files.append(path)
+        return None, [], None
+    try:
+        mail = open_mailbox(args)
+    except (imaplib.IMAP4.error, OSError, ValueError) as e:
+        logger.error(f'Unable to log in to {args.imap_server}: {e}')
+        return None, [], None
+    try:
+        reports, uids, cursor = stream_csv_attachments(mail, args.imap_sender, logger, load_mailbox_cursor(args, state_store))
+    except (imaplib.IMAP4.error, OSError) as e:
+        logger.error(f'Unable to download reports from {args.imap_server}: {e}')
+        close_mailbox(mail)
+        return None, [], None
+    if not reports:
+        # Nothing to archive, so there is no reason to look at these emails again
+        save_mailbox_cursor(args, state_store, cursor)
+        close_mailbox(mail)
+        return None, [], None
+    logger.info(f'Streaming {len(reports)} CSV report(s) from {args.imap_server}')
+    helper.csv_files.extend(reports)
+    return mail, uids, cursor
+
+def poll_mailbox(args, download_folder:Path, state_store:StateStore, stop_event:threading.Event) -> None:
+    # Reports land in the watched directory, so the daemon's watcher takes it from there
+    while not stop_event.is_set():
+        try:
+            download_mailbox(args, download_folder, state_store)
+        except Exception:
+            # Same as a failed sync, the poller keeps going and tries again next interval
+            logger.exception('Mailbox check failed')
+        stop_event.wait(args.imap_poll_interval)
+
+def run_once(helper:Helpers, bb:BlackBerryAPI, state_store:StateStore, args, stop_event:threading.Event=None) -> bool:
+    full_resync = args.full_resync or state_store.full_resync_due(args.full_resync_hours)
+    archived = False
+    try:
+        archived = main(helper, bb, args.concurrency, args.page_size, args.dry_run, state_store, full_resync, args.parse_workers, stop_event,
+                        args.asset_cache_hours, args.bulk_batch_size, create_label_policy(args))
+        return archived
+    finally:
+        if not archived:
+            # The reports stay in report_directory, so copies made while they were parsed would only be duplicates
+            helper.discard_archive()
+        try:
+            report_file = helper.metrics.write_report(helper.archive_dir, args.prometheus_textfile)
+            logger.info(f'Run report written to {report_file}')
+        except OSError as e:
+            logger.error(f'Unable to write run report: {e}')
+
+def run_daemon(helper:Helpers, bb:BlackBerryAPI, state_store:StateStore, args) -> None:
+    """Syncs whenever new reports land in the report directory, keeping the API session and tokens warm between runs."""
+    stop_event = threading.Event()
+    def request_shutdown(signum, frame):
+        logger.info(f'Received {signal.Signals(signum).name}, shutting down after in-flight requests finish')
+        stop_event.set()
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    def sync() -> None:
+        try:
+            run_once(helper, bb, state_store, args, stop_event)
+        except Exception:
+            # A bad batch of reports must not stop the daemon
+            logger.exception('Sync run failed')
+
+    watcher = DirectoryWatcher(helper.input_dir, logger, args.debounce, args.poll_interval)
+    if args.imap_server:
+        threading.Thread(target=poll_mailbox, args=(args, helper.input_dir, state_store, stop_event), name='mailbox', daemon=True).start()
+    try:
+        # Reports that arrived while the daemon was down are synced straight away
+        sync()
+        while watcher.wait_for_reports(stop_event):
+            helper.refresh()
+            logger.info(f'New reports in {helper.input_dir}. Files will be archived to {helper.archive_dir}.')
+            sync()
+    finally:
+        watcher.close()
+    logger.info('Daemon stopped')
+
+def run(args, input_dir:Path) -> None:
+    """Sets up the helpers, API client and state store for the parsed arguments, then syncs once or runs the daemon."""
+    whitelist_file = args.white_list_file.resolve()
+    key_file = args.api_key_file.resolve()
+    
+    test_level = args.test_level
+    if test_level == 'not_test':
+        max_dirs = 24
+    else:
+        max_dirs = 5
+    metrics = Metrics()
+    helper = Helpers(input_dir, args.report_archive_directory.resolve(), logger, args.log_level, max_dirs, test_level, args.log_format, metrics,
+                     args.archive_compression)
+
+
+    if not whitelist_file.is_file():
+        logger.error(f"{str(whitelist_file)} is not a valid file.")
+        exit(1)
+    if not key_file.is_file():
+        logger.error(f"{str(key_file)} is not a valid file.")
+        exit(1)
+
+    helper.whitelist_file = whitelist_file
+    # The sync workers and the label writer's pool each keep up to --concurrency requests in flight
+    pool_size = args.pool_size or max(10, 2 * args.concurrency)
+    adaptive_concurrency = AdaptiveConcurrencyLimiter(args.concurrency) if args.adaptive_concurrency else None
+    rate_limiter = RateLimiter(args.read_rate, args.write_rate, adaptive_concurrency)
+    bb = BlackBerryAPI(key_file, logger, test_level, pool_size, RetryPolicy(max_retries=args.max_retries),
+                       base_url=args.api_url or BlackBerryAPI.BASE_URL, token_url=args.token_url or BlackBerryAPI.TOKEN_URL, rate_limiter=rate_limiter, log_body_limit=args.log_body_limit,
+                       metrics=metrics, bulk_endpoint=args.bulk_endpoint)
+
+    logger.info(f'--------------------------------------\nUpdating labels from CSVs in {str(input_dir)}. Files will be archived to {str(helper.archive_dir)}.')
+    logger.info(f'Test Level: {test_level}')
+    # Lives next to the timestamped archive dirs so it survives their rotation. Test runs keep their own, so canned
+    # responses never stand in for the real fleet
+    state_file = 'label_state.sqlite3' if test_level == 'not_test' else f'label_state.{test_level}.sqlite3'
+    state_store = StateStore(helper.output_dir / state_file, logger)
+    try:
+        if args.daemon:
+            run_daemon(helper, bb, state_store, args)
+        else:
+            mail, uids, cursor = ingest_mailbox(helper, args, state_store) if args.imap_server else (None, [], None)
+            archived = run_once(helper, bb, state_store, args)
+            if mail:
+                # Streamed reports only leave the inbox once they are safe in the archive
+                if archived:
+                    from email_processor import PROCESSED, move_processed_emails
+                    import imaplib
+                    try:
+                        move_processed_emails(mail, uids, PROCESSED, logger)
+                        save_mailbox_cursor(args, state_store, cursor)
+                    except (imaplib.IMAP4.error, OSError) as e:
+                        logger.error(f'Unable to move processed emails: {e}')
+                close_mailbox(mail)
+    finally:
+        state_store.close()
+        bb.close()
@@ -0,0 +1,91 @@
+import threading
+import json
+
+from label_index import LabelIndex, format_label
+
+ADD = 'add'
+DELETE = 'delete'
+
+# Per-operation results once a plan has been executed
+APPLIED = 'applied'
+EXISTS = 'exists'
+# A delete of a label that was already gone, e.g. when a journaled delete is replayed
+GONE = 'gone'
+FAILED = 'failed'
+
+class LabelOperation:
+    __slots__ = ('asset_id', 'asset_identifier', 'op', 'label', 'label_id', 'result')
+
+    def __init__(self, asset_id, asset_identifier, op:str, label:str, label_id=None):
+        self.asset_id = asset_id
+        self.asset_identifier = asset_identifier
+        self.op = op
+        self.label = label
+        self.label_id = label_id
+        self.result = None
+
+    def to_dict(self) -> dict:
+        return {
+            'asset_id': self.asset_id,
+            'asset_identifier': self.asset_identifier,
+            'op': self.op,
+            'label': self.label,
+            'label_id': self.label_id,
+            'result': self.result
+        }
+
+    def __repr__(self):
+        return f'LabelOperation({self.asset_identifier}, {self.op}, {self.label!r})'
+
+def group_by_asset(operations:list) -> dict:
+    """Asset id -> its operations, deletes first, keeping the planned order within each asset."""
+    groups = {}
+    for operation in operations:
+        groups.setdefault(operation.asset_id, []).append(operation)
+    for asset_operations in groups.values():
+        asset_operations.sort(key=lambda o: o.op != DELETE)
+    return groups
+
+class LabelPlan:
+    def __init__(self):
+        self.operations = []
+        self._lock = threading.Lock()
+
+    def extend(self, operations:list) -> None:
+        with self._lock:
+            self.operations.extend(operations)
+
+    def count(self, op:str) -> int:
+        return sum(1 for operation in self.operations if operation.op == op)
+
+    def to_json(self, indent:int=2) -> str:
+        # Sorted so the same inputs always serialize to the same plan regardless of worker timing
+        operations = sorted(self.operations, key=lambda o: (str(o.asset_identifier), o.op != DELETE, o.label))
+        return json.dumps({
+            'summary': {ADD: self.count(ADD), DELETE: self.count(DELETE)},
+            'operations': [operation.to_dict() for operation in operations]
+        }, indent=indent)
+
+class LabelPlanner:
+    def __init__(self, new_label_map:LabelIndex, label_bases_processed:set):
+        self.new_label_map = new_label_map
+        self.label_bases_processed = label_bases_processed
+
+    def plan_asset(self, asset_id, asset_identifier, cur_asset_labels:dict) -> list:
+        # Asset id from Blackberry system in report, so skip
+        new_asset_labels = self.new_label_map.get(asset_identifier, {})
+        operations = []
+        current = set()
+
+        # Delete labels from processed reports that are no longer wanted
+        for cur_label, label_id in cur_asset_labels.items():
+            cur_label_base, cur_value = self.new_label_map.split(cur_label)
+            current.add((cur_label_base, cur_value))
+            if cur_value is not None and cur_label_base in self.label_bases_processed and new_asset_labels.get(cur_label_base) != cur_value:
+                operations.append(LabelOperation(asset_id, asset_identifier, DELETE, cur_label, label_id))
+
+        # Add only the labels the asset doesn't already have
+        new_labels = [format_label(label_base, value) for label_base, value in new_asset_labels.items() if (label_base, value) not in current]
+        for new_label in sorted(new_labels):
+            operations.append(LabelOperation(asset_id, asset_identifier, ADD, new_label))
+        return operations
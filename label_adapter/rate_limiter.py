@@ -0,0 +1,113 @@
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate:float, burst:float=None):
+        # A rate of 0 or None means unlimited
+        self.rate = rate or 0.0
+        self.capacity = burst or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Blocks until a token is available and returns the seconds spent waiting."""
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on in-flight requests: grows by one per window of healthy responses,
+    halves on a 429 or a latency spike.
+
+    A spike is a response slower than spike_factor times the baseline, an EWMA of the latency of every answered
+    request. Spikes move the baseline too, so when latency rises and stays up the baseline catches up and the limit
+    recovers, instead of every later response counting as a spike."""
+
+    def __init__(self, max_limit:int, min_limit:int=1, initial_limit:int=None, decrease_factor:float=0.5,
+                 spike_factor:float=3.0, min_spike_latency:float=0.25, decrease_cooldown:float=1.0,
+                 baseline_weight:float=0.1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial_limit or self.max_limit)
+        self.decrease_factor = decrease_factor
+        self.spike_factor = spike_factor
+        self.min_spike_latency = min_spike_latency
+        self.decrease_cooldown = decrease_cooldown
+        self.baseline_weight = baseline_weight
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.decreases = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= max(self.min_limit, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled:bool, latency:float) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            spike = (self.baseline_latency is not None
+                     and latency > max(self.min_spike_latency, self.spike_factor * self.baseline_latency))
+            if throttled or spike:
+                now = time.monotonic()
+                # One decrease per cooldown, otherwise a burst of 429s collapses the limit to the floor
+                if now - self.last_decrease >= self.decrease_cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if not throttled:
+                # 429s and failed requests say nothing about how long a served request takes
+                if self.baseline_latency is None:
+                    self.baseline_latency = latency
+                else:
+                    self.baseline_latency += self.baseline_weight * (latency - self.baseline_latency)
+            self._condition.notify_all()
+
+class RateLimiter:
+    """Request budget shared by every BlackBerryAPI call, with separate read and write buckets."""
+
+    OVERLOAD_STATUS_CODES = (None, 429, 503)
+
+    def __init__(self, read_rate:float=0.0, write_rate:float=0.0, concurrency:AdaptiveConcurrencyLimiter=None):
+        self.read_bucket = TokenBucket(read_rate)
+        self.write_bucket = TokenBucket(write_rate)
+        self.concurrency = concurrency
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, write_scope:bool) -> None:
+        (self.write_bucket if write_scope else self.read_bucket).acquire()
+        if self.concurrency:
+            self.concurrency.acquire()
+
+    def release(self, status_code, latency:float) -> None:
+        # status_code is None when the request never got a response
+        if status_code == 429:
+            with self._lock:
+                self.throttled += 1
+        if self.concurrency:
+            self.concurrency.release(status_code in self.OVERLOAD_STATUS_CODES, latency)
+
+    def __str__(self):
+        res = f'{self.throttled} throttled response(s)'
+        if self.concurrency:
+            res += (f', adaptive concurrency at {int(self.concurrency.limit)} of {self.concurrency.max_limit} '
+                    f'after {self.concurrency.decreases} decrease(s)')
+        return res
@@ -0,0 +1,259 @@
+from datetime import datetime, timedelta
+from operator import itemgetter
+from itertools import groupby
+from logging import Logger
+from pathlib import Path
+import threading
+import hashlib
+import sqlite3
+import time
+
+from asset_directory import normalize_identifier
+from csv_ingest import MemoryReport
+from label_index import LabelIndex, LabelTable, format_label, split_label
+
+class StateStore:
+    COMMIT_EVERY = 500
+    # Commits are also grouped by time, so a crash loses at most this much of the journal, which the next run redoes
+    COMMIT_INTERVAL = 0.5
+
+    def __init__(self, db_file:Path, logger:Logger):
+        self.db_file = db_file
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        # Shared by the sync workers, every access goes through self._lock
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS applied_labels (
+                asset_identifier TEXT NOT NULL,
+                label_base TEXT NOT NULL,
+                label TEXT NOT NULL,
+                PRIMARY KEY (asset_identifier, label_base, label)
+            );
+            CREATE TABLE IF NOT EXISTS report_hashes (
+                sha256 TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                processed_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS asset_directory (
+                identifier TEXT PRIMARY KEY,
+                asset_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS due_percents (
+                asset_identifier TEXT NOT NULL,
+                label_base TEXT NOT NULL,
+                due_percent TEXT NOT NULL,
+                PRIMARY KEY (asset_identifier, label_base)
+            );
+            CREATE TABLE IF NOT EXISTS journal_assets (
+                asset_id TEXT PRIMARY KEY,
+                asset_identifier TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS journal_operations (
+                asset_id TEXT NOT NULL,
+                op TEXT NOT NULL,
+                label TEXT NOT NULL,
+                label_id TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (asset_id, op, label)
+            );
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def hash_file(path) -> str:
+        if isinstance(path, MemoryReport):
+            return hashlib.sha256(path.data).hexdigest()
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def reports_seen(self, report_hashes:dict) -> bool:
+        """Returns True if every report hash has already been applied by a previous run."""
+        if not report_hashes:
+            return False
+        with self._lock:
+            for sha256 in report_hashes.values():
+                row = self.conn.execute('SELECT 1 FROM report_hashes WHERE sha256 = ?', (sha256,)).fetchone()
+                if row is None:
+                    return False
+        return True
+
+    def record_reports(self, report_hashes:dict) -> None:
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO report_hashes (sha256, file_name, processed_at) VALUES (?, ?, ?)',
+                [(sha256, Path(path).name, now) for path, sha256 in report_hashes.items()]
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def index_rows(rows, label_bases:set, table:LabelTable=None) -> LabelIndex:
+        """Loads (asset identifier, label base, value) rows, sorted by asset identifier, into a LabelIndex."""
+        index = LabelIndex(table)
+        for asset_identifier, group in groupby(rows, key=itemgetter(0)):
+            labels = {label_base: value for _, label_base, value in group if label_base in label_bases}
+            if labels:
+                # Rows written before identifiers were normalized still count for their asset
+                index.merge(normalize_identifier(asset_identifier), labels)
+        return index
+
+    def get_applied_labels(self, label_bases:set, table:LabelTable=None) -> LabelIndex:
+        with self._lock:
+            # Streamed off the cursor, only the index is ever held in memory
+            rows = self.conn.execute('SELECT asset_identifier, label_base, label FROM applied_labels ORDER BY asset_identifier')
+            return self.index_rows(((asset_identifier, label_base, split_label(label)[1]) for asset_identifier, label_base, label in rows),
+                                   label_bases, table)
+
+    def changed_assets(self, new_label_map:LabelIndex, label_bases_processed:set, applied:LabelIndex=None) -> set:
+        """Returns the identifiers whose desired labels differ from what was last applied."""
+        if applied is None:
+            applied = self.get_applied_labels(label_bases_processed, new_label_map.table)
+        # Both indexes share a table, so equal labels are equal records
+        return {asset_identifier for asset_identifier in new_label_map.records.keys() | applied.records.keys()
+                if new_label_map.record(asset_identifier) != applied.record(asset_identifier)}
+
+    def record_asset(self, asset_identifier:str, label_bases:set, labels:dict) -> None:
+        """Records the labels applied to an asset, label base -> value."""
+        # Only the processed label bases are replaced, labels from other reports are kept
+        with self._lock:
+            self.conn.executemany(
+                'DELETE FROM applied_labels WHERE asset_identifier = ? AND label_base = ?',
+                [(asset_identifier, label_base) for label_base in label_bases]
+            )
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO applied_labels (asset_identifier, label_base, label) VALUES (?, ?, ?)',
+                [(asset_identifier, label_base, format_label(label_base, value)) for label_base, value in labels.items()]
+            )
+            self._commit_batched()
+
+    def _commit_batched(self, writes:int=1) -> None:
+        # Called with self._lock held
+        self._pending += writes
+        if self._pending >= self.COMMIT_EVERY or time.monotonic() - self._last_commit >= self.COMMIT_INTERVAL:
+            self.conn.commit()
+            self._pending = 0
+            self._last_commit = time.monotonic()
+
+    def load_due_percents(self, label_bases:set, table:LabelTable=None) -> LabelIndex:
+        """Returns the due percentages of the last run, asset identifier -> label base -> due percent."""
+        with self._lock:
+            rows = self.conn.execute('SELECT asset_identifier, label_base, due_percent FROM due_percents ORDER BY asset_identifier')
+            return self.index_rows(rows, label_bases, table)
+
+    def save_due_percents(self, due_percents:LabelIndex) -> None:
+        with self._lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO due_percents (asset_identifier, label_base, due_percent) VALUES (?, ?, ?)',
+                [(asset_identifier, label_base, due_percent) for asset_identifier, bases in due_percents.items()
+                 for label_base, due_percent in bases.items()]
+            )
+            self.conn.commit()
+
+    def full_resync_due(self, interval_hours:float) -> bool:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'last_full_resync'").fetchone()
+        if row is None:
+            return True
+        return datetime.now() - datetime.fromisoformat(row[0]) >= timedelta(hours=interval_hours)
+
+    def mark_full_resync(self) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_full_resync', ?)",
+                (datetime.now().isoformat(timespec='seconds'),)
+            )
+            self.conn.commit()
+
+    def load_asset_directory(self) -> tuple:
+        """Returns the cached identifier -> asset id map and when it was refreshed, None if never."""
+        with self._lock:
+            assets = dict(self.conn.execute('SELECT identifier, asset_id FROM asset_directory').fetchall())
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'asset_directory_refreshed_at'").fetchone()
+        return assets, datetime.fromisoformat(row[0]) if row else None
+
+    def save_asset_directory(self, assets:dict) -> None:
+        with self._lock:
+            self.conn.execute('DELETE FROM asset_directory')
+            self.conn.executemany('INSERT INTO asset_directory (identifier, asset_id) VALUES (?, ?)', assets.items())
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('asset_directory_refreshed_at', ?)",
+                (datetime.now().isoformat(timespec='seconds'),)
+            )
+            self.conn.commit()
+
+    def get_mailbox_cursor(self, mailbox:str) -> tuple:
+        """Returns the (uidvalidity, last_uid) saved for a mailbox, (0, 0) if it was never fetched."""
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (f'mailbox_cursor:{mailbox}',)).fetchone()
+        if row is None:
+            return 0, 0
+        uidvalidity, last_uid = row[0].split(':')
+        return int(uidvalidity), int(last_uid)
+
+    def set_mailbox_cursor(self, mailbox:str, uidvalidity:int, last_uid:int) -> None:
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                (f'mailbox_cursor:{mailbox}', f'{uidvalidity}:{last_uid}')
+            )
+            self.conn.commit()
+
+    def open_journal(self, key:str) -> dict:
+        """Returns the journal left by an unfinished run over the same reports, as asset id -> (identifier, operations)
+        where each operation is (op, label, label_id, done). A journal for other reports is stale and is cleared."""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'journal'").fetchone()
+            if row is None or row[0] != key:
+                self.conn.execute('DELETE FROM journal_operations')
+                self.conn.execute('DELETE FROM journal_assets')
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('journal', ?)", (key,))
+                self.conn.commit()
+                return {}
+            journal = {asset_id: (asset_identifier, []) for asset_id, asset_identifier in
+                       self.conn.execute('SELECT asset_id, asset_identifier FROM journal_assets')}
+            for asset_id, op, label, label_id, done in self.conn.execute('SELECT asset_id, op, label, label_id, done FROM journal_operations'):
+                if asset_id in journal:
+                    journal[asset_id][1].append((op, label, label_id, bool(done)))
+        return journal
+
+    def journal_planned(self, asset_id, asset_identifier:str, operations:list) -> None:
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO journal_assets (asset_id, asset_identifier) VALUES (?, ?)', (asset_id, asset_identifier))
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO journal_operations (asset_id, op, label, label_id, done) VALUES (?, ?, ?, ?, 0)',
+                [(asset_id, o.op, o.label, o.label_id) for o in operations]
+            )
+            self._commit_batched(len(operations) + 1)
+
+    def journal_completed(self, operations:list) -> None:
+        with self._lock:
+            self.conn.executemany(
+                'UPDATE journal_operations SET done = 1 WHERE asset_id = ? AND op = ? AND label = ?',
+                [(o.asset_id, o.op, o.label) for o in operations]
+            )
+            self._commit_batched(len(operations))
+
+    def close_journal(self) -> None:
+        with self._lock:
+            self.conn.execute('DELETE FROM journal_operations')
+            self.conn.execute('DELETE FROM journal_assets')
+            self.conn.execute("DELETE FROM meta WHERE key = 'journal'")
+            self.conn.commit()
+            self._pending = 0
+            self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
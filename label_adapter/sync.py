@@ -0,0 +1,219 @@
+from logging import Logger
+from queue import PriorityQueue
+import itertools
+import threading
+import math
+import time
+
+from asset_directory import normalize_identifier
+from blackberry import BlackBerryAPI
+from label_index import LabelIndex
+from label_policy import LabelPolicy
+from label_writer import BulkLabelWriter, PerLabelWriter
+from metrics import Metrics
+from planner import ADD, APPLIED, DELETE, FAILED, LabelPlan, LabelPlanner
+from state_store import StateStore
+
+class SyncSummary:
+    def __init__(self):
+        self.assets_synced = 0
+        self.assets_failed = 0
+        self.labels_added = 0
+        self.labels_deleted = 0
+        self.labels_failed = 0
+        self.assets_skipped = 0
+        # Set when a shutdown stopped the run before every asset was synced
+        self.interrupted = False
+        # Set when the assets could not all be listed, so part of the fleet was never synced
+        self.listing_failed = False
+        self._lock = threading.Lock()
+
+    def record(self, added:int, deleted:int, failed:int) -> None:
+        with self._lock:
+            self.assets_synced += 1
+            self.labels_added += added
+            self.labels_deleted += deleted
+            self.labels_failed += failed
+
+    def record_failed_asset(self) -> None:
+        with self._lock:
+            self.assets_failed += 1
+
+    def record_skipped_asset(self) -> None:
+        with self._lock:
+            self.assets_skipped += 1
+
+    def to_dict(self) -> dict:
+        return {
+            'assets_synced': self.assets_synced,
+            'assets_failed': self.assets_failed,
+            'assets_skipped': self.assets_skipped,
+            'labels_added': self.labels_added,
+            'labels_deleted': self.labels_deleted,
+            'labels_failed': self.labels_failed
+        }
+
+    def __str__(self):
+        return (f'{self.assets_synced} asset(s) synced, {self.assets_failed} asset(s) failed, '
+                f'{self.assets_skipped} unchanged asset(s) skipped, '
+                f'{self.labels_added} label(s) added, {self.labels_deleted} label(s) deleted, '
+                f'{self.labels_failed} label operation(s) failed')
+
+class PlanExecutor:
+    def __init__(self, bb:BlackBerryAPI, logger:Logger, writer=None):
+        self.bb = bb
+        self.logger = logger
+        self.writer = writer or PerLabelWriter(bb, logger)
+
+    def execute(self, operations:list):
+        self.writer.apply(operations)
+        num_labels_added = 0
+        num_labels_deleted = 0
+        num_labels_failed = 0
+        # Each operation carries its own result, an existing label is neither added nor failed
+        for operation in operations:
+            if operation.result == APPLIED:
+                if operation.op == DELETE:
+                    num_labels_deleted += 1
+                else:
+                    num_labels_added += 1
+            elif operation.result in (FAILED, None):
+                num_labels_failed += 1
+        return num_labels_added, num_labels_deleted, num_labels_failed
+
+class LabelSyncEngine:
+    # Priority tier of assets the reports give no due percentage for, e.g. assets that only lose labels
+    NO_TIER = 'none'
+
+    def __init__(self, bb:BlackBerryAPI, logger:Logger, new_label_map:LabelIndex, label_bases_processed:set, concurrency:int=1, dry_run:bool=False,
+                 state_store:StateStore=None, asset_filter:set=None, stop_event:threading.Event=None, bulk_batch_size:int=100,
+                 journal=None, priorities:dict=None, metrics:Metrics=None):
+        self.bb = bb
+        self.logger = logger
+        self.new_label_map = new_label_map
+        self.label_bases_processed = label_bases_processed
+        self.state_store = state_store
+        # None syncs every asset, otherwise only identifiers in the set are touched
+        self.asset_filter = asset_filter
+        self.planner = LabelPlanner(new_label_map, label_bases_processed)
+        self.executor = None
+        self.concurrency = max(1, concurrency)
+        self.bulk_batch_size = bulk_batch_size
+        self.dry_run = dry_run
+        self.plan = LabelPlan()
+        self.stop_event = stop_event or threading.Event()
+        self.journal = journal
+        # Asset identifier -> highest due percentage in the reports, the most overdue assets are synced first
+        self.priorities = priorities or {}
+        self.metrics = metrics or Metrics()
+        self.started = time.monotonic()
+
+    def run(self, assets) -> SyncSummary:
+        # assets is any iterable of (asset_id, asset_identifier), so work can start
+        # on the first page while later pages are still being fetched
+        summary = SyncSummary()
+        self.logger.debug('Syncing assets with %d worker(s)', self.concurrency)
+        writer = self.create_writer()
+        self.executor = PlanExecutor(self.bb, self.logger, writer)
+        self.started = time.monotonic()
+        # The workers always take the most overdue asset listed so far, the counter keeps listing order among equals
+        queue = PriorityQueue()
+        order = itertools.count()
+        workers = [threading.Thread(target=self.drain, args=(queue, summary), name=f'label-sync_{index}', daemon=True)
+                   for index in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        try:
+            for asset_id, asset_identifier in assets:
+                if self.stop_event.is_set():
+                    summary.interrupted = True
+                    break
+                asset_identifier = normalize_identifier(asset_identifier)
+                if self.asset_filter is not None and asset_identifier not in self.asset_filter:
+                    summary.record_skipped_asset()
+                    continue
+                queue.put((-self.priorities.get(asset_identifier, -math.inf), next(order), asset_id, asset_identifier))
+        except Exception as e:
+            # The assets already listed are still synced, but the run is not complete
+            summary.listing_failed = True
+            self.logger.error('Unable to list the assets to sync: %s', e)
+        finally:
+            # Sorted after every asset, one per worker
+            for _ in workers:
+                queue.put((math.inf, next(order), None, None))
+            for worker in workers:
+                worker.join()
+            writer.close()
+        if summary.interrupted:
+            self.logger.warning('Sync interrupted by shutdown: %s', summary)
+        elif summary.listing_failed:
+            self.logger.error('Sync incomplete, not every asset could be listed: %s', summary)
+        elif self.dry_run:
+            self.logger.info(f'Dry run planned {self.plan.count(DELETE)} delete(s) and {self.plan.count(ADD)} add(s)')
+        else:
+            self.logger.info('Sync complete: %s', summary)
+        return summary
+
+    def create_writer(self):
+        per_label = PerLabelWriter(self.bb, self.logger, self.concurrency)
+        if self.bb.bulk_endpoint and not self.dry_run:
+            # Writes from every worker are batched together, so even one label per asset fills a batch
+            return BulkLabelWriter(self.bb, self.logger, per_label, self.bulk_batch_size, max_in_flight=self.concurrency)
+        return per_label
+
+    def drain(self, queue:PriorityQueue, summary:SyncSummary) -> None:
+        while True:
+            _, _, asset_id, asset_identifier = queue.get()
+            if asset_id is None:
+                return
+            self.sync_asset_isolated(asset_id, asset_identifier, summary)
+
+    def tier(self, asset_identifier) -> str:
+        due_percent = self.priorities.get(asset_identifier)
+        if due_percent is None:
+            return self.NO_TIER
+        # NaN compares false against every bound
+        return next((name for upper, name in LabelPolicy.SEVERITY_BANDS if due_percent <= upper), self.NO_TIER)
+
+    def sync_asset_isolated(self, asset_id, asset_identifier, summary:SyncSummary) -> None:
+        # One bad asset must not take the rest of the fleet down with it
+        if self.stop_event.is_set():
+            # Queued but not started before shutdown; the next run picks it up
+            summary.interrupted = True
+            return
+        try:
+            added, deleted, failed = self.sync_asset(asset_id, asset_identifier)
+            summary.record(added, deleted, failed)
+        except Exception as e:
+            summary.record_failed_asset()
+            self.logger.error('Failed to sync labels for asset %s (%s): %s', asset_identifier, asset_id, e)
+
+    def sync_asset(self, asset_id, asset_identifier):
+        operations = self.journal.resume(asset_id) if self.journal else None
+        if operations is None:
+            self.logger.info('Syncing labels for asset %s', asset_identifier)
+            cur_asset_labels = self.bb.get_asset_labels(asset_id)
+            if cur_asset_labels is None:
+                # Fails the asset, so it is neither journaled nor recorded as in sync
+                raise RuntimeError('unable to retrieve its current labels')
+            operations = self.planner.plan_asset(asset_id, asset_identifier, cur_asset_labels)
+            if self.journal:
+                # Written ahead of the requests, so a crash can replay them without fetching the labels again
+                self.journal.planned(asset_id, asset_identifier, operations)
+        else:
+            self.logger.info('Replaying %d journaled label operation(s) for asset %s', len(operations), asset_identifier)
+        self.plan.extend(operations)
+        if self.dry_run:
+            return 0, 0, 0
+
+        added, deleted, failed = self.executor.execute(operations)
+        if self.journal:
+            self.journal.completed(operations)
+        if operations:
+            self.metrics.record_time_to_apply(self.tier(asset_identifier), time.monotonic() - self.started)
+        self.logger.info('%d label(s) deleted for asset %s', deleted, asset_identifier)
+        self.logger.info('%d label(s) added for asset %s', added, asset_identifier)
+        if self.state_store and not failed:
+            # Only remember fully applied assets so failures are retried next run
+            self.state_store.record_asset(asset_identifier, self.label_bases_processed, self.new_label_map.get(asset_identifier, {}))
+        return added, deleted, failed
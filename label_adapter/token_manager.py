@@ -0,0 +1,86 @@
+from typing import Callable, Optional
+from logging import Logger
+from pathlib import Path
+import threading
+import time
+
+class AccessToken:
+    __slots__ = ('value', 'expires_at')
+
+    def __init__(self, value:str, expires_at:float):
+        self.value = value
+        self.expires_at = expires_at
+
+class TokenManager:
+    CLIENT_ID = '74d61af0-b906-434c-b6e7-8c00acbd575e'
+    AUDIENCE = 'https://oauth2.radar.blackberry.com'
+    # Used when the token endpoint doesn't say how long the token lives
+    DEFAULT_TTL = 600
+
+    def __init__(self, key_file:Path, logger:Logger, fetch_token:Callable[[bool], Optional[dict]], refresh_margin:float=60.0):
+        self.key_file = key_file
+        self.logger = logger
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.private_key = None
+        self.key_lock = threading.Lock()
+        # One cached token and one lock per scope so read and write tokens never evict each other
+        self.tokens = {'read': None, 'write': None}
+        self.locks = {'read': threading.Lock(), 'write': threading.Lock()}
+
+    def get_private_key(self):
+        with self.key_lock:
+            if self.private_key is None:
+                # Imported on first use, runs that never call the API don't pay for cryptography
+                from cryptography.hazmat.primitives import serialization
+                from cryptography.hazmat.backends import default_backend
+                self.logger.debug('Loading private key from %s', self.key_file)
+                with self.key_file.open("rb") as key_file:
+                    self.private_key = serialization.load_pem_private_key(
+                        key_file.read(),
+                        password=None,  # If your key has a password, add it here
+                        backend=default_backend()
+                    )
+            return self.private_key
+
+    def build_assertion(self) -> str:
+        from uuid import uuid4
+        now = int(time.time())
+        payload = {
+            "jti": str(uuid4()),
+            "iss": self.CLIENT_ID,
+            "sub": self.CLIENT_ID,
+            "aud": self.AUDIENCE,
+            "iat": now,
+            "exp": now + 60
+        }
+        import jwt
+        # JWT Generation with ES256
+        return jwt.encode(payload=payload, key=self.get_private_key(), algorithm="ES256")
+
+    def get_token(self, write_scope:bool=False) -> Optional[str]:
+        scope = 'write' if write_scope else 'read'
+        with self.locks[scope]:
+            token = self.tokens[scope]
+            if token is None or time.monotonic() >= token.expires_at - self.refresh_margin:
+                token = self.refresh(scope, write_scope)
+            return token.value if token else None
+
+    def refresh(self, scope:str, write_scope:bool) -> Optional[AccessToken]:
+        self.logger.debug('Refreshing %s access token', scope)
+        res_json = self.fetch_token(write_scope)
+        if not res_json or not res_json.get('access_token'):
+            self.tokens[scope] = None
+            return None
+        expires_in = res_json.get('expires_in') or self.DEFAULT_TTL
+        token = AccessToken(res_json['access_token'], time.monotonic() + float(expires_in))
+        self.tokens[scope] = token
+        return token
+
+    def invalidate(self, write_scope:bool, rejected_token:Optional[str]) -> None:
+        # Only drop the token that was rejected, in case another worker already replaced it
+        scope = 'write' if write_scope else 'read'
+        with self.locks[scope]:
+            token = self.tokens[scope]
+            if token is not None and token.value == rejected_token:
+                self.tokens[scope] = None
@@ -0,0 +1,131 @@
+from logging import Logger
+from pathlib import Path
+import ctypes.util
+import threading
+import ctypes
+import select
+import struct
+import time
+import os
+
+class InotifyWatch:
+    """Close-write and moved-in events for one directory, straight from the Linux inotify API."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directory:Path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), str(directory))
+
+    def read(self, timeout:float) -> list:
+        """Returns the names written or moved into the directory, or None if the kernel queue overflowed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class DirectoryWatcher:
+    """Waits for new or rewritten CSV reports in a directory, then for the burst of files to settle.
+
+    Uses inotify where the platform has it and falls back to comparing directory snapshots."""
+
+    def __init__(self, directory:Path, logger:Logger, debounce:float=5.0, poll_interval:float=10.0, max_wait:float=60.0):
+        self.directory = directory
+        self.logger = logger
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # A steady trickle of files must not postpone the sync forever
+        self.max_wait = max(max_wait, debounce)
+        self.snapshot = self.take_snapshot()
+        self.inotify = None
+        try:
+            self.inotify = InotifyWatch(directory)
+            self.logger.info('Watching %s for new reports with inotify', directory)
+        except (OSError, AttributeError) as e:
+            self.logger.info('inotify unavailable (%s), polling %s every %ss for new reports', e, directory, poll_interval)
+
+    def take_snapshot(self) -> dict:
+        snapshot = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith('.csv') and entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            self.logger.error(f'Unable to scan {self.directory}: {e}')
+        return snapshot
+
+    def poll_changes(self, timeout:float, stop_event:threading.Event) -> bool:
+        deadline = time.monotonic() + timeout
+        # Sleep in short steps so a shutdown request is noticed promptly
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+        snapshot = self.take_snapshot()
+        # Removals are our own archiving and never need a sync
+        changed = any(self.snapshot.get(name) != stat for name, stat in snapshot.items())
+        self.snapshot = snapshot
+        return changed
+
+    def inotify_changes(self, timeout:float, stop_event:threading.Event) -> bool:
+        deadline = time.monotonic() + timeout
+        while not stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            names = self.inotify.read(min(0.5, remaining))
+            if names is None:
+                self.logger.warning('inotify queue overflowed, rescanning %s', self.directory)
+                return True
+            if any(name.lower().endswith('.csv') for name in names):
+                return True
+        return False
+
+    def changes(self, timeout:float, stop_event:threading.Event) -> bool:
+        if self.inotify:
+            return self.inotify_changes(timeout, stop_event)
+        return self.poll_changes(timeout, stop_event)
+
+    def wait_for_reports(self, stop_event:threading.Event) -> bool:
+        """Blocks until reports arrive and the directory has been quiet for the debounce period.
+        Returns False when stop_event was set instead."""
+        while not stop_event.is_set():
+            if not self.changes(self.poll_interval, stop_event):
+                continue
+            first_change = time.monotonic()
+            self.logger.debug('New reports in %s, waiting %ss for more', self.directory, self.debounce)
+            while not stop_event.is_set() and time.monotonic() - first_change < self.max_wait:
+                if not self.changes(self.debounce, stop_event):
+                    break
+            return not stop_event.is_set()
+        return False
+
+    def close(self) -> None:
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
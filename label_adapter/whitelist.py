@@ -0,0 +1,43 @@
+from pathlib import Path
+import fnmatch
+import re
+
+class ComponentCodeWhitelist:
+    WILDCARD_CHARS = ('*', '?', '[')
+
+    def __init__(self, codes):
+        exact_codes = set()
+        patterns = []
+        for code in codes:
+            code = self.normalize(code)
+            if not code or code.startswith('#'):
+                continue
+            if any(char in code for char in self.WILDCARD_CHARS):
+                patterns.append(code)
+            else:
+                exact_codes.add(code)
+        self.codes = frozenset(exact_codes)
+        self.patterns = tuple(patterns)
+        # All wildcard families share one compiled regex, so a miss costs a single match call
+        self.matcher = re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns)) if patterns else None
+
+    @classmethod
+    def from_file(cls, whitelist_file:Path) -> 'ComponentCodeWhitelist':
+        with Path(whitelist_file).open('r') as file:
+            return cls(file)
+
+    @staticmethod
+    def normalize(code:str) -> str:
+        return code.strip().lower()
+
+    def __contains__(self, code:str) -> bool:
+        code = self.normalize(code)
+        if code in self.codes:
+            return True
+        return self.matcher is not None and self.matcher.match(code) is not None
+
+    def __len__(self):
+        return len(self.codes) + len(self.patterns)
+
+    def __repr__(self):
+        return f'ComponentCodeWhitelist(codes={sorted(self.codes)}, patterns={list(self.patterns)})'
@@ -0,0 +1,107 @@
+from unittest import mock
+from pathlib import Path
+import tempfile
+import unittest
+import hashlib
+import logging
+import errno
+import gzip
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from archiver import ReportArchiver
+from csv_ingest import MemoryReport
+from metrics import Metrics
+
+logger = logging.getLogger('label_adapter.tests')
+
+REPORT = b'UNITNUMBER,DUEPERCENT\n26706,92%\n'
+
+class ReportArchiverTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.report_dir = Path(directory.name) / 'reports'
+        self.archive_dir = Path(directory.name) / 'archive'
+        self.report_dir.mkdir()
+        self.archive_dir.mkdir()
+        self.metrics = Metrics()
+
+    def archiver(self, **kwargs) -> ReportArchiver:
+        archiver = ReportArchiver(self.archive_dir, logger, self.metrics, **kwargs)
+        self.addCleanup(archiver.pool.shutdown)
+        return archiver
+
+    def report(self, name:str, data:bytes=REPORT) -> Path:
+        path = self.report_dir / name
+        path.write_bytes(data)
+        return path
+
+    def manifest(self) -> list:
+        return (self.archive_dir / ReportArchiver.MANIFEST).read_text().splitlines()
+
+    def test_same_filesystem_renames_on_commit(self):
+        archiver = self.archiver()
+        report = self.report('a.csv')
+        archiver.stage(report)
+        # Nothing moves until the run has applied the report
+        self.assertTrue(report.is_file())
+        self.assertTrue(archiver.commit([report]))
+        self.assertFalse(report.exists())
+        self.assertEqual((self.archive_dir / 'a.csv').read_bytes(), REPORT)
+        # Renamed reports are not rewritten, so they have no checksum to record
+        self.assertFalse((self.archive_dir / ReportArchiver.MANIFEST).exists())
+
+    def test_cross_device_rename_falls_back_to_a_gzip_copy(self):
+        archiver = self.archiver()
+        report = self.report('a.csv')
+        with mock.patch('archiver.os.rename', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+            self.assertTrue(archiver.commit([report]))
+        self.assertFalse(report.exists())
+        self.assertEqual(gzip.decompress((self.archive_dir / 'a.csv.gz').read_bytes()), REPORT)
+        self.assertEqual(self.manifest(), [f'{hashlib.sha256(REPORT).hexdigest()}  a.csv'])
+
+    def test_other_filesystem_copies_while_staged(self):
+        archiver = self.archiver(compression='none')
+        archiver.same_filesystem = lambda source: False
+        first, second = self.report('a.csv', b'first'), self.report('b.csv', b'second')
+        archiver.stage(first)
+        archiver.stage(second)
+        self.assertTrue(archiver.commit([first, second]))
+        self.assertEqual((self.archive_dir / 'b.csv').read_bytes(), b'second')
+        self.assertFalse(first.exists() or second.exists())
+        self.assertEqual(sorted(self.manifest()), sorted([f'{hashlib.sha256(b"first").hexdigest()}  a.csv',
+                                                           f'{hashlib.sha256(b"second").hexdigest()}  b.csv']))
+
+    def test_test_runs_keep_the_sources(self):
+        archiver = self.archiver(keep_sources=True)
+        report = self.report('a.csv')
+        self.assertTrue(archiver.commit([report, MemoryReport('7_mail.csv', b'mailed')]))
+        self.assertTrue(report.is_file())
+        self.assertEqual(gzip.decompress((self.archive_dir / '7_mail.csv.gz').read_bytes()), b'mailed')
+        self.assertEqual(len(self.manifest()), 2)
+
+    def test_one_failure_does_not_stop_the_others(self):
+        archiver = self.archiver()
+        missing, report = self.report_dir / 'missing.csv', self.report('b.csv')
+        with self.assertLogs(logger, 'ERROR'):
+            self.assertFalse(archiver.commit([missing, report]))
+        self.assertTrue((self.archive_dir / 'b.csv').is_file())
+        self.assertFalse(report.exists())
+        self.assertEqual(self.metrics.counters['reports_archived'], 1)
+        self.assertEqual(self.metrics.counters['reports_archive_failed'], 1)
+        self.assertEqual([path.name for path in self.archive_dir.iterdir()], ['b.csv'])
+
+    def test_discard_removes_uncommitted_copies(self):
+        archiver = self.archiver(keep_sources=True)
+        report = self.report('a.csv')
+        archiver.stage(report)
+        archiver.entries[str(report)].future.result()
+        self.assertTrue((self.archive_dir / 'a.csv.gz').is_file())
+        archiver.discard()
+        self.assertEqual(list(self.archive_dir.iterdir()), [])
+        self.assertTrue(report.is_file())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+from unittest import mock
+from pathlib import Path
+import unittest
+import logging
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from blackberry import BlackBerryAPI, RetryPolicy
+import requests
+
+logger = logging.getLogger('label_adapter.tests')
+
+class FakeResponse:
+    def __init__(self, status_code:int, body=None, headers:dict=None, links:dict=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.links = links or {}
+        self.content = json.dumps(body).encode() if body is not None else b''
+        self.text = self.content.decode()
+        self.reason = ''
+        self.url = ''
+        self.request = SimpleNamespace(method='GET', url='', headers={}, body=None)
+
+    def json(self):
+        return self.body
+
+class FakeSession:
+    """Plays back canned responses, or raises them if they are exceptions."""
+
+    def __init__(self, responses:list):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        self.requests.append((method, url, dict(headers), dict(kwargs.get('params') or {})))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+def make_api(responses:list, max_retries:int=2) -> BlackBerryAPI:
+    # No backoff, so retries don't sleep
+    bb = BlackBerryAPI(Path('unused.pem'), logger, 'not_test', retry_policy=RetryPolicy(max_retries, backoff_base=0))
+    bb._session = FakeSession(responses)
+    bb.tokens.fetch_token = lambda write_scope: {'access_token': 'write' if write_scope else 'read', 'expires_in': 3600}
+    return bb
+
+class RetryPolicyTest(unittest.TestCase):
+    def retry_after(self, value) -> FakeResponse:
+        return FakeResponse(429, headers={'Retry-After': value})
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_retries=3)
+        self.assertEqual([policy.should_retry(status_code, 0) for status_code in (429, 500, 502, 503, 504)], [True] * 5)
+        self.assertEqual([policy.should_retry(status_code, 0) for status_code in (200, 400, 401, 404)], [False] * 4)
+        self.assertTrue(policy.should_retry(503, 2))
+        self.assertFalse(policy.should_retry(503, 3))
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        policy = RetryPolicy(backoff_base=0.5, backoff_max=30.0)
+        with mock.patch('blackberry.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([policy.get_delay(attempt) for attempt in (0, 1, 3, 10)], [0.5, 1.0, 4.0, 30.0])
+
+    def test_backoff_is_jittered(self):
+        policy = RetryPolicy(backoff_base=1.0)
+        delays = [policy.get_delay(2) for _ in range(200)]
+        self.assertTrue(all(0 <= delay <= 4.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_retry_after_seconds(self):
+        policy = RetryPolicy(backoff_max=30.0)
+        self.assertEqual(policy.get_delay(0, self.retry_after('7')), 7.0)
+        self.assertEqual(policy.get_delay(0, self.retry_after('1.5')), 1.5)
+        self.assertEqual(policy.get_delay(0, self.retry_after('-3')), 0.0)
+        # A server asking for more than backoff_max doesn't stall the run
+        self.assertEqual(policy.get_delay(0, self.retry_after('3600')), 30.0)
+
+    def test_retry_after_http_date(self):
+        policy = RetryPolicy(backoff_max=30.0)
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=20)
+        self.assertAlmostEqual(policy.parse_retry_after(self.retry_after(format_datetime(retry_at, usegmt=True))), 20, delta=2)
+        past = format_datetime(datetime.now(timezone.utc) - timedelta(hours=1), usegmt=True)
+        self.assertEqual(policy.parse_retry_after(self.retry_after(past)), 0.0)
+
+    def test_invalid_retry_after_falls_back_to_backoff(self):
+        policy = RetryPolicy(backoff_base=0.5)
+        self.assertIsNone(policy.parse_retry_after(self.retry_after('soon')))
+        self.assertIsNone(policy.parse_retry_after(FakeResponse(429)))
+        self.assertIsNone(policy.parse_retry_after(None))
+        with mock.patch('blackberry.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual(policy.get_delay(1, self.retry_after('soon')), 1.0)
+
+class SendRequestRetryTest(unittest.TestCase):
+    def send(self, bb:BlackBerryAPI):
+        return bb.send_request('GET', 'https://radar.test/assets', False, None, 'get_assets')
+
+    def test_retries_until_success(self):
+        bb = make_api([FakeResponse(503), FakeResponse(429), FakeResponse(200, [])])
+        self.assertEqual(self.send(bb).status_code, 200)
+        self.assertEqual(len(bb.session.requests), 3)
+        self.assertEqual(bb.metrics.endpoints['get_assets'].retries, 2)
+
+    def test_gives_up_after_max_retries(self):
+        bb = make_api([FakeResponse(503)] * 3)
+        self.assertEqual(self.send(bb).status_code, 503)
+        self.assertEqual(len(bb.session.requests), 3)
+        self.assertEqual(bb.metrics.endpoints['get_assets'].errors_5xx, 3)
+
+    def test_client_errors_are_not_retried(self):
+        bb = make_api([FakeResponse(404)])
+        self.assertEqual(self.send(bb).status_code, 404)
+        self.assertEqual(bb.metrics.endpoints['get_assets'].retries, 0)
+
+    def test_connection_errors_are_retried(self):
+        bb = make_api([requests.exceptions.ConnectionError('reset'), FakeResponse(200, [])])
+        self.assertEqual(self.send(bb).status_code, 200)
+        self.assertEqual(bb.metrics.endpoints['get_assets'].connection_errors, 1)
+
+    def test_connection_errors_raise_after_max_retries(self):
+        bb = make_api([requests.exceptions.Timeout('timed out')] * 3)
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.send(bb)
+        self.assertEqual(len(bb.session.requests), 3)
+
+class TokenRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.issued = []
+
+    def fetch_token(self, write_scope:bool) -> dict:
+        self.issued.append(f'token-{len(self.issued) + 1}')
+        return {'access_token': self.issued[-1], 'expires_in': 3600}
+
+    def send(self, responses:list) -> tuple:
+        bb = make_api(responses)
+        bb.tokens.fetch_token = self.fetch_token
+        response = bb.send_request('POST', 'https://radar.test/labels', True, None, 'add_label')
+        return response, [headers['Authorization'] for _, _, headers, _ in bb.session.requests]
+
+    def test_refreshes_the_token_on_401(self):
+        response, authorizations = self.send([FakeResponse(401), FakeResponse(201)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(authorizations, ['Bearer token-1', 'Bearer token-2'])
+
+    def test_refreshes_only_once(self):
+        response, authorizations = self.send([FakeResponse(403), FakeResponse(403)])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(authorizations, ['Bearer token-1', 'Bearer token-2'])
+
+class IterAssetsTest(unittest.TestCase):
+    def page(self, *numbers, **kwargs) -> FakeResponse:
+        return FakeResponse(200, {'items': [{'id': f'A{number}', 'identifier': str(number)} for number in numbers], **kwargs})
+
+    def test_cursor_pagination(self):
+        bb = make_api([self.page(1, 2, next='c2'), self.page(3, next='c3'), self.page(4, next=None)])
+        self.assertEqual(list(bb.iter_assets(page_size=2)), [('A1', '1'), ('A2', '2'), ('A3', '3'), ('A4', '4')])
+        self.assertEqual([(url, params) for _, url, _, params in bb.session.requests],
+                         [('https://api.radar.blackberry.com/1/assets', {'limit': 2}),
+                          ('https://api.radar.blackberry.com/1/assets', {'limit': 2, 'cursor': 'c2'}),
+                          ('https://api.radar.blackberry.com/1/assets', {'limit': 2, 'cursor': 'c3'})])
+
+    def test_link_header_pagination(self):
+        next_url = 'https://api.radar.blackberry.com/1/assets?page=2'
+        first = self.page(1)
+        first.links = {'next': {'url': next_url, 'rel': 'next'}}
+        bb = make_api([first, self.page(2)])
+        self.assertEqual(bb.get_assets(), {'A1': '1', 'A2': '2'})
+        # The next link carries its own query string
+        self.assertEqual([(url, params) for _, url, _, params in bb.session.requests][1], (next_url, {}))
+
+    def test_unpaged_list(self):
+        bb = make_api([FakeResponse(200, [{'id': 'A1', 'identifier': '1'}, {'id': 'A2', 'identifier': '2'}])])
+        self.assertEqual(bb.get_assets(), {'A1': '1', 'A2': '2'})
+        self.assertEqual(len(bb.session.requests), 1)
+
+    def test_failed_page_raises(self):
+        bb = make_api([self.page(1, next='c2'), FakeResponse(404)])
+        assets = bb.iter_assets()
+        self.assertEqual(next(assets), ('A1', '1'))
+        with self.assertLogs(logger, 'ERROR'), self.assertRaisesRegex(RuntimeError, r'page 2 \(HTTP 404\)'):
+            list(assets)
+
+if __name__ == '__main__':
+    unittest.main()
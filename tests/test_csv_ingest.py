@@ -0,0 +1,94 @@
+from pathlib import Path
+import tempfile
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from csv_ingest import MemoryReport, ReportReader, ReportRow, parse_last_done, parse_report
+from whitelist import ComponentCodeWhitelist
+
+class ReportReaderTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def report(self, data:bytes) -> Path:
+        path = self.directory / 'report.csv'
+        path.write_bytes(data)
+        return path
+
+    def test_bom_and_header_whitespace(self):
+        path = self.report('\ufeffUNITNUMBER , DESCRIPTION,DUEPERCENT,COMPCODE,LASTDONE\r\n'
+                           '26706,PM Service,92%,000-003,9/25/2024\r\n'.encode('utf-8'))
+        self.assertEqual(list(ReportReader(path)), [ReportRow('26706', 'PM Service', '92%', '000-003', '9/25/2024')])
+
+    def test_stray_bom_in_a_resaved_export(self):
+        # Saved twice, so utf-8-sig only strips the first BOM
+        data = '\ufeff\ufeffCOMPCODE,UNITNUMBER,DUEPERCENT,DESCRIPTION\n000-003,26706,92%,PM Service\n'.encode('utf-8')
+        self.assertEqual(list(ReportReader(MemoryReport('mail.csv', data))), [ReportRow('26706', 'PM Service', '92%', '000-003', '')])
+
+    def test_short_and_blank_rows_are_rejected(self):
+        path = self.report(b'UNITNUMBER,DESCRIPTION,DUEPERCENT,COMPCODE,NOTES\n'
+                           b'26706,PM Service,92%,000-003,ok\n'
+                           b'\n'
+                           b'26707,PM Service\n'
+                           b'26708,PM Service,50%,000-003\n')
+        reader = ReportReader(path)
+        self.assertEqual([row.unit_number for row in reader], ['26706', '26708'])
+        self.assertEqual((reader.rows_read, reader.rows_rejected), (2, 1))
+        self.assertGreater(reader.elapsed, 0)
+
+    def test_missing_column(self):
+        path = self.report(b'UNITNUMBER,DUEPERCENT\n26706,92%\n')
+        with self.assertRaisesRegex(ValueError, r'missing column\(s\) DESCRIPTION, COMPCODE'):
+            list(ReportReader(path))
+
+    def test_empty_file(self):
+        with self.assertRaises(ValueError):
+            list(ReportReader(self.report(b'')))
+
+    def test_invalid_utf8_is_replaced(self):
+        path = self.report(b'UNITNUMBER,DESCRIPTION,DUEPERCENT,COMPCODE\n26706,PM Service \xe9,92%,000-003\n')
+        self.assertEqual([row.description for row in ReportReader(path)], ['PM Service \ufffd'])
+
+    def test_parse_report_records_errors(self):
+        report = parse_report(self.report(b'UNITNUMBER\n26706\n'), ComponentCodeWhitelist(['000-003']))
+        self.assertIn('missing column(s)', report.error)
+        self.assertEqual(report.labels, {})
+
+class LastDoneTest(unittest.TestCase):
+    WHITELIST = ComponentCodeWhitelist(['000-003'])
+    HEADER = 'UNITNUMBER,LASTDONE,DUEPERCENT,COMPCODE,DESCRIPTION\n'
+
+    def parse(self, *rows):
+        return parse_report(MemoryReport('report.csv', (self.HEADER + ''.join(rows)).encode()), self.WHITELIST)
+
+    def test_parse_last_done(self):
+        cache = {}
+        self.assertEqual(parse_last_done('9/25/2024', cache), (2024, 9, 25))
+        self.assertEqual(parse_last_done(' 12/1/2023 ', cache), (2023, 12, 1))
+        self.assertEqual([parse_last_done(value, cache) for value in ('', 'n/a', '2024-09-25')], [(0, 0, 0)] * 3)
+        self.assertLess(parse_last_done('12/31/2023', cache), parse_last_done('1/1/2024', cache))
+        self.assertEqual(cache['9/25/2024'], (2024, 9, 25))
+
+    def test_most_recent_last_done_wins(self):
+        report = self.parse('26706,1/15/2024,92%,000-003,PM Service\n',
+                            '26706,9/25/2024,10%,000-003,PM Service\n',
+                            '26706,3/1/2024,50%,000-003,PM Service\n',
+                            '26706,,70%,000-003,PM Service\n')
+        self.assertEqual(report.labels, {'26706': {'PM Service': '10%'}})
+        self.assertEqual(report.superseded, 3)
+
+    def test_later_row_breaks_ties(self):
+        report = self.parse('26706,9/25/2024,92%,000-003,PM Service\n', '26706,9/25/2024,95%,000-003,PM Service\n')
+        self.assertEqual(report.labels, {'26706': {'PM Service': '95%'}})
+
+    def test_duplicates_with_the_same_value_are_not_superseded(self):
+        report = self.parse('26706,9/25/2024,92%,000-003,PM Service\n', '026706,1/1/2024,92%,000-003,PM Service\n')
+        self.assertEqual(report.labels, {'26706': {'PM Service': '92%'}})
+        self.assertEqual(report.superseded, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+from pathlib import Path
+import tempfile
+import unittest
+import binascii
+import logging
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from email_processor import (MailboxCursor, attachment_name, csv_parts, decode_part, download_csv_attachments, fetch_bodystructures,
+                             fetch_csv_attachments, parse_sexp, split_fetch_responses, stream_csv_attachments, uid_set)
+
+logger = logging.getLogger('label_adapter.tests')
+
+# A plain text body with a base64 CSV attachment, named only in its Content-Disposition
+MIXED = (b'1 (UID 5 BODYSTRUCTURE (("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 12 1 NIL NIL NIL NIL)'
+         b'("application" "octet-stream" NIL NIL NIL "base64" 120 NIL ("attachment" ("filename" "AMS Report.csv")) NIL NIL)'
+         b' "mixed" ("boundary" "xyz") NIL NIL NIL))')
+
+class FakeMail:
+    """Answers UID FETCH with canned data, the way imaplib returns it."""
+
+    def __init__(self, data:list):
+        self.data = data
+        self.commands = []
+
+    def uid(self, command, *args):
+        self.commands.append((command,) + args)
+        return 'OK', self.data
+
+class FakeMailbox:
+    """An inbox of emails from one sender, each a BODYSTRUCTURE and its sections' transfer-encoded bodies."""
+
+    def __init__(self, emails:dict, uidvalidity:int=1):
+        self.emails = emails
+        self.uidvalidity = uidvalidity
+
+    def select(self, mailbox):
+        return 'OK', [str(len(self.emails)).encode()]
+
+    def response(self, code):
+        return code, [str(self.uidvalidity).encode()]
+
+    def uid(self, command, *args):
+        if command == 'SEARCH':
+            return 'OK', [' '.join(str(uid) for uid in sorted(self.emails)).encode()]
+        if args[1] == '(UID BODYSTRUCTURE)':
+            return 'OK', [b'%d (UID %d BODYSTRUCTURE %s)' % (uid, uid, self.emails[uid][0]) for uid in sorted(self.emails)]
+        uid = int(args[0])
+        data = []
+        for section, body in self.emails[uid][1].items():
+            data += [(b'%d (UID %d BODY[%s] {%d}' % (uid, uid, section.encode(), len(body)), body), b')']
+        return 'OK', data
+
+class FakeServer(FakeMailbox):
+    """A FakeMailbox that also keeps folders, so processed emails can be moved out of the inbox."""
+
+    def __init__(self, emails:dict, capabilities:tuple=('IMAP4REV1', 'MOVE'), folders:tuple=('INBOX', 'processed')):
+        super().__init__(emails)
+        self.capabilities = capabilities
+        self.folders = {name: [] for name in folders}
+        self.deleted = set()
+        self.commands = []
+
+    def list(self):
+        return 'OK', [b'(\\HasNoChildren) "/" "%s"' % name.encode() for name in self.folders]
+
+    def create(self, name):
+        self.commands.append(('CREATE', name))
+        self.folders[name] = []
+        return 'OK', [b'CREATE completed']
+
+    def uid(self, command, *args):
+        if command in ('MOVE', 'COPY', 'STORE', 'EXPUNGE'):
+            self.commands.append((command,) + args)
+            uids = [int(uid) for uid in args[0].split(',')]
+            if command in ('MOVE', 'COPY'):
+                self.folders[args[1]] += uids
+            if command == 'MOVE':
+                self.deleted.update(uids)
+            return 'OK', [b'']
+        return super().uid(command, *args)
+
+    def expunge(self):
+        self.commands.append(('EXPUNGE',))
+        return 'OK', [b'']
+
+    def inbox(self) -> list:
+        return sorted(set(self.emails) - self.deleted)
+
+def csv_email(name:str, body:bytes=b'YSxiCg==') -> tuple:
+    return (b'("text" "csv" ("name" "%s") NIL NIL "base64" %d 1 NIL NIL NIL NIL)' % (name.encode(), len(body)), {'1': body})
+
+PLAIN_EMAIL = (b'("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 5 1 NIL NIL NIL NIL)', {})
+
+class BodyStructureTest(unittest.TestCase):
+    def test_parse_sexp(self):
+        parsed = parse_sexp([b'("text" "csv" ("name" "a \\"b\\".csv") NIL 42)'])
+        self.assertEqual(parsed, [['text', 'csv', ['name', 'a "b".csv'], None, '42']])
+
+    def test_parse_sexp_literal(self):
+        # imaplib hands a {n} literal over as the second half of a tuple
+        data = [(b'("text" "csv" ("name" {9}', b'fleet.csv'), b') NIL NIL "7bit" 20 2)']
+        self.assertEqual(parse_sexp(data), [['text', 'csv', ['name', 'fleet.csv'], None, None, '7bit', '20', '2']])
+
+    def test_csv_parts_multipart(self):
+        structure = parse_sexp([MIXED])[1][3]
+        self.assertEqual(csv_parts(structure), [('2', 'AMS Report.csv', 'base64')])
+
+    def test_csv_parts_single_part(self):
+        structure = parse_sexp([b'("text" "csv" ("name" "fleet.csv") NIL NIL "quoted-printable" 20 2 NIL NIL NIL NIL)'])[0]
+        self.assertEqual(csv_parts(structure), [('1', 'fleet.csv', 'quoted-printable')])
+
+    def test_csv_parts_nested(self):
+        structure = parse_sexp([b'((("text" "plain" NIL NIL NIL "7bit" 3 1)("text" "html" NIL NIL NIL "7bit" 3 1) "alternative")'
+                                b'("text" "csv" ("name" "due.csv") NIL NIL "base64" 20 1) "mixed")'])[0]
+        self.assertEqual(csv_parts(structure), [('2', 'due.csv', 'base64')])
+
+    def test_csv_parts_without_csv(self):
+        structure = parse_sexp([b'("image" "png" ("name" "logo.png") NIL NIL "base64" 20 NIL NIL NIL NIL)'])[0]
+        self.assertEqual(csv_parts(structure), [])
+        self.assertEqual(csv_parts([]), [])
+
+    def test_split_fetch_responses(self):
+        data = [(b'1 (UID 5 BODYSTRUCTURE ("text" "csv" ("name" {5}', b'a.csv'), b') NIL NIL "7bit" 1 1))',
+                b'2 (UID 6 BODYSTRUCTURE ("text" "plain" NIL NIL NIL "7bit" 1 1))', None]
+        self.assertEqual([len(response) for response in split_fetch_responses(data)], [2, 1])
+
+    def test_fetch_bodystructures(self):
+        mail = FakeMail([MIXED, b'2 (UID 6 BODYSTRUCTURE ("text" "plain" NIL NIL NIL "7bit" 1 1))'])
+        structures = fetch_bodystructures(mail, [6, 5])
+        self.assertEqual(mail.commands, [('FETCH', '5:6', '(UID BODYSTRUCTURE)')])
+        self.assertEqual(sorted(structures), [5, 6])
+        self.assertEqual(csv_parts(structures[5]), [('2', 'AMS Report.csv', 'base64')])
+        self.assertEqual(csv_parts(structures[6]), [])
+
+class FetchAttachmentsTest(unittest.TestCase):
+    def test_malformed_attachments_are_skipped(self):
+        mail = FakeMailbox({
+            # Badly padded base64
+            5: (b'("text" "csv" ("name" "broken.csv") NIL NIL "base64" 3 1 NIL NIL NIL NIL)', {'1': b'abc'}),
+            # A filename in a charset Python doesn't know
+            6: (b'("text" "csv" ("name" "=?x-bogus?q?foo.csv?=") NIL NIL "7bit" 4 1 NIL NIL NIL NIL)', {'1': b'a,b\n'}),
+            7: (b'("text" "csv" ("name" "fleet.csv") NIL NIL "base64" 8 1 NIL NIL NIL NIL)', {'1': b'YSxiCg=='}),
+        })
+        with self.assertLogs(logger, 'ERROR') as logs:
+            attachments, cursor = fetch_csv_attachments(mail, 'reports@example.com', logger, MailboxCursor(1, 4))
+        self.assertEqual(attachments, [(7, '7_fleet.csv', b'a,b\n')])
+        self.assertEqual(len(logs.output), 2)
+        # The cursor moves past the malformed emails so they aren't fetched again
+        self.assertEqual((cursor.uidvalidity, cursor.last_uid), (1, 7))
+
+    def test_decode_part(self):
+        self.assertEqual(decode_part(b'YSxiCg==', 'base64'), b'a,b\n')
+        self.assertEqual(decode_part(b'a=3Db', 'quoted-printable'), b'a=b')
+        self.assertEqual(decode_part(b'a,b', '7bit'), b'a,b')
+        with self.assertRaises(binascii.Error):
+            decode_part(b'abc', 'base64')
+
+class IngestionTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.report_dir = Path(directory.name) / 'reports'
+
+    def test_download_saves_reports_and_moves_their_emails(self):
+        server = FakeServer({3: csv_email('fleet.csv'), 4: PLAIN_EMAIL, 8: csv_email('due.csv', b'Yyxk')})
+        paths, cursor = download_csv_attachments(server, 'reports@example.com', self.report_dir, logger, MailboxCursor(1, 0))
+        self.assertEqual(sorted(Path(path).name for path in paths), ['3_fleet.csv', '8_due.csv'])
+        self.assertEqual(sorted(path.name for path in self.report_dir.iterdir()), ['3_fleet.csv', '8_due.csv'])
+        self.assertEqual((self.report_dir / '8_due.csv').read_bytes(), b'c,d')
+        # Only the emails that had reports leave the inbox
+        self.assertEqual(server.commands, [('MOVE', '3,8', 'processed')])
+        self.assertEqual(server.inbox(), [4])
+        self.assertEqual((cursor.uidvalidity, cursor.last_uid), (1, 8))
+
+    def test_cursor_skips_emails_already_fetched(self):
+        server = FakeServer({3: csv_email('fleet.csv'), 8: csv_email('due.csv')})
+        paths, cursor = download_csv_attachments(server, 'reports@example.com', self.report_dir, logger, MailboxCursor(1, 3))
+        self.assertEqual([Path(path).name for path in paths], ['8_due.csv'])
+        paths, _ = download_csv_attachments(server, 'reports@example.com', self.report_dir, logger, cursor)
+        self.assertEqual(paths, [])
+
+    def test_uidvalidity_change_rescans(self):
+        server = FakeServer({3: csv_email('fleet.csv')})
+        server.uidvalidity = 2
+        with self.assertLogs(logger, 'INFO'):
+            paths, cursor = download_csv_attachments(server, 'reports@example.com', self.report_dir, logger, MailboxCursor(1, 9))
+        self.assertEqual([Path(path).name for path in paths], ['3_fleet.csv'])
+        self.assertEqual((cursor.uidvalidity, cursor.last_uid), (2, 3))
+
+    def test_copy_and_expunge_without_move(self):
+        server = FakeServer({3: csv_email('fleet.csv')}, capabilities=('IMAP4REV1', 'UIDPLUS'), folders=('INBOX',))
+        with self.assertLogs(logger, 'INFO'):
+            download_csv_attachments(server, 'reports@example.com', self.report_dir, logger)
+        self.assertEqual(server.commands, [('CREATE', 'processed'), ('COPY', '3', 'processed'),
+                                           ('STORE', '3', '+FLAGS.SILENT', '(\\Deleted)'), ('EXPUNGE', '3')])
+        self.assertEqual(server.folders['processed'], [3])
+
+    def test_stream_keeps_reports_in_memory(self):
+        server = FakeServer({3: csv_email('fleet.csv'), 4: PLAIN_EMAIL, 8: csv_email('due.csv', b'Yyxk')})
+        reports, uids, cursor = stream_csv_attachments(server, 'reports@example.com', logger)
+        self.assertEqual([(report.name, report.data) for report in reports], [('3_fleet.csv', b'a,b\n'), ('8_due.csv', b'c,d')])
+        self.assertEqual(uids, [3, 8])
+        self.assertEqual(cursor.last_uid, 8)
+        # Nothing is written or moved until the caller has applied the reports
+        self.assertFalse(self.report_dir.exists())
+        self.assertEqual(server.commands, [])
+
+class HelpersTest(unittest.TestCase):
+    def test_uid_set(self):
+        self.assertEqual(uid_set([7, 1, 2, 3, 3, 9, 10]), '1:3,7,9:10')
+        self.assertEqual(uid_set([]), '')
+
+    def test_attachment_name(self):
+        self.assertEqual(attachment_name(7, '../../etc/passwd'), '7_passwd.csv')
+        self.assertEqual(attachment_name(7, '=?utf-8?q?AMS_Report.csv?='), '7_AMS Report.csv')
+        self.assertEqual(attachment_name(7, ''), '7_attachment.csv')
+        with self.assertRaises(LookupError):
+            attachment_name(7, '=?x-bogus?q?foo.csv?=')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+from pathlib import Path
+import tempfile
+import os
+import unittest
+import logging
+import sys
+
+LABEL_ADAPTER_DIR = Path(__file__).resolve().parent.parent / 'label_adapter'
+sys.path.insert(0, str(LABEL_ADAPTER_DIR))
+
+from helpers import Helpers
+from label_index import LabelIndex
+
+HEADER = 'UNITNUMBER,LASTDONE,DUEPERCENT,COMPCODE,DESCRIPTION\n'
+
+class HelpersTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input_dir = Path(directory.name) / 'reports'
+        self.input_dir.mkdir()
+        self.output_dir = Path(directory.name) / 'archive'
+        self.logger = logging.getLogger('label_adapter.tests.helpers')
+
+    def helper(self) -> Helpers:
+        helper = Helpers(self.input_dir, self.output_dir, self.logger, 'error', 5, 'not_test')
+        helper.whitelist_file = LABEL_ADAPTER_DIR / 'component_code_whitelist.txt'
+        self.addCleanup(lambda: (self.logger.removeHandler(helper.file_handler), helper.file_handler.close()))
+        return helper
+
+    def report(self, name:str, text:str) -> Path:
+        path = self.input_dir / name
+        path.write_text(text)
+        return path
+
+    def test_reports_that_cannot_be_parsed_are_not_archived(self):
+        good = self.report('good.csv', HEADER + '26706,9/25/2024,92%,000-003,PM Service and Inspect\n')
+        missing_columns = self.report('missing.csv', 'UNITNUMBER,DUEPERCENT\n26706,92%\n')
+        # Over csv.field_size_limit, which the csv module reports as csv.Error
+        oversized = self.report('oversized.csv', HEADER + '26706,9/25/2024,92%,000-003,"' + 'x' * 200000 + '"\n')
+        helper = self.helper()
+        label_map = LabelIndex()
+        with self.assertLogs(self.logger, 'ERROR'):
+            helper.parse_reports(label_map, set())
+            self.assertFalse(helper.archive_csv_files())
+        self.assertEqual(label_map['26706'], {'PM Service and Inspect': '92%'})
+        self.assertEqual(helper.failed_reports, {str(missing_columns), str(oversized)})
+        self.assertEqual(helper.metrics.counters['csv_files_failed'], 2)
+        self.assertTrue(missing_columns.is_file() and oversized.is_file())
+        self.assertFalse(good.exists())
+        self.assertEqual([path.name for path in helper.archive_dir.glob('*.csv')], ['good.csv'])
+
+    def test_determine_severity(self):
+        helper = self.helper()
+        self.assertEqual([helper.determine_severity(due_percent) for due_percent in ('92%', '110%', '150%', '181%', '')],
+                         ['LOW', 'LOW', 'MEDIUM', 'HIGH', ''])
+        self.assertEqual(helper.determine_severity('nan%'), 'HIGH')
+
+    def test_parsed_reports_are_archived(self):
+        self.report('good.csv', HEADER + '26706,9/25/2024,92%,000-003,PM Service and Inspect\n')
+        helper = self.helper()
+        helper.parse_reports(LabelIndex(), set())
+        self.assertTrue(helper.archive_csv_files())
+        self.assertEqual(list(self.input_dir.iterdir()), [])
+
+    def test_newer_reports_win(self):
+        newer = self.report('a_newer.csv', HEADER + '26706,,10%,000-003,PM Service and Inspect\n')
+        older = self.report('b_older.csv', HEADER + '26706,9/25/2024,92%,000-003,PM Service and Inspect\n')
+        os.utime(older, (1700000000, 1700000000))
+        os.utime(newer, (1700000060, 1700000060))
+        helper = self.helper()
+        self.assertEqual(helper.order_csv_files([str(newer), str(older)]), [str(older), str(newer)])
+        label_map = LabelIndex()
+        helper.parse_reports(label_map, set(), archive=False)
+        # Across reports the file time decides, not LASTDONE
+        self.assertEqual(label_map['26706'], {'PM Service and Inspect': '10%'})
+        self.assertEqual(helper.metrics.counters['labels_superseded'], 1)
+
+    def parse(self, workers:int) -> tuple:
+        helper = self.helper()
+        label_map, label_bases_processed = LabelIndex(), set()
+        helper.parse_reports(label_map, label_bases_processed, workers=workers, archive=False)
+        return dict(label_map.items()), label_bases_processed, helper.metrics.counters
+
+    def test_process_pool_gives_the_same_result(self):
+        for number in range(6):
+            rows = ''.join(f'{26700 + asset},9/{number + 1}/2024,{number * 10 + asset}%,000-003,PM Service and Inspect\n'
+                           for asset in range(number, number + 4))
+            report = self.report(f'report_{number}.csv', HEADER + rows)
+            # Listed out of order, so the merge order has to come from the mtimes
+            os.utime(report, (1700000000 - number * 60, 1700000000 - number * 60))
+        serial = self.parse(workers=1)
+        parallel = self.parse(workers=4)
+        self.assertEqual(parallel, serial)
+        # Assets in several reports take the values of the newest one
+        self.assertEqual(serial[0]['26703'], {'PM Service and Inspect': '3%'})
+        self.assertEqual(serial[2]['labels_superseded'], 24 - 9)
+
+if __name__ == '__main__':
+    unittest.main()
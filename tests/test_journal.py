@@ -0,0 +1,62 @@
+from pathlib import Path
+import tempfile
+import unittest
+import logging
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from journal import SyncJournal
+from planner import ADD, APPLIED, DELETE, FAILED, LabelOperation
+from state_store import StateStore
+
+logger = logging.getLogger('label_adapter.tests')
+
+def operations(planned:list) -> list:
+    return [(operation.op, operation.label, operation.label_id) for operation in planned]
+
+class SyncJournalTest(unittest.TestCase):
+    REPORT_HASHES = {'AMS to BBerry Labels.csv': 'abc123'}
+    LABEL_BASES = {'PM Service'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_file = Path(directory.name) / 'label_state.sqlite3'
+
+    def open(self, report_hashes:dict=None) -> tuple:
+        state_store = StateStore(self.db_file, logger)
+        self.addCleanup(state_store.conn.close)
+        return state_store, SyncJournal(state_store, logger, report_hashes or self.REPORT_HASHES, self.LABEL_BASES, 'exact')
+
+    def interrupted_run(self) -> None:
+        state_store, journal = self.open()
+        delete = LabelOperation('A1', 'T100', DELETE, 'PM Service - 90%', 'L1')
+        add = LabelOperation('A1', 'T100', ADD, 'PM Service - 92%')
+        journal.planned('A1', 'T100', [delete, add])
+        delete.result, add.result = APPLIED, FAILED
+        journal.completed([delete, add])
+        state_store.close()
+
+    def test_resume_replays_unfinished_operations(self):
+        self.interrupted_run()
+        _, journal = self.open()
+        self.assertEqual(operations(journal.resume('A1')), [(ADD, 'PM Service - 92%', None)])
+        self.assertEqual(journal.resume('A1')[0].asset_identifier, 'T100')
+        self.assertIsNone(journal.resume('A2'))
+
+    def test_other_reports_start_a_new_journal(self):
+        self.interrupted_run()
+        _, journal = self.open({'AMS to BBerry Labels.csv': 'def456'})
+        self.assertIsNone(journal.resume('A1'))
+
+    def test_finished_journal_is_not_resumed(self):
+        self.interrupted_run()
+        state_store, journal = self.open()
+        journal.finish()
+        state_store.close()
+        _, journal = self.open()
+        self.assertIsNone(journal.resume('A1'))
+
+if __name__ == '__main__':
+    unittest.main()
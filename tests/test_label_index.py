@@ -0,0 +1,52 @@
+from pathlib import Path
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from label_index import LabelIndex, split_label
+
+class LabelIndexTest(unittest.TestCase):
+    def test_lookup(self):
+        index = LabelIndex()
+        index.replace('T100', {'PM Service': '92%', 'Brake Inspection': '40%'})
+        self.assertEqual(index['T100'], {'PM Service': '92%', 'Brake Inspection': '40%'})
+        self.assertEqual(index.labels('T100'), {'PM Service - 92%', 'Brake Inspection - 40%'})
+        self.assertEqual(index.labels('T200'), set())
+        self.assertIn('T100', index)
+        self.assertEqual(index.label_count(), 2)
+
+    def test_merge_counts_superseded_values(self):
+        index = LabelIndex()
+        self.assertEqual(index.merge('T100', {'PM Service': '92%'}), 0)
+        self.assertEqual(index.merge('T100', {'PM Service': '95%', 'Brake Inspection': '40%'}), 1)
+        self.assertEqual(index['T100'], {'PM Service': '95%', 'Brake Inspection': '40%'})
+
+    def test_records_compare_across_a_shared_table(self):
+        index = LabelIndex()
+        index.replace('T100', {'PM Service': '92%', 'Brake Inspection': '40%'})
+        sibling = index.sibling()
+        sibling.replace('T100', {'Brake Inspection': '40%', 'PM Service': '92%'})
+        self.assertEqual(index.record('T100'), sibling.record('T100'))
+        sibling.replace('T100', {'PM Service': '93%', 'Brake Inspection': '40%'})
+        self.assertNotEqual(index.record('T100'), sibling.record('T100'))
+        self.assertEqual(len(index.record('T200')), 0)
+
+    def test_copy_is_independent(self):
+        index = LabelIndex()
+        index.replace('T100', {'PM Service': '92%'})
+        copy = index.copy()
+        copy.replace('T100', {'PM Service': 'LOW'})
+        copy.replace('T200', {'PM Service': '50%'})
+        self.assertEqual(index['T100'], {'PM Service': '92%'})
+        self.assertNotIn('T200', index)
+
+    def test_split(self):
+        self.assertEqual(split_label('PM Service - A - 92%'), ('PM Service - A', '92%'))
+        self.assertEqual(split_label('Manual tag'), ('Manual tag', None))
+        index = LabelIndex()
+        self.assertEqual(index.split('PM Service - 92%'), ('PM Service', '92%'))
+        self.assertIs(index.split('PM Service - 92%'), index.split('PM Service - 92%'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+from pathlib import Path
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from label_index import LabelIndex
+from label_policy import LabelPolicy
+
+class LabelPolicyTest(unittest.TestCase):
+    def test_render(self):
+        policy = LabelPolicy.severity()
+        self.assertEqual([policy.render(due_percent) for due_percent in ('92%', '110%', '150%', '181%')], ['LOW', 'LOW', 'MEDIUM', 'HIGH'])
+        # Unparsable due percents are written as they came
+        self.assertEqual(policy.render('n/a'), 'n/a')
+        self.assertEqual(policy.render('nan'), 'nan')
+        self.assertEqual(LabelPolicy.exact().render('92%'), '92%')
+
+    def test_band(self):
+        policy = LabelPolicy.severity()
+        self.assertEqual([policy.band(value) for value in (-5.0, 110.0, 110.5, 180.0, 1e9, float('inf'))], [0, 0, 1, 1, 2, 2])
+        self.assertEqual(policy.band(float('nan')), 2)
+
+    def test_from_bounds(self):
+        policy = LabelPolicy.from_bounds(['110', 90])
+        self.assertEqual([name for _, name in policy.bands], ['90% or less', '90-110%', 'over 110%'])
+        self.assertEqual(str(policy), 'bands 90,110')
+        with self.assertRaises(ValueError):
+            LabelPolicy.from_bounds([])
+
+    def test_band_hysteresis(self):
+        policy = LabelPolicy.severity(hysteresis=5)
+        self.assertTrue(policy.holds('LOW', '115%'))
+        self.assertFalse(policy.holds('LOW', '116%'))
+        self.assertTrue(policy.holds('MEDIUM', '106%'))
+        self.assertFalse(policy.holds('MEDIUM', '105%'))
+        self.assertFalse(policy.holds('UNKNOWN', '100%'))
+        self.assertFalse(LabelPolicy.severity().holds('LOW', '111%'))
+
+    def test_exact_hysteresis(self):
+        policy = LabelPolicy.exact(hysteresis=2)
+        self.assertTrue(policy.holds('90%', '92%'))
+        self.assertFalse(policy.holds('90%', '93%'))
+        self.assertFalse(policy.holds('n/a', '92%'))
+        self.assertFalse(policy.holds('90%', 'inf'))
+
+    def test_apply_holds_applied_labels(self):
+        new_label_map = LabelIndex()
+        new_label_map.replace('T100', {'PM Service': '113%', 'Brake Inspection': '190%'})
+        applied = new_label_map.sibling()
+        applied.replace('T100', {'PM Service': 'LOW', 'Brake Inspection': 'MEDIUM'})
+        previous = new_label_map.sibling()
+        previous.replace('T100', {'PM Service': '108%', 'Brake Inspection': '170%'})
+        due_percents, stats = LabelPolicy.severity(hysteresis=5).apply(new_label_map, applied, previous)
+        self.assertEqual(new_label_map['T100'], {'PM Service': 'LOW', 'Brake Inspection': 'HIGH'})
+        self.assertEqual(due_percents['T100'], {'PM Service': '113%', 'Brake Inspection': '190%'})
+        self.assertEqual((stats.labels_rendered, stats.labels_held, stats.writes_avoided), (2, 1, 2))
+
+    def test_apply_exact(self):
+        new_label_map = LabelIndex()
+        new_label_map.replace('T100', {'PM Service': '92%'})
+        due_percents, stats = LabelPolicy.exact().apply(new_label_map, new_label_map.sibling())
+        self.assertEqual(new_label_map['T100'], {'PM Service': '92%'})
+        self.assertEqual(due_percents['T100'], {'PM Service': '92%'})
+        self.assertEqual(stats.labels_rendered, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from pathlib import Path
+import threading
+import unittest
+import logging
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from label_writer import BulkLabelWriter, PerLabelWriter
+from planner import ADD, APPLIED, DELETE, EXISTS, FAILED, GONE, LabelOperation
+
+logger = logging.getLogger('label_adapter.tests')
+
+class FakeRadar:
+    """Label calls with scripted results: per-label results by label name, and a bulk endpoint that settles some labels."""
+
+    def __init__(self, results:dict=None, bulk_supported:bool=True, bulk_settles=lambda operation: True, bulk_error:Exception=None):
+        self.results = results or {}
+        self.bulk_supported = bulk_supported
+        self.bulk_settles = bulk_settles
+        self.bulk_error = bulk_error
+        self.bulk_batches = []
+        self.per_label_calls = []
+        self.lock = threading.Lock()
+
+    def add_label(self, asset_id, label):
+        with self.lock:
+            self.per_label_calls.append((ADD, label))
+        return self.results.get(label, True)
+
+    def delete_label(self, asset_id, label_id):
+        with self.lock:
+            self.per_label_calls.append((DELETE, label_id))
+        return self.results.get(label_id, True)
+
+    def bulk_label_operations(self, operations:list):
+        with self.lock:
+            self.bulk_batches.append([operation.label for operation in operations])
+        if self.bulk_error:
+            raise self.bulk_error
+        if not self.bulk_supported:
+            return None
+        for operation in operations:
+            if self.bulk_settles(operation):
+                operation.result = APPLIED
+        return True
+
+def adds(*labels) -> list:
+    return [LabelOperation('A1', '100', ADD, label) for label in labels]
+
+class PerLabelWriterTest(unittest.TestCase):
+    def test_results(self):
+        for pipeline_depth in (1, 4):
+            radar = FakeRadar({'exists': None, 'rejected': False, 'L2': None, 'L3': False})
+            writer = PerLabelWriter(radar, logger, pipeline_depth)
+            self.addCleanup(writer.close)
+            operations = adds('new', 'exists', 'rejected') + [LabelOperation('A1', '100', DELETE, f'old {number}', f'L{number}')
+                                                             for number in (1, 2, 3)]
+            writer.apply(operations)
+            self.assertEqual([operation.result for operation in operations], [APPLIED, EXISTS, FAILED, APPLIED, GONE, FAILED])
+            self.assertEqual(len(radar.per_label_calls), 6)
+
+class BulkLabelWriterTest(unittest.TestCase):
+    def writer(self, radar:FakeRadar, **kwargs) -> BulkLabelWriter:
+        writer = BulkLabelWriter(radar, logger, PerLabelWriter(radar, logger), **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_batches_operations(self):
+        radar = FakeRadar()
+        writer = self.writer(radar, batch_size=3)
+        operations = adds(*'abcdefg')
+        writer.apply(operations)
+        self.assertEqual(sorted(len(batch) for batch in radar.bulk_batches), [1, 3, 3])
+        self.assertEqual(sorted(label for batch in radar.bulk_batches for label in batch), list('abcdefg'))
+        self.assertEqual({operation.result for operation in operations}, {APPLIED})
+        self.assertEqual(radar.per_label_calls, [])
+
+    def test_falls_back_when_the_bulk_endpoint_is_missing(self):
+        radar = FakeRadar({'b': None}, bulk_supported=False)
+        writer = self.writer(radar)
+        first, second = adds('a', 'b'), adds('c')
+        with self.assertLogs(logger, 'WARNING') as logs:
+            writer.apply(first)
+        self.assertIn('Falling back to one request per label', logs.output[0])
+        self.assertFalse(writer.supported)
+        self.assertEqual([operation.result for operation in first], [APPLIED, EXISTS])
+        # Later operations go straight to per-label calls
+        writer.apply(second)
+        self.assertEqual(second[0].result, APPLIED)
+        self.assertEqual(radar.bulk_batches, [['a', 'b']])
+        self.assertEqual(radar.per_label_calls, [(ADD, 'a'), (ADD, 'b'), (ADD, 'c')])
+
+    def test_unsettled_operations_are_retried_per_label(self):
+        radar = FakeRadar({'c': False}, bulk_settles=lambda operation: operation.label == 'a')
+        writer = self.writer(radar)
+        operations = adds('a', 'b', 'c')
+        writer.apply(operations)
+        self.assertEqual([operation.result for operation in operations], [APPLIED, APPLIED, FAILED])
+        self.assertEqual(radar.per_label_calls, [(ADD, 'b'), (ADD, 'c')])
+        self.assertTrue(writer.supported)
+
+    def test_errors_reach_the_caller(self):
+        writer = self.writer(FakeRadar(bulk_error=ConnectionError('connection reset by peer')))
+        with self.assertRaises(ConnectionError):
+            writer.apply(adds('a'))
+
+    def test_concurrent_callers_share_batches(self):
+        radar = FakeRadar()
+        writer = self.writer(radar, batch_size=100, max_delay=0.2)
+        operations = [adds(f'{number}') for number in range(8)]
+        threads = [threading.Thread(target=writer.apply, args=(asset_operations,)) for asset_operations in operations]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertLess(len(radar.bulk_batches), 8)
+        self.assertEqual({operation.result for asset_operations in operations for operation in asset_operations}, {APPLIED})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+from pathlib import Path
+import unittest
+import logging
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from log_utils import JsonFormatter, LazyMessage, redact, redact_headers, truncate
+
+class RedactTest(unittest.TestCase):
+    def test_token_fields(self):
+        text = '{"access_token": "eyJhbGciOi", "expires_in": 600, "assertion":"abc.def.ghi"}'
+        self.assertEqual(redact(text), '{"access_token": "***", "expires_in": 600, "assertion":"***"}')
+
+    def test_bearer_tokens(self):
+        self.assertEqual(redact("{'Authorization': 'Bearer eyJhbGciOi.x-y_z'}"), "{'Authorization': 'Bearer ***'}")
+        self.assertEqual(redact('Bearer abc, Bearer   def'), 'Bearer ***, Bearer   ***')
+
+    def test_bytes_and_none(self):
+        self.assertEqual(redact(b'{"refresh_token": "r1"} \xff'), '{"refresh_token": "***"} \ufffd')
+        self.assertEqual(redact(None), '')
+        self.assertEqual(redact('{"identifier": "26706"}'), '{"identifier": "26706"}')
+
+    def test_redact_headers(self):
+        headers = {'authorization': 'Bearer abc', 'Content-Type': 'application/json'}
+        self.assertEqual(redact_headers(headers), {'authorization': '***', 'Content-Type': 'application/json'})
+        self.assertEqual(redact_headers(None), {})
+
+    def test_truncate(self):
+        self.assertEqual(truncate('abcdef', 4), 'abcd... [2 more characters]')
+        self.assertEqual(truncate('abcd', 4), 'abcd')
+        # 0 means no limit
+        self.assertEqual(truncate('abcdef', 0), 'abcdef')
+
+class LazyMessageTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.logger = logging.getLogger('label_adapter.tests.lazy')
+
+    def render(self, value) -> str:
+        self.calls.append(value)
+        return f'rendered {value}'
+
+    def test_not_rendered_below_the_level(self):
+        self.logger.setLevel(logging.INFO)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+        self.logger.debug('%s', LazyMessage(self.render, 1))
+        self.assertEqual(self.calls, [])
+
+    def test_rendered_when_emitted(self):
+        with self.assertLogs(self.logger, 'DEBUG') as logs:
+            self.logger.debug('%s', LazyMessage(self.render, 2))
+        self.assertEqual(logs.output, ['DEBUG:label_adapter.tests.lazy:rendered 2'])
+        self.assertEqual(self.calls, [2])
+
+class JsonFormatterTest(unittest.TestCase):
+    def test_one_object_per_record(self):
+        record = logging.LogRecord('label_adapter', logging.WARNING, __file__, 1, 'synced %d asset(s)', (3,), None)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual((entry['level'], entry['logger'], entry['message']), ('WARNING', 'label_adapter', 'synced 3 asset(s)'))
+        self.assertTrue(entry['time'].endswith('+00:00'))
+        self.assertNotIn('exception', entry)
+
+    def test_exception(self):
+        try:
+            raise RuntimeError('boom')
+        except RuntimeError:
+            record = logging.LogRecord('label_adapter', logging.ERROR, __file__, 1, 'failed', (), sys.exc_info())
+        self.assertIn('RuntimeError: boom', json.loads(JsonFormatter().format(record))['exception'])
+
+if __name__ == '__main__':
+    unittest.main()
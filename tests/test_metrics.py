@@ -0,0 +1,77 @@
+from pathlib import Path
+import tempfile
+import unittest
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from metrics import EndpointStats, Metrics
+
+class MetricsTest(unittest.TestCase):
+    def run_metrics(self) -> Metrics:
+        metrics = Metrics()
+        with metrics.phase('parse_reports'):
+            pass
+        with metrics.phase('parse_reports'):
+            pass
+        metrics.increment('csv_files_parsed', 2)
+        metrics.increment('csv_files_parsed')
+        metrics.set_counter('sync_mode', 'full')
+        metrics.record_request('add_label', 201, 0.25, bytes_sent=40, bytes_received=12)
+        metrics.record_request('add_label', 503, 0.5)
+        metrics.record_retry('add_label')
+        metrics.record_request('add_label', 404, 0.125)
+        metrics.record_request('add_label', None, 1.0)
+        return metrics
+
+    def test_report(self):
+        report = self.run_metrics().to_dict()
+        self.assertEqual(list(report['phases_seconds']), ['parse_reports'])
+        self.assertEqual(report['counters'], {'csv_files_parsed': 3, 'sync_mode': 'full'})
+        stats = report['endpoints']['add_label']
+        self.assertEqual({name: stats[name] for name in ('requests', 'retries', 'errors_4xx', 'errors_5xx', 'connection_errors')},
+                         {'requests': 4, 'retries': 1, 'errors_4xx': 1, 'errors_5xx': 1, 'connection_errors': 1})
+        self.assertEqual((stats['bytes_sent'], stats['bytes_received']), (40, 12))
+        self.assertEqual((stats['latency_seconds_total'], stats['latency_seconds_max']), (1.875, 1.0))
+        self.assertEqual((stats['latency_seconds_p50'], stats['latency_seconds_p99']), (0.5, 1.0))
+
+    def test_reset(self):
+        metrics = self.run_metrics()
+        metrics.reset()
+        report = metrics.to_dict()
+        self.assertEqual((report['phases_seconds'], report['counters'], report['endpoints']), ({}, {}, {}))
+
+    def test_bounded_latency_samples(self):
+        stats = EndpointStats()
+        for number in range(EndpointStats.MAX_SAMPLES * 2):
+            stats.requests += 1
+            stats.add_latency(float(number))
+        self.assertEqual(len(stats.samples), EndpointStats.MAX_SAMPLES)
+        self.assertEqual(stats.latency_max, EndpointStats.MAX_SAMPLES * 2 - 1)
+
+    def test_prometheus_textfile(self):
+        metrics = self.run_metrics()
+        with tempfile.TemporaryDirectory() as directory:
+            prometheus_file = Path(directory) / 'label_adapter.prom'
+            report_file = metrics.write_report(Path(directory), prometheus_file)
+            report = json.loads(report_file.read_text())
+            lines = prometheus_file.read_text().splitlines()
+            # Written through a temporary file that is renamed into place
+            self.assertEqual(sorted(path.name for path in Path(directory).iterdir()), ['label_adapter.prom', 'run_report.json'])
+        self.assertEqual(report_file.name, Metrics.REPORT_NAME)
+        self.assertIn(f"label_adapter_run_duration_seconds {report['duration_seconds']}", lines)
+        self.assertIn(f"label_adapter_phase_duration_seconds{{phase=\"parse_reports\"}} {report['phases_seconds']['parse_reports']}", lines)
+        self.assertIn('label_adapter_run_count{name="csv_files_parsed"} 3', lines)
+        self.assertIn('label_adapter_endpoint{endpoint="add_label",stat="errors_5xx"} 1', lines)
+        # Prometheus samples are numbers, so string counters stay in the JSON report only
+        self.assertFalse(any('sync_mode' in line for line in lines))
+        self.assertEqual(sum(line.startswith('# TYPE ') for line in lines), 5)
+
+    def test_without_prometheus_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.run_metrics().write_report(Path(directory))
+            self.assertEqual([path.name for path in Path(directory).iterdir()], ['run_report.json'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+from pathlib import Path
+import tempfile
+import unittest
+import sys
+
+LABEL_ADAPTER_DIR = Path(__file__).resolve().parent.parent / 'label_adapter'
+sys.path.insert(0, str(LABEL_ADAPTER_DIR))
+
+from helpers import Helpers
+from state_store import StateStore
+import pipeline
+
+REPORT = ('Textbox56,UNITNUMBER,DOMICILE,LASTDONE,LASTRDING,NEXTDUEMETER,TYPE,DUEPERCENT,INTERVAL,UTILIZATION,Textbox38,COMPCODE,DESCRIPTION,METERTYPE,Textbox144\n'
+          'Department DEPT - Default Department,26706,BARTO,9/25/2024,,,D,92%,60,55,5,000-003,PM Service and Inspect,DAYS,104\n'
+          'Department DEPT - Default Department,27317,BARTO,9/25/2024,,,D,127%,60,76,-16,000-003,PM Service and Inspect,DAYS,104\n')
+
+class FailingListing:
+    """A live API whose asset listing fails on the second page."""
+    do_read = True
+    do_write = True
+
+    def iter_assets(self, page_size:int=None):
+        yield 'A1', '26706'
+        raise RuntimeError('unable to retrieve assets page 2 (HTTP 500)')
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.input_dir = Path(directory.name) / 'reports'
+        self.input_dir.mkdir()
+        self.report = self.input_dir / 'AMS to BBerry Labels.csv'
+        self.report.write_text(REPORT)
+        logger = pipeline.logger
+        self.helper = Helpers(self.input_dir, Path(directory.name) / 'archive', logger, 'error', 5, 'not_test')
+        self.helper.whitelist_file = LABEL_ADAPTER_DIR / 'component_code_whitelist.txt'
+        self.addCleanup(lambda: (logger.removeHandler(self.helper.file_handler), self.helper.file_handler.close()))
+        self.state_store = StateStore(Path(directory.name) / 'label_state.sqlite3', logger)
+        self.addCleanup(self.state_store.close)
+
+    def test_failed_lookup_leaves_the_reports(self):
+        # Incremental runs look the changed assets up in the directory, which has to be listed first
+        with self.assertLogs(pipeline.logger, 'ERROR') as logs:
+            archived = pipeline.main(self.helper, FailingListing(), state_store=self.state_store, full_resync=False)
+        self.helper.discard_archive()
+        self.assertFalse(archived)
+        self.assertIn('unable to retrieve assets page 2', '\n'.join(logs.output))
+        self.assertTrue(self.report.is_file())
+        self.assertEqual(list(self.helper.archive_dir.glob('*.csv*')), [])
+        self.assertFalse(self.state_store.reports_seen({str(self.report): StateStore.hash_file(self.report)}))
+        self.assertEqual(self.state_store.load_asset_directory(), ({}, None))
+
+if __name__ == '__main__':
+    unittest.main()
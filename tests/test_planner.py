@@ -0,0 +1,39 @@
+from pathlib import Path
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from label_index import LabelIndex
+from planner import ADD, DELETE, LabelPlanner
+
+def operations(planned:list) -> list:
+    return [(operation.op, operation.label, operation.label_id) for operation in planned]
+
+class LabelPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.new_label_map = LabelIndex()
+        self.new_label_map.replace('T100', {'PM Service': '92%', 'Brake Inspection': '40%'})
+        self.planner = LabelPlanner(self.new_label_map, {'PM Service', 'Brake Inspection'})
+
+    def test_replaces_changed_labels_only(self):
+        current = {'PM Service - 90%': 'L1', 'Brake Inspection - 40%': 'L2', 'Manual tag': 'L3', 'Oil Analysis - 5%': 'L4'}
+        planned = self.planner.plan_asset('A1', 'T100', current)
+        self.assertEqual(operations(planned), [(DELETE, 'PM Service - 90%', 'L1'), (ADD, 'PM Service - 92%', None)])
+        self.assertTrue(all(operation.asset_id == 'A1' and operation.asset_identifier == 'T100' for operation in planned))
+
+    def test_adds_missing_labels_sorted(self):
+        planned = self.planner.plan_asset('A1', 'T100', {})
+        self.assertEqual(operations(planned), [(ADD, 'Brake Inspection - 40%', None), (ADD, 'PM Service - 92%', None)])
+
+    def test_up_to_date_asset(self):
+        self.assertEqual(self.planner.plan_asset('A1', 'T100', {'PM Service - 92%': 'L1', 'Brake Inspection - 40%': 'L2'}), [])
+
+    def test_asset_missing_from_reports(self):
+        # Labels from the processed reports come off, labels without a value or from other reports stay
+        current = {'PM Service - 90%': 'L1', 'PM Service': 'L2', 'Oil Analysis - 5%': 'L3'}
+        planned = self.planner.plan_asset('A2', 'T200', current)
+        self.assertEqual(operations(planned), [(DELETE, 'PM Service - 90%', 'L1')])
+
+if __name__ == '__main__':
+    unittest.main()
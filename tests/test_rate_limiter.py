@@ -0,0 +1,118 @@
+from unittest import mock
+from pathlib import Path
+import threading
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from rate_limiter import AdaptiveConcurrencyLimiter, RateLimiter, TokenBucket
+
+class FakeClock:
+    # Rates in the tests are powers of two so every wait is exact, a float clock can't creep up on a token
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds:float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('rate_limiter.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0)
+        self.assertEqual([bucket.acquire() for _ in range(100)], [0.0] * 100)
+        self.assertEqual(self.clock.slept, [])
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(4, burst=2)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.25)
+        self.assertEqual(bucket.acquire(), 0.25)
+        self.assertEqual(self.clock.now, 0.5)
+
+    def test_refills_while_idle(self):
+        bucket = TokenBucket(4)
+        for _ in range(4):
+            bucket.acquire()
+        self.clock.now += 0.5
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.25)
+
+class AdaptiveConcurrencyLimiterTest(unittest.TestCase):
+    def respond(self, limiter:AdaptiveConcurrencyLimiter, latency:float, count:int=1, throttled:bool=False) -> None:
+        for _ in range(count):
+            limiter.acquire()
+            limiter.release(throttled, latency)
+
+    def test_throttling_halves_the_limit_once_per_cooldown(self):
+        limiter = AdaptiveConcurrencyLimiter(8, decrease_cooldown=60)
+        self.respond(limiter, 0.1, 3, throttled=True)
+        self.assertEqual((limiter.limit, limiter.decreases), (4, 1))
+
+    def test_decreases_to_the_floor(self):
+        limiter = AdaptiveConcurrencyLimiter(8, min_limit=2, decrease_cooldown=0)
+        self.respond(limiter, 0.1, 10, throttled=True)
+        self.assertEqual(limiter.limit, 2)
+        # Throttled responses don't set the baseline
+        self.assertIsNone(limiter.baseline_latency)
+
+    def test_latency_spike_decreases(self):
+        limiter = AdaptiveConcurrencyLimiter(8, decrease_cooldown=0)
+        self.respond(limiter, 0.1, 10)
+        self.respond(limiter, 2.0)
+        self.assertEqual((limiter.limit, limiter.decreases), (4, 1))
+
+    def test_healthy_responses_ramp_back_up(self):
+        limiter = AdaptiveConcurrencyLimiter(8, initial_limit=1)
+        self.respond(limiter, 0.1, 100)
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(limiter.decreases, 0)
+
+    def test_recovers_when_latency_stays_up(self):
+        limiter = AdaptiveConcurrencyLimiter(8, decrease_cooldown=0)
+        self.respond(limiter, 0.1, 20)
+        # The API got slower for good: the first slow responses are spikes, then they are the new normal
+        self.respond(limiter, 2.0, 200)
+        self.assertEqual(limiter.limit, 8)
+        self.assertLess(limiter.decreases, 10)
+        self.assertGreater(limiter.baseline_latency, 2.0 / limiter.spike_factor)
+
+    def test_acquire_waits_for_a_slot(self):
+        limiter = AdaptiveConcurrencyLimiter(2)
+        limiter.acquire()
+        limiter.acquire()
+        waiting = threading.Thread(target=limiter.acquire)
+        waiting.start()
+        waiting.join(0.05)
+        self.assertTrue(waiting.is_alive())
+        limiter.release(False, 0.1)
+        waiting.join(5)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(limiter.in_flight, 2)
+
+class RateLimiterTest(unittest.TestCase):
+    def test_overload_responses_throttle(self):
+        concurrency = AdaptiveConcurrencyLimiter(8, decrease_cooldown=0)
+        limiter = RateLimiter(concurrency=concurrency)
+        for status_code in (200, 429, 503, None):
+            limiter.acquire(write_scope=False)
+            limiter.release(status_code, 0.1)
+        self.assertEqual(limiter.throttled, 1)
+        self.assertEqual(concurrency.decreases, 3)
+        self.assertEqual(concurrency.in_flight, 0)
+        self.assertIn('1 throttled response(s)', str(limiter))
+
+if __name__ == '__main__':
+    unittest.main()
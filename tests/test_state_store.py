@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+import tempfile
+import unittest
+import logging
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from label_index import LabelIndex
+from state_store import StateStore
+
+logger = logging.getLogger('label_adapter.tests')
+
+LABEL_BASES = {'PM Service', 'Oil Change'}
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_file = Path(directory.name) / 'state' / 'label_state.sqlite3'
+
+    def open(self) -> StateStore:
+        state_store = StateStore(self.db_file, logger)
+        self.addCleanup(state_store.conn.close)
+        return state_store
+
+    def test_applied_labels_survive_a_restart(self):
+        state_store = self.open()
+        state_store.record_asset('100', LABEL_BASES, {'PM Service': '92%', 'Oil Change': '40%'})
+        state_store.record_asset('101', LABEL_BASES, {'PM Service': '50%'})
+        state_store.close()
+        applied = self.open().get_applied_labels(LABEL_BASES)
+        self.assertEqual(dict(applied.items()), {'100': {'PM Service': '92%', 'Oil Change': '40%'}, '101': {'PM Service': '50%'}})
+
+    def test_record_asset_only_replaces_the_processed_label_bases(self):
+        state_store = self.open()
+        state_store.record_asset('100', LABEL_BASES, {'PM Service': '92%', 'Oil Change': '40%'})
+        state_store.record_asset('100', {'PM Service'}, {'PM Service': '95%'})
+        self.assertEqual(state_store.get_applied_labels(LABEL_BASES)['100'], {'PM Service': '95%', 'Oil Change': '40%'})
+        self.assertEqual(state_store.get_applied_labels({'PM Service'})['100'], {'PM Service': '95%'})
+
+    def test_changed_assets(self):
+        state_store = self.open()
+        state_store.record_asset('100', LABEL_BASES, {'PM Service': '92%'})
+        state_store.record_asset('101', LABEL_BASES, {'PM Service': '50%'})
+        state_store.record_asset('102', LABEL_BASES, {'PM Service': '70%'})
+        new_label_map = LabelIndex()
+        # Unchanged, changed, and new; 102 dropped out of the reports
+        new_label_map.replace('100', {'PM Service': '92%'})
+        new_label_map.replace('101', {'PM Service': '55%'})
+        new_label_map.replace('103', {'PM Service': '10%'})
+        self.assertEqual(state_store.changed_assets(new_label_map, LABEL_BASES), {'101', '102', '103'})
+
+    def test_changed_assets_matches_unnormalized_identifiers(self):
+        state_store = self.open()
+        # Written before identifiers were normalized
+        state_store.record_asset('026706', LABEL_BASES, {'PM Service': '92%'})
+        new_label_map = LabelIndex()
+        new_label_map.replace('26706', {'PM Service': '92%'})
+        self.assertEqual(state_store.changed_assets(new_label_map, LABEL_BASES), set())
+
+    def test_full_resync_due(self):
+        state_store = self.open()
+        self.assertTrue(state_store.full_resync_due(24))
+        state_store.mark_full_resync()
+        self.assertFalse(state_store.full_resync_due(24))
+        self.assertTrue(state_store.full_resync_due(0))
+        yesterday = (datetime.now() - timedelta(hours=25)).isoformat(timespec='seconds')
+        state_store.conn.execute("UPDATE meta SET value = ? WHERE key = 'last_full_resync'", (yesterday,))
+        self.assertTrue(state_store.full_resync_due(24))
+        self.assertFalse(state_store.full_resync_due(48))
+
+    def test_reports_seen(self):
+        state_store = self.open()
+        self.assertFalse(state_store.reports_seen({}))
+        state_store.record_reports({'reports/a.csv': 'aaa'})
+        self.assertTrue(state_store.reports_seen({'a.csv': 'aaa'}))
+        self.assertFalse(state_store.reports_seen({'a.csv': 'aaa', 'b.csv': 'bbb'}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from pathlib import Path
+import itertools
+import threading
+import unittest
+import logging
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from label_index import LabelIndex
+from sync import LabelSyncEngine
+
+logger = logging.getLogger('label_adapter.tests')
+
+class FakeRadar:
+    """Radar's label endpoints in memory: asset id -> {label: label id}."""
+    bulk_endpoint = None
+
+    def __init__(self, labels:dict, broken:set=frozenset(), rejected:set=frozenset()):
+        self.labels = {asset_id: dict(asset_labels) for asset_id, asset_labels in labels.items()}
+        # Assets whose label fetch fails, and labels the API refuses to add
+        self.broken = broken
+        self.rejected = rejected
+        self.ids = itertools.count(1000)
+        self.lock = threading.Lock()
+
+    def get_asset_labels(self, asset_id):
+        if asset_id in self.broken:
+            raise ConnectionError('connection reset by peer')
+        with self.lock:
+            return dict(self.labels[asset_id])
+
+    def add_label(self, asset_id, label):
+        if label in self.rejected:
+            return False
+        with self.lock:
+            if label in self.labels[asset_id]:
+                return None
+            self.labels[asset_id][label] = f'L{next(self.ids)}'
+            return True
+
+    def delete_label(self, asset_id, label_id):
+        with self.lock:
+            asset_labels = self.labels[asset_id]
+            for label, current_id in asset_labels.items():
+                if current_id == label_id:
+                    del asset_labels[label]
+                    return True
+            return None
+
+    def label_names(self) -> dict:
+        return {asset_id: set(asset_labels) for asset_id, asset_labels in self.labels.items()}
+
+class LabelSyncEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.new_label_map = LabelIndex()
+        self.remote = {}
+        self.assets = []
+        for number in range(10):
+            identifier = str(100 + number)
+            self.new_label_map.replace(identifier, {'PM Service': f'{90 + number}%'})
+            asset_id = f'A{number}'
+            self.assets.append((asset_id, identifier))
+            self.remote[asset_id] = {'PM Service - 80%': f'{asset_id}-pm', 'Manual tag': f'{asset_id}-tag'}
+        # Already up to date
+        self.remote['A5'] = {'PM Service - 95%': 'A5-pm'}
+        # In Radar but no longer in the reports
+        self.assets.append(('A99', '999'))
+        self.remote['A99'] = {'PM Service - 50%': 'A99-pm'}
+
+    def run_engine(self, radar:FakeRadar, concurrency:int=1, **kwargs):
+        engine = LabelSyncEngine(radar, logger, self.new_label_map, {'PM Service'}, concurrency, **kwargs)
+        with self.assertLogs(logger) as logs:
+            summary = engine.run(iter(self.assets))
+        return engine, summary, logs.output
+
+    def test_summary_counts(self):
+        radar = FakeRadar(self.remote)
+        _, summary, _ = self.run_engine(radar)
+        self.assertEqual(summary.to_dict(), {'assets_synced': 11, 'assets_failed': 0, 'assets_skipped': 0,
+                                             'labels_added': 9, 'labels_deleted': 10, 'labels_failed': 0})
+        self.assertEqual(radar.label_names()['A0'], {'PM Service - 90%', 'Manual tag'})
+        self.assertEqual(radar.label_names()['A99'], set())
+
+    def test_one_failing_asset_does_not_stop_the_others(self):
+        radar = FakeRadar(self.remote, broken={'A7'})
+        _, summary, logs = self.run_engine(radar, concurrency=4)
+        self.assertEqual((summary.assets_synced, summary.assets_failed), (10, 1))
+        self.assertTrue(any('asset 107 (A7)' in line and 'connection reset' in line for line in logs))
+        self.assertEqual(radar.label_names()['A7'], {'PM Service - 80%', 'Manual tag'})
+        self.assertEqual(radar.label_names()['A9'], {'PM Service - 99%', 'Manual tag'})
+
+    def test_failed_writes_are_counted(self):
+        radar = FakeRadar(self.remote, rejected={'PM Service - 92%'})
+        _, summary, _ = self.run_engine(radar)
+        self.assertEqual((summary.labels_added, summary.labels_failed), (8, 1))
+
+    def test_asset_filter_skips_unchanged_assets(self):
+        radar = FakeRadar(self.remote)
+        _, summary, _ = self.run_engine(radar, asset_filter={'100', '101'})
+        self.assertEqual((summary.assets_synced, summary.assets_skipped), (2, 9))
+        self.assertEqual(radar.label_names()['A2'], {'PM Service - 80%', 'Manual tag'})
+
+    def test_dry_run_writes_nothing(self):
+        radar = FakeRadar(self.remote)
+        engine, summary, _ = self.run_engine(radar, dry_run=True)
+        self.assertEqual(radar.label_names(), FakeRadar(self.remote).label_names())
+        self.assertEqual((engine.plan.count('add'), engine.plan.count('delete')), (9, 10))
+        self.assertEqual(summary.labels_added, 0)
+
+    def test_concurrency_gives_the_same_result(self):
+        serial = FakeRadar(self.remote, broken={'A3'})
+        serial_engine, serial_summary, _ = self.run_engine(serial, concurrency=1)
+        parallel = FakeRadar(self.remote, broken={'A3'})
+        parallel_engine, parallel_summary, _ = self.run_engine(parallel, concurrency=8)
+        self.assertEqual(parallel_summary.to_dict(), serial_summary.to_dict())
+        self.assertEqual(parallel.label_names(), serial.label_names())
+        self.assertEqual(parallel_engine.plan.to_json(), serial_engine.plan.to_json())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+from unittest import mock
+from pathlib import Path
+import threading
+import unittest
+import logging
+import time
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from token_manager import TokenManager
+
+logger = logging.getLogger('label_adapter.tests')
+
+class FakeTokenEndpoint:
+    """Hands out numbered tokens per scope and counts the calls."""
+
+    def __init__(self, expires_in=600, delay:float=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = {'read': 0, 'write': 0}
+        self.lock = threading.Lock()
+
+    def __call__(self, write_scope:bool) -> dict:
+        scope = 'write' if write_scope else 'read'
+        # Slow enough for concurrent callers to pile up behind the scope lock
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls[scope] += 1
+            return {'access_token': f'{scope}-{self.calls[scope]}', 'expires_in': self.expires_in}
+
+class TokenManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('token_manager.time', SimpleNamespace(monotonic=lambda: self.now, time=time.time))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def manager(self, endpoint) -> TokenManager:
+        return TokenManager(Path('unused.pem'), logger, endpoint)
+
+    def test_tokens_are_cached_per_scope(self):
+        endpoint = FakeTokenEndpoint()
+        tokens = self.manager(endpoint)
+        self.assertEqual([tokens.get_token(False) for _ in range(3)], ['read-1'] * 3)
+        self.assertEqual([tokens.get_token(True) for _ in range(3)], ['write-1'] * 3)
+        # Fetching the write token didn't evict the read token
+        self.assertEqual(tokens.get_token(False), 'read-1')
+        self.assertEqual(endpoint.calls, {'read': 1, 'write': 1})
+
+    def test_refreshes_within_the_margin_before_expiry(self):
+        endpoint = FakeTokenEndpoint(expires_in=600)
+        tokens = self.manager(endpoint)
+        tokens.get_token()
+        self.now += 539
+        self.assertEqual(tokens.get_token(), 'read-1')
+        self.now += 1
+        self.assertEqual(tokens.get_token(), 'read-2')
+
+    def test_default_ttl_without_expires_in(self):
+        endpoint = FakeTokenEndpoint(expires_in=None)
+        tokens = self.manager(endpoint)
+        tokens.get_token()
+        self.now += TokenManager.DEFAULT_TTL - 61
+        self.assertEqual(tokens.get_token(), 'read-1')
+        self.now += TokenManager.DEFAULT_TTL
+        self.assertEqual(tokens.get_token(), 'read-2')
+
+    def test_failed_fetch_is_not_cached(self):
+        responses = [None, {'access_token': ''}, {'access_token': 'read-1'}]
+        tokens = self.manager(lambda write_scope: responses.pop(0))
+        self.assertIsNone(tokens.get_token())
+        self.assertIsNone(tokens.get_token())
+        self.assertEqual(tokens.get_token(), 'read-1')
+
+    def test_invalidate_only_drops_the_rejected_token(self):
+        endpoint = FakeTokenEndpoint()
+        tokens = self.manager(endpoint)
+        tokens.get_token(False)
+        tokens.get_token(True)
+        # Another worker already replaced the token this one was rejected with
+        tokens.invalidate(False, 'read-0')
+        self.assertEqual(tokens.get_token(False), 'read-1')
+        tokens.invalidate(False, 'read-1')
+        self.assertEqual(tokens.get_token(False), 'read-2')
+        self.assertEqual(tokens.get_token(True), 'write-1')
+
+    def test_concurrent_callers_share_one_refresh(self):
+        endpoint = FakeTokenEndpoint(delay=0.05)
+        tokens = self.manager(endpoint)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(tokens.get_token(True))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['write-1'] * 8)
+        self.assertEqual(endpoint.calls, {'read': 0, 'write': 1})
+
+if __name__ == '__main__':
+    unittest.main()
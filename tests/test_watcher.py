@@ -0,0 +1,116 @@
+from unittest import mock
+from pathlib import Path
+import itertools
+import threading
+import tempfile
+import unittest
+import logging
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'label_adapter'))
+
+from watcher import DirectoryWatcher
+
+logger = logging.getLogger('label_adapter.tests')
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds:float) -> None:
+        self.now += seconds
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.stop_event = threading.Event()
+
+    def watcher(self, **kwargs) -> DirectoryWatcher:
+        watcher = DirectoryWatcher(self.directory, logger, **kwargs)
+        self.addCleanup(watcher.close)
+        return watcher
+
+class DebounceTest(WatcherTest):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('watcher.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def script(self, watcher:DirectoryWatcher, events) -> list:
+        """Replaces the change source: each check uses up its timeout and reports whether reports arrived."""
+        events = iter(events)
+        timeouts = []
+        def changes(timeout, stop_event):
+            timeouts.append(timeout)
+            self.clock.now += timeout
+            return next(events)
+        watcher.changes = changes
+        return timeouts
+
+    def test_waits_for_the_burst_to_settle(self):
+        watcher = self.watcher(debounce=5, poll_interval=10)
+        timeouts = self.script(watcher, [False, True, True, True, False])
+        self.assertTrue(watcher.wait_for_reports(self.stop_event))
+        self.assertEqual(timeouts, [10, 10, 5, 5, 5])
+        self.assertEqual(self.clock.now, 35)
+
+    def test_steady_trickle_is_capped_by_max_wait(self):
+        watcher = self.watcher(debounce=5, poll_interval=10, max_wait=12)
+        timeouts = self.script(watcher, itertools.repeat(True))
+        self.assertTrue(watcher.wait_for_reports(self.stop_event))
+        self.assertEqual(timeouts, [10, 5, 5, 5])
+
+    def test_max_wait_is_at_least_the_debounce(self):
+        self.assertEqual(self.watcher(debounce=5, max_wait=1).max_wait, 5)
+
+    def test_stop_while_debouncing(self):
+        watcher = self.watcher(debounce=5, poll_interval=10)
+        def events():
+            yield True
+            self.stop_event.set()
+            yield True
+        self.script(watcher, events())
+        self.assertFalse(watcher.wait_for_reports(self.stop_event))
+
+    def test_stop_while_idle(self):
+        self.stop_event.set()
+        self.assertFalse(self.watcher().wait_for_reports(self.stop_event))
+
+class ChangeDetectionTest(WatcherTest):
+    def test_polling_fallback(self):
+        (self.directory / 'old.csv').write_text('a')
+        watcher = self.watcher()
+        watcher.close()
+        # A stopped event skips the sleep and just compares snapshots
+        self.stop_event.set()
+        self.assertFalse(watcher.changes(10, self.stop_event))
+        (self.directory / 'new.CSV').write_text('a')
+        self.assertTrue(watcher.changes(10, self.stop_event))
+        self.assertFalse(watcher.changes(10, self.stop_event))
+        (self.directory / 'old.csv').write_text('ab')
+        self.assertTrue(watcher.changes(10, self.stop_event))
+        # Our own archiving removes reports, and other files don't matter
+        (self.directory / 'old.csv').unlink()
+        (self.directory / 'notes.txt').write_text('a')
+        self.assertFalse(watcher.changes(10, self.stop_event))
+
+    def test_inotify(self):
+        watcher = self.watcher()
+        if watcher.inotify is None:
+            self.skipTest('inotify is not available')
+        (self.directory / 'notes.txt').write_text('a')
+        self.assertFalse(watcher.changes(0.2, self.stop_event))
+        (self.directory / 'report.csv').write_text('a')
+        self.assertTrue(watcher.changes(5, self.stop_event))
+        self.stop_event.set()
+        self.assertFalse(watcher.changes(5, self.stop_event))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+from pathlib import Path
+import unittest
+import sys
+
+LABEL_ADAPTER_DIR = Path(__file__).resolve().parent.parent / 'label_adapter'
+sys.path.insert(0, str(LABEL_ADAPTER_DIR))
+
+from whitelist import ComponentCodeWhitelist
+
+class ComponentCodeWhitelistTest(unittest.TestCase):
+    def test_codes_are_normalized(self):
+        whitelist = ComponentCodeWhitelist(['000-003\n', '  PM-A  \n'])
+        self.assertIn('000-003', whitelist)
+        self.assertIn(' 000-003 ', whitelist)
+        self.assertIn('pm-a', whitelist)
+        self.assertIn('Pm-A', whitelist)
+        self.assertNotIn('000-004', whitelist)
+
+    def test_comments_and_blank_lines_are_ignored(self):
+        whitelist = ComponentCodeWhitelist(['# PM codes\n', '\n', '   \n', '000-003\n'])
+        self.assertEqual(len(whitelist), 1)
+        self.assertNotIn('# pm codes', whitelist)
+        self.assertNotIn('', whitelist)
+
+    def test_wildcards(self):
+        whitelist = ComponentCodeWhitelist(['000-0*', 'OIL-??', 'TIRE-[AB]', '100-001'])
+        self.assertEqual(len(whitelist), 4)
+        self.assertEqual(whitelist.codes, {'100-001'})
+        self.assertEqual([code in whitelist for code in ('000-003', '000-099', '001-003')], [True, True, False])
+        self.assertEqual([code in whitelist for code in ('oil-12', 'OIL-12', 'oil-123')], [True, True, False])
+        self.assertEqual([code in whitelist for code in ('tire-a', 'TIRE-B', 'tire-c')], [True, True, False])
+        self.assertIn('100-001', whitelist)
+
+    def test_without_wildcards(self):
+        whitelist = ComponentCodeWhitelist(['000-003'])
+        self.assertIsNone(whitelist.matcher)
+        self.assertNotIn('000-00*', whitelist)
+
+    def test_shipped_whitelist(self):
+        whitelist = ComponentCodeWhitelist.from_file(LABEL_ADAPTER_DIR / 'component_code_whitelist.txt')
+        self.assertGreater(len(whitelist), 0)
+        self.assertIn('000-003', whitelist)
+
+if __name__ == '__main__':
+    unittest.main()